@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Reproduzierbare Laufzeit- und Genauigkeitsmessung der heißen Pfade
+von pertbeta.betadist, der Summenzeile (MultiEstimate) und der Webseite.
+
+Genauigkeit wird gegen mpmath (falls installiert) gemessen, sonst gegen
+math.lgamma und eine eng tolerierte Gauss-Kronrod-Quadratur.
+
+    python betabench.py run [-o result.json] [--quick] [--only beta_cdf]
+    python betabench.py compare base.json result.json [--slower 1.25]
+"""
+
+#---
+#--- Python
+import os
+import sys
+import imp
+import gc
+import csv
+import json
+import math
+import time
+import timeit
+import random
+import platform
+import tempfile
+import argparse
+
+try :
+    import mpmath
+except ImportError :
+    mpmath = None
+
+#--- .
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from pertbeta import betadist
+from pertbeta.betadist import BetaDistribution
+from pertbeta import convolution
+
+#---
+BENCH_VERSION = 1
+MIN_SECONDS = 0.2        # per timing run, number of calls is calibrated
+REPEAT = 5               # timing runs, the fastest counts
+QUICK_SECONDS = 0.02
+QUICK_REPEAT = 2
+SLOWER_FACTOR = 1.25     # compare: flag calls that got slower than this
+ERROR_FACTOR = 10.0      # compare: flag errors that grew more than this
+ERROR_FLOOR = 1e-13      # compare: errors below this never count
+
+# name -> (a, b, alpha, beta)
+SHAPES = [("symmetric", 0.0, 10.0, 4.0, 4.0),
+          ("skewed", 3.0, 20.0, 0.8, 3.2),        # alpha < 1: pdf infinite at a
+          ("pertLeft", 0.0, 10.0) + betadist.alphaBetaFromAmB(0.0, 0.0, 10.0),
+          ("uShaped", 0.0, 1.0, 0.5, 0.5),
+          ("narrow", 1000.0, 1000.001, 2.5, 1.6),
+          ("wide", 0.0, 1.0e6, 1.8, 4.5),
+          ]
+POINTS = 9               # interior x per shape for pdf and cdf
+CONFS = (0.001, 0.05, 0.2, 0.5, 0.8, 0.95, 0.999)
+GAMMA_ARGS = (0.3, 0.8, 1.5, 4.0, 10.0, 33.3, 120.0)
+HISTOGRAM_BUCKETS = 50
+FOOTER_ESTIMATES = 1000
+
+#---
+def interiorPoints(a, b, n = POINTS) :
+    return [a + (b - a) * (i + 0.5) / n for i in xrange(n)]
+
+def referenceGamma(x) :
+    if mpmath is not None :
+        return float(mpmath.gamma(x))
+    return math.exp(math.lgamma(x))
+
+def referencePdf(x, alpha, beta, a, b) :
+    if mpmath is not None :
+        with mpmath.workdps(40) :
+            u = (mpmath.mpf(x) - a) / (mpmath.mpf(b) - a)
+            return float(u ** (alpha - 1) * (1 - u) ** (beta - 1) / mpmath.beta(alpha, beta) / (mpmath.mpf(b) - a))
+    u = (x - a) / float(b - a)
+    lbeta = math.lgamma(alpha) + math.lgamma(beta) - math.lgamma(alpha + beta)
+    return math.exp((alpha - 1) * math.log(u) + (beta - 1) * math.log1p(-u) - lbeta) / (b - a)
+
+def referenceCdf(x, alpha, beta, a, b) :
+    if mpmath is not None :
+        with mpmath.workdps(40) :
+            u = (mpmath.mpf(x) - a) / (mpmath.mpf(b) - a)
+            return float(mpmath.betainc(alpha, beta, 0, u, regularized = True))
+    u = (x - a) / float(b - a)
+    lbeta = math.lgamma(alpha) + math.lgamma(beta) - math.lgamma(alpha + beta)
+    # substitute t = s**k to remove the singularity of the density at 0
+    k = max(1.0, 2.0 / alpha)
+    f = lambda s : k * math.exp((k * alpha - 1.0) * math.log(s) + (beta - 1.0) * math.log1p(-s ** k) - lbeta) if s > 0 else 0.0
+    lower = u <= 0.5
+    if not lower :
+        (alpha, beta) = (beta, alpha)
+        k = max(1.0, 2.0 / alpha)
+        u = 1.0 - u
+    (value, error) = betadist.INTEGRAL_GK(f, 0.0, u ** (1.0 / k), abstol = 1e-15, reltol = 1e-14)
+    return value if lower else 1.0 - value
+
+def errors(pairs) :
+    """@rtype: C{dict} largest absolute and relative error of (value, reference) pairs"""
+    absError = max([abs(v - ref) for (v, ref) in pairs] or [0.0])
+    relError = max([abs(v - ref) / abs(ref) for (v, ref) in pairs if ref] or [0.0])
+    return {"maxAbsError" : absError, "maxRelError" : relError}
+
+def timeCall(func, minSeconds = MIN_SECONDS, repeat = REPEAT) :
+    """seconds per call of func(), the fastest of repeat calibrated runs"""
+    timer = timeit.Timer(func)
+    number = 1
+    while True :
+        elapsed = timer.timeit(number)
+        if elapsed >= minSeconds or number >= 1 << 24 :
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(1.2 * minSeconds / elapsed))
+    best = elapsed / number
+    for i in xrange(repeat - 1) :
+        best = min(best, timer.timeit(number) / number)
+    return best
+
+def loadWebExample() :
+    path = os.path.join(HERE, '..', 'examples', 'pertBeta.web.py')
+    return imp.load_source('pertBeta_web', path)
+
+def writeEstimatesCsv(path, n, seed = 1) :
+    rng = random.Random(seed)
+    with open(path, 'wb') as f :
+        writer = csv.writer(f, delimiter = ';', quotechar = '|')
+        writer.writerow(["opt", "likly", "pess", "ident"])
+        for i in xrange(n) :
+            a = rng.randint(1, 20)
+            m = a + rng.randint(0, 10)
+            b = m + rng.randint(1, 30)
+            writer.writerow([a, m, b, "task%i" % (i,)])
+
+
+#---
+def iterCases() :
+    """
+    (name, func, accuracy) per benchmark; func runs the timed work and
+    accuracy() returns the error dict or None.
+    """
+    def case(name, func, accuracy = None) :
+        return (name, func, accuracy)
+
+    def gammaAccuracy() :
+        return errors([(betadist.gamma(x), referenceGamma(x)) for x in GAMMA_ARGS])
+    yield case("gamma", lambda : [betadist.gamma(x) for x in GAMMA_ARGS], gammaAccuracy)
+
+    for (shape, a, b, alpha, beta) in SHAPES :
+        xs = interiorPoints(a, b)
+
+        def pdfRun(xs = xs, a = a, b = b, alpha = alpha, beta = beta) :
+            return [betadist.beta_pdf(x, alpha, beta, a, b) for x in xs]
+        def pdfAccuracy(xs = xs, a = a, b = b, alpha = alpha, beta = beta) :
+            return errors([(betadist.beta_pdf(x, alpha, beta, a, b), referencePdf(x, alpha, beta, a, b)) for x in xs])
+        yield case("beta_pdf/" + shape, pdfRun, pdfAccuracy)
+
+        for (method, suffix) in ((betadist.CDF_INCBETA, ""), (betadist.CDF_QUADRATURE, ":quadrature")) :
+            def cdfRun(xs = xs, a = a, b = b, alpha = alpha, beta = beta, method = method) :
+                return [betadist.beta_cdf(x, alpha, beta, a, b, method = method) for x in xs]
+            def cdfAccuracy(xs = xs, a = a, b = b, alpha = alpha, beta = beta, method = method) :
+                return errors([(betadist.beta_cdf(x, alpha, beta, a, b, method = method),
+                                referenceCdf(x, alpha, beta, a, b)) for x in xs])
+            yield case("beta_cdf%s/%s" % (suffix, shape), cdfRun, cdfAccuracy)
+
+        def invRun(a = a, b = b, alpha = alpha, beta = beta) :
+            return [betadist.beta_inv(conf, alpha, beta, a, b) for conf in CONFS]
+        def invAccuracy(a = a, b = b, alpha = alpha, beta = beta) :
+            # residual of the quantile in probability
+            return errors([(referenceCdf(betadist.beta_inv(conf, alpha, beta, a, b), alpha, beta, a, b), conf)
+                           for conf in CONFS])
+        yield case("beta_inv/" + shape, invRun, invAccuracy)
+
+        width = (b - a) / HISTOGRAM_BUCKETS
+        def histogramRun(a = a, b = b, alpha = alpha, beta = beta, width = width) :
+            # a fresh distribution, the histogram is memoized per instance
+            return list(BetaDistribution(a, b, alpha, beta).iterPDFasHistogram(width = width))
+        def histogramAccuracy(a = a, b = b, alpha = alpha, beta = beta, width = width) :
+            buckets = BetaDistribution(a, b, alpha, beta).histogram(width = width)
+            return errors([(prop, referenceCdf(hi, alpha, beta, a, b) - referenceCdf(lo, alpha, beta, a, b))
+                           for (lo, hi, prop) in buckets])
+        yield case("iterPDFasHistogram/" + shape, histogramRun, histogramAccuracy)
+
+    web = loadWebExample()
+    rng = random.Random(1)
+    me = web.MultiEstimate()
+    for i in xrange(FOOTER_ESTIMATES) :
+        a = rng.uniform(1.0, 20.0)
+        m = a + rng.uniform(0.0, 10.0)
+        me.AppendEstimate("task%i" % (i,), BetaDistribution.FromAmB(a, m, m + rng.uniform(1.0, 30.0)))
+    yield case("MultiEstimate.getFooterFields/%i" % (FOOTER_ESTIMATES,), me.getFooterFields)
+    if convolution.numpy is not None :
+        yield case("MultiEstimate.convolve/%i" % (FOOTER_ESTIMATES,), me.convolve)
+        index = me.cdfIndex()
+        deadlines = [index.percentile(conf) for conf in CONFS]
+        def cdfIndexRun(index = index, deadlines = deadlines) :
+            return ([index.probability(x) for x in deadlines], [index.percentile(conf) for conf in CONFS])
+        def cdfIndexAccuracy(index = index, deadlines = deadlines) :
+            # round trip of the inverse query
+            return errors([(index.probability(x), conf) for (x, conf) in zip(deadlines, CONFS)])
+        yield case("CdfIndex.query", cdfIndexRun, cdfIndexAccuracy)
+
+    yield case("renderPage/REST", lambda : web.renderPage('GET', '/3/7/20', None))
+    csvPath = os.path.join(tempfile.gettempdir(), "betabench_estimates.csv")
+    writeEstimatesCsv(csvPath, 200)
+    yield case("renderPage/CSV200", lambda : web.renderPage('GET', '/', csvPath))
+
+def runBenchmarks(only = None, quick = False, log = sys.stderr) :
+    """@rtype: C{dict} the JSON document"""
+    minSeconds = QUICK_SECONDS if quick else MIN_SECONDS
+    repeat = QUICK_REPEAT if quick else REPEAT
+    results = {}
+    for (name, func, accuracy) in iterCases() :
+        if only and not any(pattern in name for pattern in only) :
+            continue
+        gc.collect()
+        entry = {"seconds" : timeCall(func, minSeconds, repeat)}
+        if accuracy is not None :
+            entry.update(accuracy())
+        results[name] = entry
+        accuracyText = ""
+        if "maxAbsError" in entry :
+            accuracyText = "abs %(maxAbsError).1e rel %(maxRelError).1e" % entry
+        log.write("%-45s %12.3f us %s\n" % (name, 1e6 * entry["seconds"], accuracyText))
+    return {"version" : BENCH_VERSION,
+            "created" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "reference" : "mpmath %s" % (mpmath.__version__,) if mpmath is not None else "quadrature",
+            "quick" : quick,
+            "results" : results,
+            }
+
+def compareResults(base, new, slower = SLOWER_FACTOR, errorFactor = ERROR_FACTOR) :
+    """
+    Lines for every benchmark of both runs and the number of regressions:
+    slower by more than the factor slower, or an error that grew more
+    than errorFactor (and above L{ERROR_FLOOR}).
+
+    Doctests::
+        >>> base = {"results" : {"f" : {"seconds" : 1e-6, "maxAbsError" : 1e-15}}}
+        >>> new = {"results" : {"f" : {"seconds" : 2e-6, "maxAbsError" : 1e-9}}}
+        >>> (lines, regressions) = compareResults(base, new)
+        >>> regressions
+        2
+    """
+    lines = []
+    regressions = 0
+    for name in sorted(set(base["results"]) | set(new["results"])) :
+        old = base["results"].get(name)
+        cur = new["results"].get(name)
+        if old is None or cur is None :
+            lines.append("%-45s %s" % (name, "only in base" if cur is None else "new"))
+            continue
+        ratio = cur["seconds"] / old["seconds"]
+        flags = []
+        if ratio > slower :
+            flags.append("SLOWER")
+        for key in ("maxAbsError", "maxRelError") :
+            if key in old and key in cur and cur[key] > ERROR_FLOOR and cur[key] > errorFactor * max(old[key], ERROR_FLOOR) :
+                flags.append("LESS ACCURATE (%s %.1e -> %.1e)" % (key, old[key], cur[key]))
+        regressions += len(flags)
+        lines.append("%-45s %10.3f us %10.3f us %6.2fx %s" % (name, 1e6 * old["seconds"], 1e6 * cur["seconds"],
+                                                              ratio, " ".join(flags)))
+    return (lines, regressions)
+
+def parseArguments(argv) :
+    parser = argparse.ArgumentParser(description = "pertbeta benchmarks")
+    commands = parser.add_subparsers(dest = 'command')
+    run = commands.add_parser('run', help = "time and check accuracy")
+    run.add_argument('-o', '--output', help = "write the results as JSON")
+    run.add_argument('--quick', action = 'store_true', help = "short timing runs")
+    run.add_argument('--only', action = 'append', help = "benchmarks containing this text")
+    compare = commands.add_parser('compare', help = "flag regressions between two runs")
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--slower', type = float, default = SLOWER_FACTOR)
+    compare.add_argument('--error-factor', type = float, default = ERROR_FACTOR, dest = 'errorFactor')
+    return parser.parse_args(argv)
+
+def main(argv) :
+    args = parseArguments(argv)
+    if args.command == 'run' :
+        document = runBenchmarks(only = args.only, quick = args.quick)
+        if args.output :
+            with open(args.output, 'wb') as f :
+                json.dump(document, f, indent = 1, sort_keys = True)
+        return 0
+    with open(args.base, 'rb') as f :
+        base = json.load(f)
+    with open(args.new, 'rb') as f :
+        new = json.load(f)
+    (lines, regressions) = compareResults(base, new, args.slower, args.errorFactor)
+    for line in lines :
+        print line
+    print "%i regression(s)" % (regressions,)
+    return 1 if regressions else 0
+
+if __name__ == "__main__" :
+    sys.exit(main(sys.argv[1:]))
@@ -13,6 +13,18 @@ import os
 import sys
 import socket
 import csv
+import json
+import StringIO
+import signal
+import threading
+import webbrowser
+import multiprocessing
+import argparse
+import hashlib
+import urlparse
+import cProfile
+import pstats
+import timeit
 
 #--- beta
 import random
@@ -25,13 +37,26 @@ sys.path.append(os.path.join(os.getcwd(), '..'))
 from pertbeta.betadist import BetaDistribution
 from pertbeta.betadist import MAX_DOTS
 from pertbeta import betadist
+from pertbeta import simulation
+from pertbeta import streamstats
+from pertbeta import parallel
+from pertbeta import incremental
+from pertbeta import columns
+from pertbeta import convolution
+from pertbeta import diskcache
+from pertbeta import binfmt
+from pertbeta import cdfindex
+from pertbeta import ingest
+from pertbeta.lrucache import LRUCache
+from pertbeta import metrics
 
 #--- webserver
 import BaseHTTPServer
+import SocketServer
 
 #---
 def generateValues(dist, N) :
-    values = [dist.random() for i in xrange(0, N)]
+    values = list(dist.sample(N))
     return values
 
 def makeBuckets(values, f) :
@@ -64,18 +89,17 @@ def iterHistogram(buckets, maxDots = MAX_DOTS) :
         yield line
 
 def statValues(values) :
-    count = float(len(values))
-    mean = sum(values) / count
-    var = sum([(v - mean) ** 2 for v in values]) / count
-    return mean, var
+    moments = streamstats.Moments()
+    moments.update(values)
+    return moments.mean(), moments.variance()
 
 def statValues2(values, confidence) :
-    sortedValues = sorted(values)
-    count = float(len(values))
-    q25 = sortedValues[round(0.25 * count)]
-    q50 = sortedValues[round(0.50 * count)]
-    q75 = sortedValues[round(0.75 * count)]
-    qConf = sortedValues[round(confidence * count)]
+    sketch = streamstats.QuantileSketch()
+    sketch.update(values)
+    q25 = sketch.quantile(0.25)
+    q50 = sketch.quantile(0.50)
+    q75 = sketch.quantile(0.75)
+    qConf = sketch.quantile(confidence)
     return q25, q50, q75, qConf
 
 def iter_properties(dist, a, m, b, alpha, beta) :
@@ -166,8 +190,10 @@ def iterBlogLink() :
 
 def iterUsage():
     yield '<pre>USAGE:<br>'
-    yield 'python.exe pertBeta.web.py<br>'
+    yield 'python.exe pertBeta.web.py [--port 8000] [--workers N] [--timeout 30] [--open] [--metrics] [--cache PATH]<br>'
     #yield 'python.exe pertBeta.web.py pertExample.csv<br>'
+    yield 'POST /batch {"estimates" : [[O, N, P], ...]} returns JSON lines<br>'
+    yield 'GET /cdf?x=120&amp;q=0.9 returns P(total &lt;= x) and the q-quantile of the input file<br>'
     yield '</pre>'
     for line in iterBlogLink() :
         yield line
@@ -275,10 +301,133 @@ def write_CSV_lines(fout, inputCsv, heading) :
 
 class MultiEstimate(object) :
     def __init__(self) :
-        self._estimates = {} # ident -> dist
+        self._estimates = columns.EstimateColumns() # ident -> dist, column-wise
+        self._incremental = None
+        self._version = 0                           # counts changes, invalidates the CDF index
+        self._cdfIndex = None                       # (key, cdfindex.CdfIndex)
 
     def AppendEstimate(self, ident, dist):
-        self._estimates[ident] = dist
+        """adds the estimate ident, or replaces it"""
+        self._estimates.put(ident, dist)
+        self._version += 1
+        if self._incremental is not None :
+            self._incremental.setEstimate(ident, dist)
+
+    def RemoveEstimate(self, ident) :
+        """@raise KeyError: unknown ident"""
+        self._estimates.remove(ident)
+        self._version += 1
+        if self._incremental is not None :
+            self._incremental.removeEstimate(ident)
+
+    def simulateIncremental(self, N = simulation.SIMULATION_SAMPLES, seed = 0) :
+        """
+        Simulation state that follows later AppendEstimate/RemoveEstimate
+        calls in O(N) per change, with common random numbers per ident.
+
+        Doctests::
+            >>> me = MultiEstimate()
+            >>> me.AppendEstimate("design", BetaDistribution.FromAmB(3, 5, 12))
+            >>> state = me.simulateIncremental(N = 5000, seed = 1)
+            >>> me.AppendEstimate("build", BetaDistribution.FromAmB(5, 8, 20))
+            >>> me.RemoveEstimate("design")
+            >>> len(state), 5.0 < state.quantiles([0.5])[0] < 20.0
+            (1, True)
+
+        @rtype: C{incremental.IncrementalSimulation}
+        """
+        state = self._incremental
+        if state is None or state.N != N or state.seed != seed :
+            state = incremental.IncrementalSimulation(N = N, seed = seed)
+            for (ident, dist) in self._estimates.iteritems() :
+                state.setEstimate(ident, dist)
+            self._incremental = state
+        return state
+
+    def simulate(self, N = simulation.SIMULATION_SAMPLES, seed = None, keepTotals = True,
+                 workers = 0, hosts = ()) :
+        """
+        Monte Carlo sample of the total over all estimates; unlike the
+        ACCU footer it keeps the skew of the summed PERT tasks.
+        @param keepTotals: False summarizes the totals in constant memory
+        @param workers: processes for L{parallel.simulateParallel}, which
+            also summarizes; hosts adds remote workers
+        @rtype: C{simulation.SimulationResult} (C{simulation.SketchResult})
+        """
+        if workers or hosts :
+            return parallel.simulateParallel(self._estimates.values(), N = N, seed = seed,
+                                             workers = workers, hosts = hosts)
+        if not keepTotals :
+            return simulation.simulateSummary(self._estimates.values(), N = N, seed = seed)
+        return simulation.simulateTotals(self._estimates.values(), N = N, seed = seed)
+
+    def convolve(self, tolerance = convolution.CONVOLUTION_TOL) :
+        """
+        Deterministic distribution of the total with percentiles, unlike
+        the ACCU footer (mean and sigma only); requires NumPy.
+        @rtype: C{convolution.ConvolutionResult}
+        """
+        return convolution.convolveTotals(self._estimates.toArray(), tolerance = tolerance)
+
+    def cdfIndex(self, method = None, knots = cdfindex.CDF_INDEX_KNOTS,
+                 N = simulation.SIMULATION_SAMPLES, seed = 0) :
+        """
+        Index of P(total <= x) for repeated forward and inverse queries,
+        built on the first call and again after AppendEstimate or
+        RemoveEstimate changed the portfolio.
+
+        Doctests::
+            >>> me = MultiEstimate()
+            >>> me.AppendEstimate("design", BetaDistribution.FromAmB(3, 5, 12))
+            >>> me.AppendEstimate("build", BetaDistribution.FromAmB(5, 8, 20))
+            >>> index = me.cdfIndex()
+            >>> me.cdfIndex() is index, 0.89 < index.probability(index.percentile(0.9)) < 0.91
+            (True, True)
+            >>> me.AppendEstimate("test", BetaDistribution.FromAmB(1, 2, 4))
+            >>> me.cdfIndex() is index, me.cdfIndex().percentile(0.5) > index.percentile(0.5)
+            (False, True)
+
+        @param method: "convolution" (default with NumPy) or "simulation"
+            with N samples and the given seed
+        @rtype: C{cdfindex.CdfIndex}
+        """
+        if method is None :
+            method = "convolution" if convolution.numpy is not None else "simulation"
+        key = (self._version, method, knots) + ((N, seed) if method == "simulation" else ())
+        if self._cdfIndex is None or self._cdfIndex[0] != key :
+            if method == "convolution" :
+                result = self.convolve()
+            elif method == "simulation" :
+                result = self.simulate(N = N, seed = seed)
+            else :
+                raise ValueError("unknown method %r" % (method,))
+            self._cdfIndex = (key, cdfindex.CdfIndex.FromResult(result, knots, method))
+        return self._cdfIndex[1]
+
+    def saveEstimates(self, path) :
+        """writes the estimates in the L{binfmt} format, readable as input file"""
+        return binfmt.writeEstimates(path, self._estimates.iteritems())
+
+    def spillSimulation(self, path, N = simulation.SIMULATION_SAMPLES, seed = None, perEstimate = False) :
+        """
+        Like L{simulate}, but the samples go batch by batch to a L{binfmt}
+        file, so N is not limited by RAM; requires NumPy.
+
+        Doctests::
+            >>> import tempfile, shutil, os
+            >>> folder = tempfile.mkdtemp()
+            >>> me = MultiEstimate()
+            >>> me.AppendEstimate("design", BetaDistribution.FromAmB(3, 5, 12))
+            >>> me.AppendEstimate("build", BetaDistribution.FromAmB(5, 8, 20))
+            >>> samples = me.spillSimulation(os.path.join(folder, "run.pbin"), N = 3000, seed = 1)
+            >>> samples.rows, abs(samples.result().mean() - me.simulate(N = 3000, seed = 1).mean()) < 1e-9
+            (3000, True)
+            >>> samples.close(); shutil.rmtree(folder)
+
+        @rtype: C{binfmt.SampleFile}, opened without reading it again
+        """
+        binfmt.spillSimulation(path, self._estimates.values(), N = N, seed = seed, perEstimate = perEstimate)
+        return binfmt.SampleFile(path, verify = False)
 
     def getHeaderFields(self) :
         return ["ident",
@@ -316,21 +465,28 @@ class MultiEstimate(object) :
                 ]
 
     def getFooterFields(self) :
+        return self.getAccumulatorFields(self._estimates.accumulator())
+
+    def getAccumulatorFields(self, acc) :
+        """
+        @param acc: sums over all estimates
+        @type  acc: C{ingest.PortfolioAccumulator}
+        """
         # Kennung
         ident = "ACCU"
 
         # O/N/P
-        a = sum([dist.a for dist in self._estimates.values()])
-        m = sum([dist.m for dist in self._estimates.values()])
-        b = sum([dist.b for dist in self._estimates.values()])
+        a = acc.a
+        m = acc.m
+        b = acc.b
 
         # alpha und beta
         alpha = ""
         beta = ""
 
         # Mittelwert und Streuung
-        mean = sum([dist.mean() for dist in self._estimates.values()])
-        sigma = math.sqrt(sum([dist.sigma() ** 2 for dist in self._estimates.values()]))
+        mean = acc.mean
+        sigma = acc.sigma()
 
         # Mittelwert plus Streuung
         mu_1sigma = mean + 1 * sigma
@@ -390,28 +546,164 @@ class MultiEstimate(object) :
             yield map(self.formatCell, enumerate(self.getDataFields(ident, dist)))
         yield map(self.formatCell, enumerate(self.getFooterFields()))
 
-def iterInputCsv(inputCsv) :
+OUTPUT_HTML = "html"
+OUTPUT_CSV = "csv"
+OUTPUT_JSONL = "jsonl"
+ACCU_QUANTILES = (0.5, 0.8, 0.95)
+
+CSV_CACHE_VERSION = 1      # part of every disk cache key, bump when the row fields change
+DISK_CACHE_PATH = None     # set by run and --cache
+
+def getDiskCache() :
+    """@rtype: C{diskcache.DiskCache} of this process, None without --cache"""
+    if DISK_CACHE_PATH is None :
+        return None
+    return diskcache.openCache(DISK_CACHE_PATH)
+
+def getRowKey(settingsKey, ident, a, m, b) :
+    """
+    Disk cache key of one row; cheaper than L{diskcache.makeKey} per row.
+
+    @param settingsKey: key of everything else the row's fields depend on
+    """
+    # repr keeps idents that are not valid UTF-8 apart
+    return hashlib.sha1("%s;%r;%r;%r;%r" % (settingsKey, ident, a, m, b)).hexdigest()
+
+def iterCsvFields(inputCsv, me, errors = None, cache = None) :
+    """
+    (fields, acc) for the header, each row and the ACCU footer, streamed
+    from the file in chunks; only the running sums are kept in memory.
+    acc is the L{ingest.PortfolioAccumulator} for the footer, else None.
+
+    @param cache: C{diskcache.DiskCache}; rows and chunk sums found there
+        are reused, only changed rows are computed
+    """
+    acc = ingest.PortfolioAccumulator()
+    yield (me.getHeaderFields(), None)
+    settingsKey = diskcache.makeKey(CSV_CACHE_VERSION, me.getHeaderFields())
+    for chunk in iterInputChunks(inputCsv, errors) :
+        # sums per chunk, so cached chunks give the same footer
+        if cache is None :
+            (rows, partial) = computeChunk(chunk, me)
+        else :
+            (rows, partial) = getCachedChunk(chunk, me, cache, settingsKey)
+        for fields in rows :
+            yield (fields, None)
+        acc.merge(partial)
+    yield (me.getAccumulatorFields(acc), acc)
+
+def iterInputChunks(inputCsv, errors = None) :
+    """chunks of (rowNumber, ident, O, N, P) from a CSV or L{binfmt} estimates file"""
+    if binfmt.isBinaryFile(inputCsv) :
+        with binfmt.EstimateFile(inputCsv) as estimates :
+            for chunk in estimates.iterChunks() :
+                yield chunk
+        return
     with open(inputCsv, 'rb') as csvfile:
-        spamreader = csv.reader(csvfile, delimiter = ';', quotechar = '|')
-        yield '<table border="1px">\n'
-        me = MultiEstimate()
-        for (rowNumber, rowList) in enumerate(spamreader):
-            if rowNumber > 0 :
-                a = int(rowList[0])
-                m = int(rowList[1])
-                b = int(rowList[2])
-                ident = rowList[3]
-                dist = BetaDistribution.FromAmB(a, m, b)
-                me.AppendEstimate(ident, dist)
-                continue
-
-        for (row, colData) in enumerate(me.iterFields()) :
-            columns = rowList + ["&nbsp;"]
-            rowCells = ['<td %s>%s</td>' % (" ".join(me.cellHtmlAttributes(col)), s,)
-                        for (col, s) in enumerate(map(str, colData))]
-            row = "".join(rowCells)
-            yield '<tr>%s</tr>\n' % (row,)
-        yield '</table>\n'
+        for chunk in ingest.iterEstimateChunks(csvfile, errors = errors) :
+            yield chunk
+
+def computeChunk(chunk, me) :
+    """
+    @rtype: C{([fields], ingest.PortfolioAccumulator)}
+    """
+    rows = []
+    partial = ingest.PortfolioAccumulator()
+    for (rowNumber, ident, a, m, b) in chunk :
+        fields = me.getDataFields(ident, BetaDistribution.FromAmB(a, m, b))
+        partial.addValues(*fields[1:6])     # O, N, P, alpha, beta
+        rows.append(fields)
+    return (rows, partial)
+
+def getCachedChunk(chunk, me, cache, settingsKey) :
+    """
+    L{computeChunk} through the disk cache: an unchanged chunk is one
+    entry with its rows and sums; otherwise unchanged rows come from
+    their own entries and only the others are computed.
+    """
+    keys = [getRowKey(settingsKey, ident, a, m, b) for (rowNumber, ident, a, m, b) in chunk]
+    chunkKey = hashlib.sha1("".join(keys)).hexdigest()
+    entry = cache.get(chunkKey)
+    if entry is not None :
+        rows = entry["rows"]
+        for (fields, (rowNumber, ident, a, m, b)) in zip(rows, chunk) :
+            fields[0] = ident
+        return (rows, ingest.PortfolioAccumulator.FromDict(entry["sums"]))
+    cached = cache.getMany(keys)
+    rows = []
+    partial = ingest.PortfolioAccumulator()
+    computed = []
+    for ((rowNumber, ident, a, m, b), key) in zip(chunk, keys) :
+        fields = cached.get(key)
+        if fields is None :
+            fields = me.getDataFields(ident, BetaDistribution.FromAmB(a, m, b))
+            # the ident is in the key; it need not be valid UTF-8 for JSON
+            computed.append((key, [None] + fields[1:]))
+        else :
+            fields[0] = ident
+        partial.addValues(*fields[1:6])
+        rows.append(fields)
+    computed.append((chunkKey, {"rows" : [[None] + fields[1:] for fields in rows], "sums" : partial.toDict()}))
+    cache.putMany(computed)
+    return (rows, partial)
+
+def iterHtmlRows(fieldRows, me) :
+    yield '<table border="1px">\n'
+    acc = None
+    for (colData, acc) in fieldRows :
+        colData = map(me.formatCell, enumerate(colData))
+        rowCells = ['<td %s>%s</td>' % (" ".join(me.cellHtmlAttributes(col)), s,)
+                    for (col, s) in enumerate(map(str, colData))]
+        row = "".join(rowCells)
+        yield '<tr>%s</tr>\n' % (row,)
+    yield '</table>\n'
+    if acc is not None :
+        yield '<pre>ACCU %s</pre>\n' % (" ".join(iterQuantileTexts(acc)),)
+
+def iterCsvRows(fieldRows, me) :
+    buf = StringIO.StringIO()
+    writer = csv.writer(buf, delimiter = ';', quotechar = '|', lineterminator = '\n')
+    curve = me.getHeaderFields().index("curve")
+    for (colData, acc) in fieldRows :
+        writer.writerow(colData[:curve] + colData[curve + 1:])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+def iterJsonRows(fieldRows, me) :
+    header = me.getHeaderFields()
+    for (colData, acc) in fieldRows :
+        if colData == header :
+            continue
+        record = dict(zip(header, colData))
+        del record["curve"]
+        if acc is not None :
+            record["quantiles"] = dict(("q%02.0f" % (100.0 * q,), acc.quantile(q)) for q in ACCU_QUANTILES)
+        yield json.dumps(record, sort_keys = True) + "\n"
+
+def iterQuantileTexts(acc) :
+    for q in ACCU_QUANTILES :
+        yield "q%02.0f = %.1f" % (100.0 * q, acc.quantile(q))
+
+OUTPUT_WRITERS = {OUTPUT_HTML : iterHtmlRows,
+                  OUTPUT_CSV : iterCsvRows,
+                  OUTPUT_JSONL : iterJsonRows,
+                  }
+
+def iterInputCsv(inputCsv, outputFormat = OUTPUT_HTML, cache = None) :
+    """
+    Streams the estimates of inputCsv as HTML table, CSV or JSON lines;
+    rows are written as they are read, so memory stays bounded.
+    Invalid rows (O <= N <= P violated) raise ValueError.
+
+    @param cache: C{diskcache.DiskCache}, default L{getDiskCache}
+    """
+    me = MultiEstimate()
+    writer = OUTPUT_WRITERS[outputFormat]
+    if cache is None :
+        cache = getDiskCache()
+    for text in writer(iterCsvFields(inputCsv, me, cache = cache), me) :
+        yield text
 
 def write_REST_lines(fout, param, heading):
     writeln(fout, "<b>%(heading)s</b><br>" % locals())
@@ -421,34 +713,630 @@ def write_REST_lines(fout, param, heading):
     writeln(fout, "</pre>")
     writeln(fout, "".join(iterMathMlExample()))
 
-def run(inputCsv):
+SERVER_PORT = 8000
+SERVER_TIMEOUT = 30.0   # seconds per request, and idle keep-alive connections
+
+def renderPage(theCommand, thePath, inputCsv) :
+    """
+    Whole page as string, so it can be rendered in a worker process
+    and sent with Content-Length (needed for keep-alive).
+    """
+    fout = StringIO.StringIO()
+    writeRequestContentLines(fout, theCommand, thePath, inputCsv)
+    return fout.getvalue()
+
+PROFILE_LINES = 40
+
+def profilePage(theCommand, thePath, inputCsv) :
+    """cProfile statistics of rendering the page, as text"""
+    profiler = cProfile.Profile()
+    profiler.runcall(renderPage, theCommand, thePath, inputCsv)
+    out = StringIO.StringIO()
+    stats = pstats.Stats(profiler, stream = out)
+    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return out.getvalue()
+
+def callMeasured(function, *args) :
+    """runs function in a worker, returns its result and the worker's metrics"""
+    return (function(*args), metrics.drain())
+
+def initWorker(enableMetrics = False, diskCachePath = None) :
+    # the server process handles Ctrl-C; forked workers need their own random state
+    global DISK_CACHE_PATH
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    random.seed()
+    if enableMetrics :
+        metrics.enable()
+    DISK_CACHE_PATH = diskCachePath
+
+def splitPath(thePath) :
+    """
+    Doctests::
+        >>> splitPath("/3/7/20?profile=1")
+        ('/3/7/20', {'profile': ['1']})
+
+    @rtype: C{(str, dict)} path and query parameters
+    """
+    parts = urlparse.urlsplit(thePath)
+    return (parts.path, urlparse.parse_qs(parts.query))
+
+def getPageKind(thePath, inputCsv) :
+    """label of the page for the request metrics"""
+    if thePath == CDF_PATH :
+        return "cdf"
+    if getParameterFromPath(thePath) :
+        return "REST"
+    return "CSV" if inputCsv else "Random"
+
+RESPONSE_CACHE_SIZE = 256
+CACHE_MAX_AGE = 300     # seconds clients may reuse a page without asking
+
+def getCacheKey(thePath, inputCsv) :
+    """
+    Normalized key of a deterministic page, or None for the random page:
+    the O/N/P parameters, or the input file with its size and mtime.
+    @rtype: C{tuple | None}
+    """
+    param = getParameterFromPath(thePath)
+    if param :
+        return ("REST", param, OUTPUT_HTML)
+    if inputCsv :
+        st = os.stat(inputCsv)
+        return ("CSV", inputCsv, st.st_size, st.st_mtime, OUTPUT_HTML)
+    return None
+
+def getCanonicalPath(key) :
+    """the path a cached page is rendered for"""
+    if key[0] == "REST" :
+        return "/%i/%i/%i" % key[1]
+    return "/"
+
+def makeETag(content) :
+    return '"%s"' % (hashlib.sha1(content).hexdigest()[:20],)
+
+def matchesETag(ifNoneMatch, etag) :
+    """@param ifNoneMatch: value of the If-None-Match header or None"""
+    if not ifNoneMatch :
+        return False
+    tags = [tag.strip() for tag in ifNoneMatch.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+BATCH_PATH = "/batch"
+BATCH_OUTPUTS = ("alphaBeta", "mean", "sigma", "quantiles", "cdf", "histogram")
+BATCH_QUANTILES = (0.5, 0.8, 0.95)
+BATCH_CHUNK = 500                # estimates per worker task
+BATCH_MAX_BYTES = 16 << 20       # request body
+BATCH_MAX_BUCKETS = 10000        # histogram buckets per estimate
+
+def getNumbers(request, key, default, single = False) :
     """
+    Doctests::
+        >>> getNumbers({"width" : 2}, "width", 1.0, single = True), getNumbers({}, "points", [])
+        ([2.0], [])
+        >>> getNumbers({"points" : None}, "points", [])
+        Traceback (most recent call last):
+        ...
+        ValueError: "points" must be a list of numbers
+
+    @param single: the value is one number instead of a list
+    @rtype: C{[float]}
+    @raise ValueError: not a (list of) JSON number(s)
+    """
+    message = '"%s" must be %s' % (key, "a number" if single else "a list of numbers")
+    values = request.get(key, default)
+    if single :
+        values = [values]
+    if not isinstance(values, list) or \
+       not all(isinstance(v, (int, long, float)) and not isinstance(v, bool) for v in values) :
+        raise ValueError(message)
+    try :
+        return [float(v) for v in values]
+    except OverflowError :
+        raise ValueError(message)
+
+def parseBatchRequest(body) :
+    """
+    Checks a batch request once for all estimates::
+
+        {"estimates" : [[O, N, P], [O, N, P, ident], ...],
+         "outputs" : ["alphaBeta", "mean", "sigma", "quantiles", "cdf", "histogram"],
+         "quantiles" : [0.5, 0.8, 0.95],
+         "points" : [x, ...],
+         "width" : 1.0}
+
+    Only "estimates" is required; the outputs default to all but
+    "cdf" and "histogram".
+
+    Doctests::
+        >>> (estimates, options) = parseBatchRequest('{"estimates" : [[3, 5, 12]]}')
+        >>> estimates, options['outputs']
+        ([(0, '0', 3, 5, 12)], ['alphaBeta', 'mean', 'sigma', 'quantiles'])
+        >>> parseBatchRequest('{"estimates" : [[3, 5, 12]], "width" : null}')
+        Traceback (most recent call last):
+        ...
+        ValueError: "width" must be a number
+
+    @rtype: C{([(int, str, number, number, number)], dict)} estimates
+        (index, ident, O, N, P) and options
+    @raise ValueError: malformed request
+    """
+    try :
+        request = json.loads(body)
+    except ValueError as E :
+        raise ValueError("invalid JSON: %s" % (E,))
+    if not isinstance(request, dict) or not isinstance(request.get("estimates"), list) :
+        raise ValueError('expected an object with a list "estimates"')
+    outputs = request.get("outputs", ["alphaBeta", "mean", "sigma", "quantiles"])
+    if not isinstance(outputs, list) :
+        raise ValueError('"outputs" must be a list')
+    unknown = [name for name in outputs if name not in BATCH_OUTPUTS]
+    if unknown :
+        raise ValueError("unknown outputs %r, choose from %r" % (unknown, list(BATCH_OUTPUTS)))
+    try :
+        options = {'outputs' : outputs,
+                   'quantiles' : getNumbers(request, "quantiles", list(BATCH_QUANTILES)),
+                   'points' : getNumbers(request, "points", []),
+                   'width' : getNumbers(request, "width", 1.0, single = True)[0],
+                   }
+    except (TypeError, ValueError) as E :
+        raise ValueError(str(E))
+    if not all(0.0 <= q <= 1.0 for q in options['quantiles']) :
+        raise ValueError("quantiles outside [0,1]")
+    if not 0.0 < options['width'] < float('inf') :
+        raise ValueError("width must be > 0")
+    estimates = []
+    for (index, item) in enumerate(request["estimates"]) :
+        if not isinstance(item, list) or len(item) not in (3, 4) :
+            raise ValueError("estimate %i: expected [O, N, P] or [O, N, P, ident]" % (index,))
+        ident = item[3] if len(item) == 4 else str(index)
+        estimates.append((index, ident) + tuple(item[:3]))
+    return (estimates, options)
+
+def evaluateEstimate(a, m, b, options) :
+    """@rtype: C{dict} the requested outputs of one estimate"""
+    if not all(isinstance(v, (int, long, float)) for v in (a, m, b)) :
+        raise ValueError("O, N, P must be numbers")
+    if not (a <= m <= b and a < b) :
+        raise ValueError("O <= N <= P and O < P violated")
+    dist = BetaDistribution.FromAmB(float(a), float(m), float(b))
+    outputs = options['outputs']
+    record = {}
+    if "alphaBeta" in outputs :
+        record["alpha"] = dist.alpha
+        record["beta"] = dist.beta
+    if "mean" in outputs :
+        record["mean"] = dist.mean()
+    if "sigma" in outputs :
+        record["sigma"] = dist.sigma()
+    if "quantiles" in outputs :
+        confs = options['quantiles']
+        values = betadist.beta_ppf_batch(confs, dist.alpha, dist.beta, dist.a, dist.b)
+        record["quantiles"] = [[q, x] for (q, x) in zip(confs, values)]
+    if "cdf" in outputs :
+        record["cdf"] = [[x, dist.cdf(x)] for x in options['points']]
+    if "histogram" in outputs :
+        if (b - a) / options['width'] > BATCH_MAX_BUCKETS :
+            raise ValueError("more than %i histogram buckets, use a larger width" % (BATCH_MAX_BUCKETS,))
+        record["histogram"] = [list(bucket) for bucket in dist.histogram(width = options['width'])]
+    return record
+
+def evaluateBatchChunkMeasured(args) :
+    return callMeasured(evaluateBatchChunk, args)
+
+def evaluateBatchChunk(args) :
+    """
+    One JSON line per estimate; a bad estimate yields an "error" line
+    instead of failing the whole batch.
+
+    Doctests::
+        >>> lines = evaluateBatchChunk(([(0, "x", 2, 4, 9), (1, "y", 9, 4, 2)], {'outputs' : ["mean"]}))
+        >>> print "".join(lines),
+        {"ident": "x", "index": 0, "mean": 4.5}
+        {"error": "O <= N <= P and O < P violated", "ident": "y", "index": 1}
+
+    @param args: (estimates, options) from L{parseBatchRequest}
+    @rtype: C{[str]}
+    """
+    (estimates, options) = args
+    lines = []
+    for (index, ident, a, m, b) in estimates :
+        try :
+            record = evaluateEstimate(a, m, b, options)
+        except ValueError as E :
+            record = {"error" : str(E)}
+        record["index"] = index
+        record["ident"] = ident
+        lines.append(json.dumps(record, sort_keys = True) + "\n")
+    return lines
+
+def iterBatchChunks(estimates, options) :
+    for start in xrange(0, len(estimates), BATCH_CHUNK) :
+        yield (estimates[start:start + BATCH_CHUNK], options)
+
+CDF_PATH = "/cdf"
+CDF_INDEX_CACHE_SIZE = 8        # input file versions with a CDF index in the server
+CDF_MAX_QUERIES = 10000         # x and q values per request
+
+def loadPortfolio(inputCsv) :
+    """@rtype: C{MultiEstimate} of a CSV or L{binfmt} input file"""
+    me = MultiEstimate()
+    for chunk in iterInputChunks(inputCsv) :
+        for (rowNumber, ident, a, m, b) in chunk :
+            me.AppendEstimate(ident, BetaDistribution.FromAmB(a, m, b))
+    return me
+
+def buildCdfIndex(inputCsv) :
+    """runs in a worker; the index is small enough to send back"""
+    return loadPortfolio(inputCsv).cdfIndex()
+
+def parseCdfQuery(query) :
+    """
+    Doctests::
+        >>> parseCdfQuery({'x' : ['120', '150.5'], 'q' : ['0.9']})
+        ([120.0, 150.5], [0.9])
+
+    @param query: parameters from L{splitPath}
+    @rtype: C{([float], [float])} totals x and probabilities q
+    @raise ValueError: no, too many or invalid values
+    """
+    try :
+        xs = [float(x) for x in query.get("x", [])]
+        qs = [float(q) for q in query.get("q", [])]
+    except ValueError :
+        raise ValueError("x and q must be numbers")
+    if not xs and not qs :
+        raise ValueError("expected x=total and/or q=probability")
+    if len(xs) + len(qs) > CDF_MAX_QUERIES :
+        raise ValueError("more than %i values" % (CDF_MAX_QUERIES,))
+    if any(math.isnan(value) for value in xs + qs) :
+        raise ValueError("x and q must be numbers")
+    if any(q < 0 or q > 1 for q in qs) :
+        raise ValueError("q outside [0,1]")
+    return (xs, qs)
+
+def answerCdfQuery(index, xs, qs) :
+    """
+    Doctests::
+        >>> index = cdfindex.CdfIndex([10.0, 20.0, 40.0], [0.0, 0.5, 1.0], "convolution")
+        >>> answer = answerCdfQuery(index, [15.0], [0.75])
+        >>> answer["probability"], answer["percentile"]
+        ([[15.0, 0.25]], [[0.75, 30.0]])
+    """
+    return {"method" : index.method, "knots" : len(index),
+            "probability" : [[x, index.probability(x)] for x in xs],
+            "percentile" : [[q, index.percentile(q)] for q in qs]}
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer) :
+    """
+    Keeps its request handlers, so L{stopHandlers} can wait for the
+    responses in flight; handlers still running after that do not keep
+    the process alive.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, serverAddress, handlerClass) :
+        BaseHTTPServer.HTTPServer.__init__(self, serverAddress, handlerClass)
+        self.stopping = False
+        self.handlers = set()
+        self.handlersChanged = threading.Condition()
+
+    def addHandler(self, handler) :
+        with self.handlersChanged :
+            self.handlers.add(handler)
+
+    def removeHandler(self, handler) :
+        with self.handlersChanged :
+            self.handlers.discard(handler)
+            self.handlersChanged.notify_all()
+
+    def stopHandlers(self, timeout) :
+        """
+        Call after shutdown(): closes idle keep-alive connections, lets
+        busy handlers finish their response and waits up to timeout
+        seconds for them.
+
+        @rtype: C{bool} all handlers finished
+        """
+        self.stopping = True
+        with self.handlersChanged :
+            handlers = list(self.handlers)
+        for handler in handlers :
+            if not handler.busy :
+                try :
+                    # wakes up the handler waiting for the next request
+                    handler.connection.shutdown(socket.SHUT_RD)
+                except socket.error :
+                    pass
+        deadline = timeit.default_timer() + timeout
+        with self.handlersChanged :
+            while self.handlers :
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0 :
+                    return False
+                self.handlersChanged.wait(remaining)
+        return True
+
+def run(inputCsv, port = SERVER_PORT, workers = None, timeout = SERVER_TIMEOUT, openBrowser = False,
+        enableMetrics = False, diskCache = None):
+    """
+    Threaded HTTP/1.1 server with keep-alive; pages are rendered in a pool
+    of worker processes, so a slow page does not block other requests.
+    Deterministic pages are kept in an LRU cache with an ETag, repeated
+    requests get 304 or the cached page; /cache shows the hit rate.
+    POST /batch evaluates many estimates per request, see
+    L{parseBatchRequest}, and streams JSON lines back in chunks.
+    GET /cdf answers P(total <= x) and quantile queries on the input
+    file from a L{cdfindex.CdfIndex}, built once per file version in a
+    worker and kept in the server, see L{parseCdfQuery}.
+    /metrics shows the metrics in Prometheus text format, a page with
+    ?profile=1 returns its cProfile statistics instead.
+    SIGINT/SIGTERM stop accepting requests, close idle keep-alive
+    connections, wait up to C{timeout} seconds for the responses in
+    flight and then shut the pool down.
+
     @param inputCsv: optionaler Name der Eingabedatei
     @type  inputCsv: C{str | None}
+    @param workers: number of worker processes, default one per CPU;
+        0 renders in the request thread
+    @param timeout: seconds until a page render is answered with 504;
+        the worker keeps rendering that page until it is done
+    @param openBrowser: open the start page in the default browser
+    @param enableMetrics: collect L{metrics} in the server and the
+        workers; without it /metrics shows only the cache statistics
+    @param diskCache: path of a L{diskcache.DiskCache} file shared by the
+        workers and later runs; CSV pages then recompute changed rows only
     """
+    global DISK_CACHE_PATH
+    DISK_CACHE_PATH = diskCache
+    if workers is None :
+        workers = multiprocessing.cpu_count()
+    if enableMetrics :
+        metrics.enable()
+    pool = multiprocessing.Pool(workers, initWorker, (enableMetrics, diskCache)) if workers > 0 else None
+    responseCache = LRUCache(RESPONSE_CACHE_SIZE)
+    cdfIndexes = LRUCache(CDF_INDEX_CACHE_SIZE)
 
     class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler) :
+        protocol_version = "HTTP/1.1"
+
+        def setup(self) :
+            self.timeout = timeout
+            self.busy = False
+            BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+            self.server.addHandler(self)
+
+        def finish(self) :
+            try :
+                BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+            finally :
+                self.server.removeHandler(self)
+
+        def handle_one_request(self) :
+            try :
+                BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+            finally :
+                self.busy = False
+                if self.server.stopping :
+                    self.close_connection = 1
+
+        def sendContent(self, status, content, contentType = 'text/html', headers = ()) :
+            self.send_response(status)
+            self.send_header('Content-type', contentType)
+            self.send_header('Content-Length', len(content))
+            for (name, value) in headers :
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD' :
+                self.wfile.write(content)
+
+        def runInPool(self, function, *args) :
+            if pool is None :
+                return function(*args)
+            if not metrics.ENABLED :
+                return pool.apply_async(function, args).get(timeout)
+            (result, workerMetrics) = pool.apply_async(callMeasured, (function,) + args).get(timeout)
+            metrics.merge(workerMetrics)
+            return result
+
+        def renderPage(self, theCommand, thePath) :
+            return self.runInPool(renderPage, theCommand, thePath, inputCsv)
+
+        def sendMetrics(self) :
+            gauges = [("pertbeta_response_cache_%s" % (key.replace("hitRatio", "hit_ratio"),),
+                       "Rendered-page cache %s" % (key,), value, ())
+                      for (key, value) in sorted(responseCache.stats().items())]
+            content = "".join(line + "\n" for line in metrics.iterPrometheusLines(gauges))
+            self.sendContent(200, content, 'text/plain; version=0.0.4', [('Cache-Control', 'no-cache')])
+
+        def sendCdf(self, query) :
+            if not inputCsv :
+                self.sendContent(404, "%s needs an input file\n" % (CDF_PATH,), 'text/plain')
+                return
+            try :
+                (xs, qs) = parseCdfQuery(query)
+            except ValueError as E :
+                self.sendContent(400, "%s\n" % (E,), 'text/plain')
+                return
+            # the key has the file's size and mtime, so an edited file gets a new index
+            key = getCacheKey("/", inputCsv)
+            index = cdfIndexes.getOrCompute(key, lambda : self.runInPool(buildCdfIndex, inputCsv))
+            content = json.dumps(answerCdfQuery(index, xs, qs), sort_keys = True)
+            self.sendContent(200, content + "\n", 'application/json', [('Cache-Control', 'no-cache')])
+
+        def getCachedPage(self, key) :
+            """@rtype: C{(str, str)} content and ETag"""
+            entry = responseCache.get(key)
+            if entry is None :
+                content = self.renderPage('GET', getCanonicalPath(key))
+                entry = (content, makeETag(content))
+                responseCache.put(key, entry)
+            return entry
+
+        def measured(self, handle, kind) :
+            self.busy = True
+            if not metrics.ENABLED :
+                return handle()
+            start = timeit.default_timer()
+            try :
+                return handle()
+            finally :
+                metrics.observe("pertbeta_request_seconds", timeit.default_timer() - start,
+                                labels = (("page", kind(self.path)),))
 
         def do_GET(self) :
-            # if self.path.endswith('.html'):
-            # content = "<html><body>hallo</body></html>\n"
+            self.measured(self.handleGet, lambda thePath : getPageKind(splitPath(thePath)[0], inputCsv))
+
+        def do_POST(self) :
+            self.measured(self.handlePost, lambda thePath : "batch")
+
+        def handleGet(self) :
+            (path, query) = splitPath(self.path)
+            if path == "/cache" :
+                stats = json.dumps(responseCache.stats(), sort_keys = True)
+                self.sendContent(200, stats + "\n", 'application/json', [('Cache-Control', 'no-cache')])
+                return
+            if path == "/metrics" :
+                self.sendMetrics()
+                return
+            try :
+                if path == CDF_PATH :
+                    self.sendCdf(query)
+                    return
+                if query.get("profile") == ["1"] :
+                    content = self.runInPool(profilePage, self.command, path, inputCsv)
+                    self.sendContent(200, content, 'text/plain', [('Cache-Control', 'no-cache')])
+                    return
+                key = getCacheKey(path, inputCsv)
+                if key is None :
+                    content = self.renderPage(self.command, path)
+                    self.sendContent(200, content, headers = [('Cache-Control', 'no-cache')])
+                    return
+                (content, etag) = self.getCachedPage(key)
+            except multiprocessing.TimeoutError :
+                self.sendContent(504, "timeout after %g s\n" % (timeout,), 'text/plain')
+                return
+            except ValueError as E :
+                self.sendContent(400, "%s\n" % (E,), 'text/plain')
+                return
+            headers = [('ETag', etag), ('Cache-Control', 'public, max-age=%i' % (CACHE_MAX_AGE,))]
+            if matchesETag(self.headers.get('If-None-Match'), etag) :
+                self.send_response(304)
+                for (name, value) in headers :
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+            self.sendContent(200, content, headers = headers)
+            return
+
+        do_HEAD = do_GET
+
+        def sendChunk(self, text) :
+            self.wfile.write("%x\r\n%s\r\n" % (len(text), text))
+
+        def handlePost(self) :
+            if self.path != BATCH_PATH :
+                self.sendContent(404, "POST only on %s\n" % (BATCH_PATH,), 'text/plain')
+                return
+            try :
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError :
+                length = -1
+            if length < 0 :
+                self.close_connection = 1
+                self.sendContent(400, "invalid Content-Length\n", 'text/plain')
+                return
+            if length > BATCH_MAX_BYTES :
+                self.close_connection = 1
+                self.sendContent(413, "request body above %i bytes\n" % (BATCH_MAX_BYTES,), 'text/plain')
+                return
+            try :
+                (estimates, options) = parseBatchRequest(self.rfile.read(length))
+            except ValueError as E :
+                self.sendContent(400, "%s\n" % (E,), 'text/plain')
+                return
+            chunks = iterBatchChunks(estimates, options)
+            measured = pool is not None and metrics.ENABLED
+            if pool is None :
+                results = (evaluateBatchChunk(chunk) for chunk in chunks)
+            elif measured :
+                results = pool.imap(evaluateBatchChunkMeasured, chunks)
+            else :
+                results = pool.imap(evaluateBatchChunk, chunks)
             self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            # self.send_header('Content-Length', len(content))
+            self.send_header('Content-type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
             self.end_headers()
-            writeRequestContentLines(self.wfile, self.command, self.path, inputCsv)
-            return
+            # the status is already sent, errors are reported in the stream,
+            # which is always terminated
+            try :
+                while True :
+                    lines = results.next(timeout) if pool is not None else next(results)
+                    if measured :
+                        (lines, workerMetrics) = lines
+                        metrics.merge(workerMetrics)
+                    self.sendChunk("".join(lines))
+            except StopIteration :
+                pass
+            except multiprocessing.TimeoutError :
+                self.sendChunk(json.dumps({"error" : "timeout after %g s" % (timeout,)}) + "\n")
+            except socket.error :
+                # the client is gone
+                self.close_connection = 1
+                raise
+            except Exception as E :
+                self.close_connection = 1
+                self.log_error("batch failed: %r", E)
+                self.sendChunk(json.dumps({"error" : "%s: %s" % (type(E).__name__, E)}) + "\n")
+            self.sendChunk("")
 
-    port = 8000
     targetUrl = "http://localhost:%(port)i/" % locals()
     server_address = ('', port)
-    httpd = BaseHTTPServer.HTTPServer(server_address, RequestHandler)
-    os.startfile(targetUrl)
-    httpd.serve_forever()
+    httpd = ThreadingHTTPServer(server_address, RequestHandler)
 
-if __name__ == "__main__" :
+    def stop(signum, frame) :
+        # shutdown() waits for serve_forever, so it must run in another thread
+        threading.Thread(target = httpd.shutdown).start()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if openBrowser :
+        webbrowser.open(targetUrl)
     try :
-        inputCsv = sys.argv[1]
-    except IndexError :
-        inputCsv = None
-    run(inputCsv)
+        httpd.serve_forever()
+    finally :
+        httpd.server_close()
+        httpd.stopHandlers(timeout)
+        if pool is not None :
+            pool.close()
+            pool.join()
+
+def parseArguments(argv) :
+    parser = argparse.ArgumentParser(description = "PERT beta distributions as web pages")
+    parser.add_argument('inputCsv', nargs = '?', help = "estimates O;N;P;ident, or a pertbeta.binfmt file")
+    parser.add_argument('outputFormat', nargs = '?', choices = sorted(OUTPUT_WRITERS.keys()),
+                        help = "write inputCsv to stdout in this format instead of serving")
+    parser.add_argument('--port', type = int, default = SERVER_PORT)
+    parser.add_argument('--workers', type = int, default = None,
+                        help = "render processes (default: one per CPU, 0: none)")
+    parser.add_argument('--timeout', type = float, default = SERVER_TIMEOUT,
+                        help = "seconds per request")
+    parser.add_argument('--open', action = 'store_true', dest = 'openBrowser',
+                        help = "open the start page in the browser")
+    parser.add_argument('--metrics', action = 'store_true', dest = 'enableMetrics',
+                        help = "collect latency and step metrics for /metrics")
+    parser.add_argument('--cache', dest = 'diskCache', default = None, metavar = 'PATH',
+                        help = "SQLite file reusing CSV rows across runs")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__" :
+    args = parseArguments(sys.argv[1:])
+    if args.outputFormat :
+        # python pertBeta.web.py pertExample.csv csv|jsonl|html [--cache PATH] > output
+        DISK_CACHE_PATH = args.diskCache
+        for text in iterInputCsv(args.inputCsv, args.outputFormat) :
+            sys.stdout.write(text)
+    else :
+        run(args.inputCsv, port = args.port, workers = args.workers,
+            timeout = args.timeout, openBrowser = args.openBrowser,
+            enableMetrics = args.enableMetrics, diskCache = args.diskCache)
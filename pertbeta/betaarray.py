@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Vektorisierte BETA-Verteilungen (struct-of-arrays) auf Basis von NumPy:
+pdf, CDF, Quantile, Mittelwert und Streuung für viele PERT-Schätzungen
+in jeweils einem Aufruf.
+
+NumPy ist optional; ohne NumPy bleibt L{pertbeta.betadist} voll nutzbar.
+"""
+
+#---
+#--- Python
+import math
+import sys
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta import betadist
+from pertbeta.betadist import BetaDistribution
+
+#---
+EPSILON = sys.float_info.epsilon
+
+#---
+def _requireNumpy() :
+    if numpy is None :
+        raise ImportError("BetaDistributionArray requires numpy")
+
+def _tiny(v) :
+    return numpy.where(numpy.abs(v) < betadist.INCBETA_TINY, betadist.INCBETA_TINY, v)
+
+def lgamma(z) :
+    """
+    Real log-gamma for z > 0 with the Lanczos coefficients of
+    L{betadist.gamma_lanczos}, elementwise.
+
+    Doctests::
+        >>> z = [0.1, 0.5, 1.0, 3.7, 150.0]
+        >>> float(numpy.abs(lgamma(z) - [betadist.log_gamma(v) for v in z]).max()) < 1e-12
+        True
+    """
+    z = numpy.asarray(z, dtype = float)
+    small = z < 0.5
+    zz = numpy.where(small, z + 1.0, z) - 1.0
+    coef = betadist.LANCZOS_COEF
+    x = coef[0]
+    for i in xrange(1, betadist.LANCZOS_G + 2) :
+        x = x + coef[i] / (zz + i)
+    t = zz + betadist.LANCZOS_G + 0.5
+    lg = 0.5 * math.log(2 * math.pi) + (zz + 0.5) * numpy.log(t) - t + numpy.log(x)
+    return numpy.where(small, lg - numpy.log(z), lg)
+
+def lbeta(alpha, beta) :
+    return lgamma(alpha) + lgamma(beta) - lgamma(alpha + beta)
+
+def _incbeta_cf(x, alpha, beta) :
+    """elementwise version of L{betadist._incbeta_cf}"""
+    qab = alpha + beta
+    qap = alpha + 1.0
+    qam = alpha - 1.0
+    c = numpy.ones_like(x)
+    d = 1.0 / _tiny(1.0 - qab * x / qap)
+    h = d.copy()
+    active = numpy.ones(x.shape, dtype = bool)
+    for m in xrange(1, betadist.INCBETA_MAXITER + 1) :
+        m2 = 2 * m
+        aa = m * (beta - m) * x / ((qam + m2) * (alpha + m2))
+        d = 1.0 / _tiny(1.0 + aa * d)
+        c = _tiny(1.0 + aa / c)
+        h = numpy.where(active, h * d * c, h)
+        aa = -(alpha + m) * (qab + m) * x / ((alpha + m2) * (qap + m2))
+        d = 1.0 / _tiny(1.0 + aa * d)
+        c = _tiny(1.0 + aa / c)
+        delta = d * c
+        h = numpy.where(active, h * delta, h)
+        active &= numpy.abs(delta - 1.0) >= betadist.INCBETA_EPS
+        if not active.any() :
+            return h
+    raise ValueError("incomplete beta did not converge")
+
+def betainc_regularized(u, alpha, beta, lbeta_ab = None) :
+    """
+    Elementwise I_u(alpha, beta), see L{betadist.betainc_regularized}.
+    u is clipped to [0, 1].
+
+    Doctests::
+        >>> u = numpy.array([0.0, 1e-6, 0.3, 0.9, 1.0])
+        >>> [float(numpy.abs(betainc_regularized(u, alpha, beta) -
+        ...                  [betadist.betainc_regularized(v, alpha, beta) for v in u]).max()) < 1e-14
+        ...  for (alpha, beta) in ((0.5, 0.5), (0.3, 2.0), (2.0, 5.0))]
+        [True, True, True]
+    """
+    u, alpha, beta = numpy.broadcast_arrays(
+        numpy.clip(numpy.asarray(u, dtype = float), 0.0, 1.0),
+        numpy.asarray(alpha, dtype = float),
+        numpy.asarray(beta, dtype = float))
+    if lbeta_ab is None :
+        lbeta_ab = lbeta(alpha, beta)
+    lbeta_ab = numpy.broadcast_to(lbeta_ab, u.shape)
+    with numpy.errstate(all = 'ignore') :
+        front = numpy.exp(alpha * numpy.log(u) + beta * numpy.log1p(-u) - lbeta_ab)
+        swap = u >= (alpha + 1.0) / (alpha + beta + 2.0)
+        x = numpy.where(swap, 1.0 - u, u)
+        p = numpy.where(swap, beta, alpha)
+        q = numpy.where(swap, alpha, beta)
+        cf = _incbeta_cf(x, p, q)
+        result = numpy.where(swap, 1.0 - front * cf / p, front * cf / p)
+    result = numpy.where(u <= 0.0, 0.0, result)
+    return numpy.where(u >= 1.0, 1.0, result)
+
+
+#---
+class BetaDistributionArray(object) :
+    """
+    Many beta distributions on [a, b] stored column-wise; every method
+    evaluates all rows in one vectorized call.  Arguments like C{x} or
+    C{conf} broadcast against the rows, so a scalar applies to every row
+    and an array of shape (k, n) evaluates k points per row.
+    """
+
+    @classmethod
+    def FromAmB(cls, a, m, b) :
+        _requireNumpy()
+        a = numpy.asarray(a, dtype = float)
+        m = numpy.asarray(m, dtype = float)
+        b = numpy.asarray(b, dtype = float)
+        alpha, beta = betadist.alphaBetaFromAmB(a, m, b)
+        return cls(a, b, alpha, beta, m = m)
+
+    @classmethod
+    def FromDistributions(cls, dists) :
+        _requireNumpy()
+        dists = list(dists)
+        column = lambda name : numpy.array([getattr(dist, name) for dist in dists], dtype = float)
+        m = numpy.array([dist.m if dist.m is not None else numpy.nan for dist in dists], dtype = float)
+        return cls(column('a'), column('b'), column('alpha'), column('beta'), m = m)
+
+    def __init__(self, a, b, alpha, beta, m = None) :
+        _requireNumpy()
+        self.a = numpy.asarray(a, dtype = float)
+        self.b = numpy.asarray(b, dtype = float)
+        self.alpha = numpy.asarray(alpha, dtype = float)
+        self.beta = numpy.asarray(beta, dtype = float)
+        if m is None :
+            m = numpy.empty_like(self.a)
+            m.fill(numpy.nan)
+        self.m = numpy.asarray(m, dtype = float)
+        if numpy.any(self.alpha <= 0) or numpy.any(self.beta <= 0) :
+            raise ValueError("precondition violated: alpha, beta > 0")
+        self.lbeta = lbeta(self.alpha, self.beta)
+
+    def __len__(self) :
+        return len(self.a)
+
+    def __getitem__(self, i) :
+        """@rtype: C{BetaDistribution}"""
+        dist = BetaDistribution(float(self.a[i]), float(self.b[i]), float(self.alpha[i]), float(self.beta[i]))
+        if not numpy.isnan(self.m[i]) :
+            dist.m = float(self.m[i])
+        return dist
+
+    def _standardize(self, x) :
+        return (numpy.asarray(x, dtype = float) - self.a) / (self.b - self.a)
+
+    def logpdf(self, x) :
+        u = self._standardize(x)
+        alpha = self.alpha
+        beta = self.beta
+        with numpy.errstate(all = 'ignore') :
+            logpdf = (alpha - 1.0) * numpy.log(u) + (beta - 1.0) * numpy.log1p(-u) \
+                     - self.lbeta - numpy.log(self.b - self.a)
+            # x**0 == 1 at the bounds
+            logpdf = numpy.where((u == 0.0) & (alpha == 1.0), numpy.log(beta) - numpy.log(self.b - self.a), logpdf)
+            logpdf = numpy.where((u == 1.0) & (beta == 1.0), numpy.log(alpha) - numpy.log(self.b - self.a), logpdf)
+        return numpy.where((u < 0.0) | (u > 1.0), -numpy.inf, logpdf)
+
+    def pdf(self, x) :
+        return numpy.exp(self.logpdf(x))
+
+    def cdf(self, x) :
+        """CDF per row; x outside [a, b] yields 0 or 1"""
+        return betainc_regularized(self._standardize(x), self.alpha, self.beta, self.lbeta)
+
+    def ppf(self, conf, tol = betadist.QUANTILE_TOL, maxiter = betadist.QUANTILE_MAXITER) :
+        """
+        Quantiles per row with the bracketed Halley iteration of
+        L{betadist.beta_ppf}, run on all rows at once.
+
+        Doctests::
+            >>> dists = BetaDistributionArray([0.0, 0.0, 0.0], [1.0, 17.0, 1.0], [0.5, 0.8, 0.3], [3.0, 3.2, 2.0])
+            >>> [float(numpy.abs(dists.ppf(conf) - [betadist.beta_ppf(conf, dist.alpha, dist.beta, dist.a, dist.b)
+            ...                                     for dist in (dists[0], dists[1], dists[2])]).max()) < 1e-12
+            ...  for conf in (0.0, 0.05, 0.5, 0.999, 1.0)]
+            [True, True, True, True, True]
+            >>> x = dists.ppf(1e-8)   # far below tol for alpha < 1
+            >>> float(numpy.abs(dists.cdf(x) / 1e-8 - 1.0).max()) < 1e-9
+            True
+
+        @param tol: absolute tolerance for x (in units of [a, b]); the
+            probability residual must also be below
+            L{betadist.QUANTILE_RTOL} * conf
+        """
+        conf = numpy.asarray(conf, dtype = float)
+        if numpy.any(conf < 0) or numpy.any(conf > 1) :
+            raise ValueError("conf outside support [0,1]")
+        shape = numpy.broadcast(conf, self.a).shape
+        conf, alpha, beta, lb, width = [numpy.array(v, dtype = float).ravel() for v in
+            numpy.broadcast_arrays(conf, self.alpha, self.beta, self.lbeta, self.b - self.a)]
+        u = numpy.where(conf <= 0.0, 0.0, 1.0)
+        # solve only the rows that have not converged yet
+        rows = numpy.nonzero((conf > 0.0) & (conf < 1.0))[0]
+        p, q, lbr, cr = alpha[rows], beta[rows], lb[rows], conf[rows]
+        utol = tol / width[rows]
+        lo = numpy.zeros(len(rows))
+        hi = numpy.ones(len(rows))
+        ur = p / (p + q)
+        with numpy.errstate(all = 'ignore') :
+            for i in xrange(maxiter) :
+                if not len(rows) :
+                    break
+                F = betainc_regularized(ur, p, q, lbr) - cr
+                below = F < 0.0
+                lo = numpy.where(below, ur, lo)
+                hi = numpy.where(below, hi, ur)
+                residualOk = numpy.abs(F) <= betadist.QUANTILE_RTOL * cr
+                converged = (F == 0.0) | (hi - lo <= 4.0 * EPSILON * hi) | ((hi - lo <= utol) & residualOk)
+                logf = (p - 1.0) * numpy.log(ur) + (q - 1.0) * numpy.log1p(-ur) - lbr
+                step = F / numpy.exp(logf)
+                dlogf = (p - 1.0) / ur - (q - 1.0) / (1.0 - ur)
+                denom = 1.0 - 0.5 * step * dlogf
+                step = numpy.where(denom > 0.0, step / denom, step)
+                un = ur - step
+                converged |= un == ur       # step below the resolution of u
+                inside = (un > lo) & (un < hi)
+                un = numpy.where(inside, un, 0.5 * (lo + hi))
+                ur = numpy.where(converged, ur, un)
+                u[rows] = ur
+                keep = ~(converged | (inside & (numpy.abs(step) <= utol) & residualOk))
+                rows, p, q, lbr, cr, utol, lo, hi, ur = [v[keep] for v in
+                    (rows, p, q, lbr, cr, utol, lo, hi, ur)]
+        u[rows] = ur
+        u = u.reshape(shape)
+        return self.a + u * (self.b - self.a)
+
+    def mean(self) :
+        """PERT mean (a + 4m + b) / 6, see L{BetaDistribution.mean}"""
+        return (self.a + 4 * self.m + self.b) / 6.0
+
+    def sigma(self) :
+        return (self.b - self.a) / 6.0
@@ -9,21 +9,79 @@ und BETA-Verteiltungsfunktion (CDF) zu berechnen.
 
 #---
 #--- Python
-from cmath import *
 import doctest
+import heapq
+import math
 import random
+import sys
+
+#--- .
+try :
+    from pertbeta.lrucache import LRUCache
+    from pertbeta import metrics
+    from pertbeta import sampling
+except ImportError : # started as script
+    from lrucache import LRUCache
+    import metrics
+    import sampling
 
 #---
 MAX_DOTS = 40
-
-#---
-def gamma_lanczos(z):
-    """
-    Gamma function with the Lanczos approximation (found on Wikipedia)
-    https://en.wikipedia.org/wiki/Lanczos_approximation
-    """
-    g = 7
-    lanczos_coef = [ \
+BETA_CACHE_SIZE = 4096
+
+#--- INTEGRAL backends
+INTEGRAL_ADAPTIVE = "adaptive"     # adaptive Gauss-Kronrod (7/15 points)
+INTEGRAL_TRAPEZOID = "trapezoid"   # fixed step size epsilon
+INTEGRAL_METHOD = INTEGRAL_ADAPTIVE
+INTEGRAL_LIMIT = 200               # max. number of subintervals
+INTEGRAL_RELTOL = 1.0e-10
+# starting subintervals of the tanh-sinh parameter t, see INTEGRAL_GK;
+# |t| = 2 lies 1e-5 and |t| = 6 lies 1e-276 of the width from a bound
+INTEGRAL_DE_EDGES = (-6.0, -2.0, -1.0, 0.0, 1.0, 2.0, 6.0)
+
+# Gauss-Kronrod 7/15 nodes on [-1, 1] (x[1::2] are the Gauss nodes)
+GK15_X = [0.991455371120812639206854697526329,
+          0.949107912342758524526189684047851,
+          0.864864423359769072789712788640926,
+          0.741531185599394439863864773280788,
+          0.586087235467691130294144845693013,
+          0.405845151377397166906606412076961,
+          0.207784955007898467600689403773245,
+          0.000000000000000000000000000000000]
+GK15_WK = [0.022935322010529224963732008058970,
+           0.063092092629978553290700663189204,
+           0.104790010322250183839876322541518,
+           0.140653259715525918745189590510238,
+           0.169004726639267902826583426598550,
+           0.190350578064785409913256402421014,
+           0.204432940075298892414161999234649,
+           0.209482141084727828012999174891714]
+GK15_WG = [0.129484966168869693270611432679082,
+           0.279705391489276667901467771423780,
+           0.381830050505118944950369775488975,
+           0.417959183673469387755102040816327]
+
+#--- beta_cdf backends
+CDF_INCBETA = "incbeta"         # regularized incomplete beta (continued fraction)
+CDF_QUADRATURE = "quadrature"   # numerical integration of beta_pdf
+CDF_METHOD = CDF_INCBETA
+
+INCBETA_EPS = 1.0e-15
+INCBETA_MAXITER = 1000
+INCBETA_TINY = 1.0e-300
+
+#--- beta_inv backends
+INV_SOLVER = "solver"           # bracketed Halley iteration on the incomplete beta
+INV_QUADRATURE = "quadrature"   # walk the quadrature until conf is reached
+INV_METHOD = INV_SOLVER
+
+QUANTILE_TOL = 1.0e-10
+QUANTILE_RTOL = 1.0e-10         # probability residual relative to conf
+QUANTILE_MAXITER = 100
+
+#--- Lanczos approximation (g = 7, n = 9)
+LANCZOS_G = 7
+LANCZOS_COEF = [ \
          0.99999999999980993,
        676.5203681218851,
      -1259.1392167224028,
@@ -34,41 +92,215 @@ def gamma_lanczos(z):
          9.9843695780195716e-6,
          1.5056327351493116e-7]
 
-    z = complex(z)
-    if z.real < 0.5:
-        return pi / (sin(pi*z)*gamma(1-z))
+#---
+def gamma_lanczos(z):
+    """
+    Gamma function with the Lanczos approximation (found on Wikipedia)
+    https://en.wikipedia.org/wiki/Lanczos_approximation
+    """
+    g = LANCZOS_G
+    lanczos_coef = LANCZOS_COEF
+
+    z = float(z)
+    if z < 0.5:
+        return math.pi / (math.sin(math.pi*z)*gamma(1-z))
     else:
         z -= 1
         x = lanczos_coef[0] + \
             sum(lanczos_coef[i]/(z+i)
                 for i in range(1, g+2))
         t = z + g + 0.5
-        return sqrt(2*pi) * t**(z+0.5) * exp(-t) * x
+        return math.sqrt(2*math.pi) * t**(z+0.5) * math.exp(-t) * x
 
 
 
 def gamma(x) :
     """
     Testing against a known value (Γ(10) = 9! = 362880)::
-        >>> int(gamma(10.0)) # 362880.00000000047+0j)
+        >>> int(gamma(10.0)) # 362880.00000000047
         362880
     """
-    z = gamma_lanczos(x)
-    return z.real
+    return gamma_lanczos(x)
 
+def log_gamma(x) :
+    """
+    log|Γ(x)| with the Lanczos approximation evaluated in log space,
+    so it stays finite long after gamma(x) overflows (x > 171).
 
-def INTEGRAL(f, lo, hi, epsilon = 0.001) :
+    Doctests::
+        >>> "%.6f" % log_gamma(10.0) # log(362880)
+        '12.801827'
+        >>> "%.3f" % log_gamma(1000.0)
+        '5905.220'
+    """
+    x = float(x)
+    if x < 0.5 :
+        # reflection: Γ(x) Γ(1-x) = pi / sin(pi x)
+        return math.log(math.pi / abs(math.sin(math.pi * x))) - log_gamma(1.0 - x)
+    z = x - 1.0
+    s = LANCZOS_COEF[0]
+    for i in xrange(1, LANCZOS_G + 2) :
+        s += LANCZOS_COEF[i] / (z + i)
+    t = z + LANCZOS_G + 0.5
+    return 0.5 * math.log(2 * math.pi) + (z + 0.5) * math.log(t) - t + math.log(s)
+
+def log_beta(alpha, beta) :
+    """log(B(alpha, beta)) = log(Γ(alpha) Γ(beta) / Γ(alpha + beta)) for alpha, beta > 0"""
+    return log_gamma(alpha) + log_gamma(beta) - log_gamma(alpha + beta)
+
+
+def INTEGRAL(f, lo, hi, epsilon = 0.001, method = None, endpoints = False) :
     """
     Doctests::
         >>> eps = 0.00001
         >>> INTEGRAL(lambda x : x, 0, 1, epsilon = eps) - 0.5 < eps
         True
+        >>> INTEGRAL(lambda x : x, 0, 1, epsilon = eps, method = INTEGRAL_TRAPEZOID) - 0.5 < eps
+        True
+        >>> try :
+        ...     INTEGRAL(lambda x : math.sin(1e4 * x), 0, 1, epsilon = eps)
+        ... except ValueError :
+        ...     print "no convergence"
+        no convergence
+        >>> # the call counter of metrics passes the endpoint distances on
+        >>> metrics.enable()
+        >>> "%.6f" % (12.0 * BETA_INTEGRAL(2.0, 3.0, 0.0, 1.0)), "%.4f" % beta_cdf(9.4, 0.8, 3.2, 3.0, 20.0, method = CDF_QUADRATURE)
+        ('1.000000', '0.8324')
+        >>> metrics.disable()
+        >>> metrics.reset()
+
+    @param epsilon: step size of the trapezoid rule; the adaptive
+        backend uses epsilon**2 as absolute tolerance, which is the
+        order of the trapezoid error for smooth functions
+    @param method: L{INTEGRAL_ADAPTIVE} or L{INTEGRAL_TRAPEZOID},
+        default L{INTEGRAL_METHOD}
+    @param endpoints: call f(x, x - lo, hi - x), see L{INTEGRAL_GK}
+    @raise ValueError: the adaptive backend missed its tolerance within
+        L{INTEGRAL_LIMIT} subintervals
     """
-    summe = 0.0
-    for (A, tr) in iterIntegral(f, lo, hi, epsilon = epsilon) :
-        summe += A
+    if method is None :
+        method = INTEGRAL_METHOD
+    counter = None
+    if metrics.ENABLED :
+        f = counter = metrics.CallCounter(f)
+    if method == INTEGRAL_ADAPTIVE :
+        abstol = epsilon ** 2
+        (summe, error) = INTEGRAL_GK(f, lo, hi, abstol = abstol, endpoints = endpoints)
+        if not error <= max(abstol, INTEGRAL_RELTOL * abs(summe)) :
+            raise ValueError("integral did not converge (error estimate %g)" % (error,))
+    elif method == INTEGRAL_TRAPEZOID :
+        g = f
+        if endpoints :
+            g = lambda x : f(x, x - lo, hi - x)
+        summe = 0.0
+        for (A, tr) in iterIntegral(g, lo, hi, epsilon = epsilon) :
+            summe += A
+    else :
+        raise ValueError("unknown integral method %r" % (method,))
+    if counter is not None :
+        metrics.observe("pertbeta_integral_evaluations", counter.calls, metrics.COUNT_BUCKETS, (("method", method),))
     return summe
 
+def _gk15(g, lo, hi) :
+    """
+    Gauss-Kronrod 7/15 rule on [lo, hi], returns (kronrod, error) with
+    the QUADPACK error estimate derived from |kronrod - gauss|.
+    """
+    center = 0.5 * (lo + hi)
+    half = 0.5 * (hi - lo)
+    fc = g(center)
+    kronrod = fc * GK15_WK[7]
+    gauss = fc * GK15_WG[3]
+    pairs = []
+    for j in xrange(7) :
+        dx = half * GK15_X[j]
+        f1 = g(center - dx)
+        f2 = g(center + dx)
+        pairs.append((f1, f2))
+        kronrod += GK15_WK[j] * (f1 + f2)
+        if j % 2 == 1 :
+            gauss += GK15_WG[j // 2] * (f1 + f2)
+    mean = 0.5 * kronrod
+    resasc = GK15_WK[7] * abs(fc - mean)
+    for j in xrange(7) :
+        (f1, f2) = pairs[j]
+        resasc += GK15_WK[j] * (abs(f1 - mean) + abs(f2 - mean))
+    resasc *= abs(half)
+    error = abs((kronrod - gauss) * half)
+    if resasc != 0.0 and error != 0.0 :
+        error = resasc * min(1.0, (200.0 * error / resasc) ** 1.5)
+    return (kronrod * half, error)
+
+def INTEGRAL_GK(f, lo, hi, abstol = 1.0e-10, reltol = INTEGRAL_RELTOL, limit = INTEGRAL_LIMIT, endpoints = False) :
+    """
+    Adaptive Gauss-Kronrod quadrature: the subinterval with the largest
+    error estimate is bisected until the total error is below
+    max(abstol, reltol * |estimate|) or C{limit} subintervals are used.
+    In the latter case the returned error estimate exceeds the
+    tolerance, L{INTEGRAL} turns that into a ValueError.
+
+    The integral runs over t in L{INTEGRAL_DE_EDGES} after the tanh-sinh
+    substitution x = (lo + hi) / 2 + (hi - lo) / 2 *
+    tanh(pi/2 sinh(t)).  The weight decays double exponentially towards
+    both ends, so integrable endpoint singularities such as
+    (x - a)**(alpha - 1) with alpha < 1 converge without special cases.
+    The lower half of t is measured from lo and the upper half from hi,
+    which keeps the distance to the nearer bound exact even where x
+    itself rounds to lo or hi.  With C{endpoints} f receives these
+    distances as f(x, x - lo, hi - x); otherwise such points evaluate
+    f at the bound itself.
+
+    Doctests::
+        >>> (estimate, error) = INTEGRAL_GK(lambda x : x ** -0.5, 0.0, 1.0)
+        >>> abs(estimate - 2.0) < 1e-9, error < 1e-9
+        (True, True)
+        >>> calls = []
+        >>> f = lambda x, fromLo, toHi : calls.append(x) or fromLo ** -0.9 * toHi ** -0.7
+        >>> (estimate, error) = INTEGRAL_GK(f, 3.0, 4.0, endpoints = True)
+        >>> abs(estimate - math.exp(log_beta(0.1, 0.3))) < 1e-9, len(calls) < 300
+        (True, True)
+
+    @param endpoints: call f(x, x - lo, hi - x) with both distances exact
+    @rtype: C{(float, float)} estimate and error estimate
+    """
+    if lo >= hi :
+        return (0.0, 0.0)
+    width = float(hi - lo)
+    def g(t) :
+        s = 0.5 * math.pi * math.sinh(t)
+        e = math.exp(-2.0 * abs(s))
+        near = width * e / (1.0 + e)
+        weight = math.pi * width * math.cosh(t) * e / (1.0 + e) ** 2
+        if near == 0.0 or weight == 0.0 :
+            return 0.0
+        if s < 0 :
+            (x, fromLo, toHi) = (lo + near, near, width - near)
+        else :
+            (x, fromLo, toHi) = (hi - near, width - near, near)
+        if endpoints :
+            return f(x, fromLo, toHi) * weight
+        return f(x) * weight
+    intervals = []
+    for (t0, t1) in zip(INTEGRAL_DE_EDGES[:-1], INTEGRAL_DE_EDGES[1:]) :
+        (part, parterr) = _gk15(g, t0, t1)
+        intervals.append((-parterr, t0, t1, part))
+    heapq.heapify(intervals)
+    estimate = math.fsum(item[3] for item in intervals)
+    error = math.fsum(-item[0] for item in intervals)
+    while error > max(abstol, reltol * abs(estimate)) and len(intervals) < limit :
+        (negerr, u0, u1, part) = heapq.heappop(intervals)
+        um = 0.5 * (u0 + u1)
+        (left, lefterr) = _gk15(g, u0, um)
+        (right, righterr) = _gk15(g, um, u1)
+        heapq.heappush(intervals, (-lefterr, u0, um, left))
+        heapq.heappush(intervals, (-righterr, um, u1, right))
+        estimate += left + right - part
+        error += lefterr + righterr + negerr
+    # resum to avoid accumulated rounding from the updates
+    estimate = math.fsum(item[3] for item in intervals)
+    error = math.fsum(-item[0] for item in intervals)
+    return (estimate, error)
+
 def iterIntegral(f, lo, hi, epsilon = 0.001) :
     if lo >= hi :
         return
@@ -87,24 +319,48 @@ def iterIntegral(f, lo, hi, epsilon = 0.001) :
     return
 
 def BETA_GAMMA(alpha, beta, a, b) :
-    gamma_quot = (gamma(alpha)*gamma(beta)/gamma(alpha+beta))
+    gamma_quot = math.exp(log_beta(alpha, beta))
     return gamma_quot #* (b-a)**(alpha + beta - 1)
 
 def BETA_INTEGRAL(alpha, beta, a, b, epsilon = 0.001) :
-    f = lambda t : beta_pdf_nominator(t, alpha, beta, a, b)
-    return INTEGRAL(f, a, b, epsilon = epsilon)
+    f = lambda t, fromA, toB : _beta_kernel(fromA, toB, alpha, beta)
+    return INTEGRAL(f, a, b, epsilon = epsilon, endpoints = True)
 
 def BETA(alpha, beta, a, b) :
     return BETA_GAMMA(alpha, beta, a, b)
     # return BETA_INTEGRAL(alpha, beta, a, b)
 
-beta_cache = {}
+beta_cache = LRUCache(BETA_CACHE_SIZE)
+def LOG_BETA_CACHED(alpha, beta) :
+    """
+    log(B(alpha, beta)) from the bounded L{beta_cache}, keyed by (alpha, beta).
+    Use C{beta_cache.stats()}, C{beta_cache.clear()} and
+    C{beta_cache.setCapacity(n)} to monitor and control it.
+    """
+    return beta_cache.getOrCompute((alpha, beta), lambda : log_beta(alpha, beta))
+
 def BETA_CACHED(alpha, beta, a, b) :
-    key = (alpha, beta, a, b)
-    if not beta_cache.has_key(key) :
-        B = BETA(alpha, beta, a, b)
-        beta_cache[key] = B
-    return beta_cache[key]
+    """BETA(alpha, beta); a and b do not enter BETA_GAMMA"""
+    return math.exp(LOG_BETA_CACHED(alpha, beta))
+
+def _xlogy(c, y) :
+    """c * log(y) with 0 * log(0) = 0"""
+    if c == 0 :
+        return 0.0
+    if y == 0 :
+        return float('-inf') if c > 0 else float('inf')
+    return c * math.log(y)
+
+def _beta_kernel(fromA, toB, alpha, beta, logscale = 0.0, infinite = 10.0) :
+    """
+    (x - a)**(alpha - 1) * (b - x)**(beta - 1) * exp(logscale) from the
+    distances fromA = x - a and toB = b - x, for L{INTEGRAL} with
+    C{endpoints}; C{infinite} * exp(logscale) stands in at a singular bound.
+    """
+    logk = _xlogy(alpha - 1, fromA) + _xlogy(beta - 1, toB)
+    if logk == float('inf') :
+        return infinite * math.exp(logscale)
+    return math.exp(logk + logscale)
 
 def beta_pdf_nominator(x, alpha, beta, a, b, infinite = 10.0) :
     """
@@ -118,6 +374,9 @@ def beta_pdf_nominator(x, alpha, beta, a, b, infinite = 10.0) :
     (taken from https://github.com/scipy/scipy/blob/v0.11.0/scipy/stats/distributions.py)
     @param a, b, x: lower and upper bounds with a <= x <= b
     @param alpha, beta: shape parameters with alpha, beta > 0
+    @param infinite: stand-in for the singular value at a (alpha < 1) or
+        b (beta < 1); the fixed-step trapezoid rule evaluates there, and
+        so does L{INTEGRAL_GK} where x - a or b - x rounds to zero
     """
     NULL = 0.0
     if x < a or x > b:
@@ -147,42 +406,209 @@ def beta_pdf(x, alpha, beta, a, b, infinite = 10.0) :
     if x < a or x > b:
         return NULL
     if alpha > 0 and beta > 0 :
-        num = beta_pdf_nominator(x, alpha, beta, a, b, infinite = infinite)
-        den = BETA_CACHED(alpha,beta,a,b)*(b-a)**(alpha+beta-1)
-        return num/den
+        logpdf = beta_logpdf(x, alpha, beta, a, b)
+        if logpdf == float('inf') :
+            # integrable singularity at a (alpha < 1) or b (beta < 1)
+            logpdf = math.log(infinite) - LOG_BETA_CACHED(alpha, beta) - (alpha + beta - 1) * math.log(b - a)
+        return math.exp(logpdf)
     return NULL
 
-def beta_cdf(x, alpha, beta, a, b, epsilon = 0.001) :
+def beta_logpdf(x, alpha, beta, a, b) :
+    """
+    log(beta_pdf(x)), computed without forming the gamma and power
+    products, so large shapes stay finite.  Returns -inf outside [a, b]
+    and +inf at a singular bound (alpha < 1 at a, beta < 1 at b).
+
+    Doctests::
+        >>> "%.4f" % beta_logpdf(10.0, 2000.0, 2000.0, 0.0, 20.0)
+        '0.9254'
+
+    @param a, b, x: lower and upper bounds with a <= x <= b
+    @param alpha, beta: shape parameters with alpha, beta > 0
+    """
+    if x < a or x > b :
+        return float('-inf')
+    if alpha <= 0 or beta <= 0 :
+        raise ValueError("precondition violated: alpha, beta > 0")
+    lognum = _xlogy(alpha - 1, x - a) + _xlogy(beta - 1, b - x)
+    return lognum - LOG_BETA_CACHED(alpha, beta) - (alpha + beta - 1) * math.log(b - a)
+
+def _incbeta_cf(x, alpha, beta) :
+    """
+    Continued fraction of the incomplete beta function, evaluated with
+    the modified Lentz method (Numerical Recipes, betacf).
+    Converges quickly for x < (alpha + 1) / (alpha + beta + 2).
+    """
+    qab = alpha + beta
+    qap = alpha + 1.0
+    qam = alpha - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < INCBETA_TINY :
+        d = INCBETA_TINY
+    d = 1.0 / d
+    h = d
+    for m in xrange(1, INCBETA_MAXITER + 1) :
+        m2 = 2 * m
+        # even step
+        aa = m * (beta - m) * x / ((qam + m2) * (alpha + m2))
+        d = 1.0 + aa * d
+        if abs(d) < INCBETA_TINY :
+            d = INCBETA_TINY
+        c = 1.0 + aa / c
+        if abs(c) < INCBETA_TINY :
+            c = INCBETA_TINY
+        d = 1.0 / d
+        h *= d * c
+        # odd step
+        aa = -(alpha + m) * (qab + m) * x / ((alpha + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < INCBETA_TINY :
+            d = INCBETA_TINY
+        c = 1.0 + aa / c
+        if abs(c) < INCBETA_TINY :
+            c = INCBETA_TINY
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < INCBETA_EPS :
+            if metrics.ENABLED :
+                metrics.observe("pertbeta_steps", m, metrics.COUNT_BUCKETS, (("solver", "incbeta_cf"),))
+            return h
+    raise ValueError("incomplete beta did not converge (alpha=%r, beta=%r)" % (alpha, beta))
+
+def betainc_regularized(x, alpha, beta) :
+    """
+    Regularized incomplete beta function I_x(alpha, beta) for 0 <= x <= 1,
+    i.e. the CDF of the standard beta distribution on [0, 1].
+
+    The cost does not depend on x; for the shapes produced by
+    alphaBetaFromAmB the continued fraction needs well below 50 terms.
+    The absolute error is below 1e-14 for alpha, beta in [0.1, 10] (the
+    PERT range) and below 1e-12 for alpha, beta up to 1000.
+
+    Doctests::
+        >>> "%.12f" % betainc_regularized(0.3, 1.0, 1.0) # uniform
+        '0.300000000000'
+        >>> abs(betainc_regularized(0.5, 2.5, 2.5) - 0.5) < 1e-14
+        True
+    """
+    return _betainc(x, alpha, beta, LOG_BETA_CACHED(alpha, beta))
+
+def _betainc_tail(x, alpha, beta, lbeta) :
+    """
+    (upper, logt) with I_x = exp(logt) for the lower tail, and
+    I_x = 1 - exp(logt) for the upper tail, for 0 < x < 1.
+    """
+    logfront = alpha * math.log(x) + beta * math.log1p(-x) - lbeta
+    if x < (alpha + 1.0) / (alpha + beta + 2.0) :
+        return False, logfront + math.log(_incbeta_cf(x, alpha, beta) / alpha)
+    return True, logfront + math.log(_incbeta_cf(1.0 - x, beta, alpha) / beta)
+
+def _betainc(x, alpha, beta, lbeta) :
+    """I_x(alpha, beta) with a precomputed log(B(alpha, beta))"""
+    if x <= 0.0 :
+        return 0.0
+    if x >= 1.0 :
+        return 1.0
+    (upper, logt) = _betainc_tail(x, alpha, beta, lbeta)
+    if upper :
+        return 1.0 - math.exp(logt)
+    return math.exp(logt)
+
+def _log_betainc(x, alpha, beta, lbeta) :
+    """log(I_x(alpha, beta)), accurate deep in the lower tail"""
+    if x <= 0.0 :
+        return float('-inf')
+    if x >= 1.0 :
+        return 0.0
+    (upper, logt) = _betainc_tail(x, alpha, beta, lbeta)
+    if upper :
+        return math.log1p(-math.exp(logt))
+    return logt
+
+def beta_cdf(x, alpha, beta, a, b, epsilon = 0.001, method = None) :
     """
     BETA(3.0, 4.0, 20.0) alpha=0.8 beta=3.2
     mean1 = 6.5 var = 8.0 sigma1 = 2.8
     mean2 = 6.6 var = 10.1 sigma2 = 3.2 (N = 1000)
     q25 = 4.0 q50 = 5.8 q75 = 8.6 | qConf = 9.4 (conf=80.0%)
 
+    Doctests::
+        >>> "%.4f" % beta_cdf(9.4, 0.8, 3.2, 3.0, 20.0)
+        '0.8324'
+        >>> "%.4f" % beta_cdf(9.4, 0.8, 3.2, 3.0, 20.0, method = CDF_QUADRATURE)
+        '0.8324'
+        >>> shapes = [(3.0, 0.5), (3.0, 0.3), (0.1, 0.1), (0.3, 2.0)]
+        >>> [abs(beta_cdf(x, alpha, beta, 3.0, 20.0, epsilon = 1e-5, method = CDF_QUADRATURE)
+        ...      - beta_cdf(x, alpha, beta, 3.0, 20.0)) < 1e-9
+        ...  for (alpha, beta) in shapes for x in (9.4, 20.0)]
+        [True, True, True, True, True, True, True, True]
+
     @param a, b, x: lower and upper bounds with a <= x <= b
     @param alpha, beta: shape parameters with alpha, beta > 0
+    @param epsilon: step size, only used by the quadrature backend
+    @param method: L{CDF_INCBETA} or L{CDF_QUADRATURE}, default L{CDF_METHOD}
     """
     if x < a or x > b:
         raise ValueError("x outside support [a,b]")
     if alpha > 0 and beta > 0 :
-        f = lambda t : beta_pdf(t, alpha, beta, a, b)
-        return INTEGRAL(f, a, x, epsilon = epsilon)
+        if method is None :
+            method = CDF_METHOD
+        if method == CDF_INCBETA :
+            return betainc_regularized(float(x - a) / (b - a), alpha, beta)
+        if method == CDF_QUADRATURE :
+            # exact distances to a and b, see INTEGRAL_GK
+            logscale = -LOG_BETA_CACHED(alpha, beta) - (alpha + beta - 1) * math.log(b - a)
+            f = lambda t, fromA, toX : _beta_kernel(fromA, (b - x) + toX, alpha, beta, logscale)
+            return INTEGRAL(f, a, x, epsilon = epsilon, endpoints = True)
+        raise ValueError("unknown cdf method %r" % (method,))
     raise ValueError("precondition violated: alpha, beta > 0")
 
-def beta_inv(conf, alpha, beta, a, b, epsilon = 0.001) :
+def beta_logcdf(x, alpha, beta, a, b) :
+    """
+    log(beta_cdf(x)) with the incomplete beta kept in log space, so tail
+    probabilities far below 1e-308 are still representable.
+
+    Doctests::
+        >>> "%.2f" % beta_logcdf(1.0, 500.0, 500.0, 0.0, 20.0)
+        '-834.63'
+
+    @param a, b, x: lower and upper bounds with a <= x <= b
+    @param alpha, beta: shape parameters with alpha, beta > 0
+    """
+    if x < a or x > b:
+        raise ValueError("x outside support [a,b]")
+    if alpha <= 0 or beta <= 0 :
+        raise ValueError("precondition violated: alpha, beta > 0")
+    return _log_betainc(float(x - a) / (b - a), alpha, beta, LOG_BETA_CACHED(alpha, beta))
+
+def beta_inv(conf, alpha, beta, a, b, epsilon = 0.001, method = None) :
     """
     BETA(3.0, 4.0, 20.0) alpha=0.8 beta=3.2
     mean1 = 6.5 var = 8.0 sigma1 = 2.8
     mean2 = 6.6 var = 10.1 sigma2 = 3.2 (N = 1000)
     q25 = 4.0 q50 = 5.8 q75 = 8.6 | qConf = 9.4 (conf=80.0%)
 
+    Doctests::
+        >>> "%.4f" % beta_inv(0.8, 0.8, 3.2, 3.0, 20.0)
+        '8.8371'
+
     @param a, b, x: lower and upper bounds with a <= x <= b
     @param alpha, beta: shape parameters with alpha, beta > 0
+    @param epsilon: step size, only used by the quadrature backend
+    @param method: L{INV_SOLVER} or L{INV_QUADRATURE}, default L{INV_METHOD}
     """
     if conf < 0 or conf > 1:
         raise ValueError("conf outside support [0,1]")
     if alpha <= 0 or beta <= 0 :
         raise ValueError("precondition violated: alpha, beta > 0")
+    if method is None :
+        method = INV_METHOD
+    if method == INV_SOLVER :
+        return beta_ppf(conf, alpha, beta, a, b)
+    if method != INV_QUADRATURE :
+        raise ValueError("unknown inv method %r" % (method,))
     summe = 0.0
     f = lambda t : beta_pdf(t, alpha, beta, a, b)
     for (A, tr) in iterIntegral(f, a, b, epsilon = epsilon) :
@@ -191,6 +617,106 @@ def beta_inv(conf, alpha, beta, a, b, epsilon = 0.001) :
             return tr
     return summe
 
+def _betainc_solve(conf, alpha, beta, lbeta, lo, hi, tol, maxiter) :
+    """
+    Solves I_u(alpha, beta) = conf for u in the bracket [lo, hi] with
+    I_lo <= conf <= I_hi.  Halley steps are taken while they stay inside
+    the bracket, otherwise the bracket is bisected.
+
+    Stops when the step or bracket is below tol and the residual
+    |I_u - conf| is below QUANTILE_RTOL * conf; for alpha < 1 and small
+    conf the root lies far below tol, so the x test alone would stop
+    too early.  Also stops when the bracket cannot shrink any further.
+    """
+    rtol = QUANTILE_RTOL * conf
+    u = alpha / (alpha + beta)
+    if not lo < u < hi :
+        u = 0.5 * (lo + hi)
+    steps = 0
+    for i in xrange(maxiter) :
+        steps += 1
+        F = _betainc(u, alpha, beta, lbeta) - conf
+        if F < 0.0 :
+            lo = u
+        else :
+            hi = u
+        if F == 0.0 or hi - lo <= 4.0 * sys.float_info.epsilon * hi :
+            break
+        if hi - lo <= tol and abs(F) <= rtol :
+            break
+        logf = (alpha - 1.0) * math.log(u) + (beta - 1.0) * math.log1p(-u) - lbeta
+        step = F / math.exp(logf)
+        # Halley correction with f'/f = (alpha-1)/u - (beta-1)/(1-u)
+        dlogf = (alpha - 1.0) / u - (beta - 1.0) / (1.0 - u)
+        denom = 1.0 - 0.5 * step * dlogf
+        if denom > 0.0 :
+            step = step / denom
+        un = u - step
+        if un == u :
+            break       # the step is below the resolution of u
+        if not lo < un < hi :
+            un = 0.5 * (lo + hi)
+        elif abs(step) <= tol and abs(F) <= rtol :
+            u = un
+            break
+        u = un
+    if metrics.ENABLED :
+        metrics.observe("pertbeta_steps", steps, metrics.COUNT_BUCKETS, (("solver", "betainc_solve"),))
+    return u
+
+def beta_ppf(conf, alpha, beta, a, b, tol = QUANTILE_TOL, maxiter = QUANTILE_MAXITER) :
+    """
+    Quantile function (inverse CDF): the x in [a, b] with beta_cdf(x) = conf.
+
+    Doctests::
+        >>> x = beta_ppf(0.95, 2.0, 5.0, 3.0, 2000.0)
+        >>> abs(beta_cdf(x, 2.0, 5.0, 3.0, 2000.0) - 0.95) < 1e-12
+        True
+        >>> # alpha < 1, small conf: the root is far below tol
+        >>> [abs(beta_cdf(beta_ppf(p, alpha, 3.0, 0.0, 1.0), alpha, 3.0, 0.0, 1.0) / p - 1.0) < 1e-9
+        ...  for (p, alpha) in ((1e-8, 0.5), (1e-6, 0.3), (1e-12, 0.8))]
+        [True, True, True]
+
+    @param tol: absolute tolerance for x (in units of [a, b]); the
+        probability residual must also be below L{QUANTILE_RTOL} * conf
+    @param maxiter: iteration cap; the best bracketed estimate is
+        returned when it is reached
+    """
+    return beta_ppf_batch([conf], alpha, beta, a, b, tol = tol, maxiter = maxiter)[0]
+
+def beta_ppf_batch(confs, alpha, beta, a, b, tol = QUANTILE_TOL, maxiter = QUANTILE_MAXITER) :
+    """
+    Quantiles for a list of confidence levels of one distribution.
+    log(B(alpha, beta)) is computed once and every root brackets the
+    search for the next larger confidence level.
+
+    Doctests::
+        >>> ["%.2f" % x for x in beta_ppf_batch([0.8, 0.25, 0.5], 0.8, 3.2, 3.0, 20.0)]
+        ['8.84', '3.95', '5.53']
+
+    @rtype: C{[float]} in the order of C{confs}
+    """
+    if alpha <= 0 or beta <= 0 :
+        raise ValueError("precondition violated: alpha, beta > 0")
+    for conf in confs :
+        if conf < 0 or conf > 1:
+            raise ValueError("conf outside support [0,1]")
+    lbeta = LOG_BETA_CACHED(alpha, beta)
+    width = float(b - a)
+    utol = tol / width
+    result = [None] * len(confs)
+    lo = 0.0
+    for (i, conf) in sorted(enumerate(confs), key = lambda item : item[1]) :
+        if conf <= 0.0 :
+            u = 0.0
+        elif conf >= 1.0 :
+            u = 1.0
+        else :
+            u = _betainc_solve(conf, alpha, beta, lbeta, lo, 1.0, utol, maxiter)
+            lo = u
+        result[i] = a + u * width
+    return result
+
 def alphaBetaFromAmB(a, m, b) :
     first_numer_alpha = 2.0 * (b + 4 * m - 5 * a)
     first_numer_beta = 2.0 * (5 * b - 4 * m - a)
@@ -206,6 +732,9 @@ def alphaBetaFromAmB(a, m, b) :
 #---
 class BetaDistribution(object) :
 
+    # no per-instance __dict__; _histograms is set on the first histogram call
+    __slots__ = ('a', 'b', 'alpha', 'beta', 'm', '_histograms')
+
     @classmethod
     def FromAmB(cls, a, m, b) :
 
@@ -232,10 +761,32 @@ class BetaDistribution(object) :
         self.beta = beta
         self.m = None
 
+    def __getstate__(self) :
+        # pickle protocols 0 and 1 need this with __slots__; the memo is dropped
+        return (self.a, self.b, self.alpha, self.beta, self.m)
+
+    def __setstate__(self, state) :
+        (self.a, self.b, self.alpha, self.beta, self.m) = state
+
     def random(self) :
         r = random.betavariate(self.alpha, self.beta)
         return self.a + r * (self.b - self.a)
 
+    def sample(self, n, rng = None, out = None) :
+        """
+        n random values in one call, see L{sampling.sampleBeta}.
+
+        Doctests::
+            >>> dist = BetaDistribution.FromAmB(3.0, 5.0, 12.0)
+            >>> values = dist.sample(1000, rng = 5)
+            >>> len(values), 3.0 <= min(values), max(values) <= 12.0
+            (1000, True, True)
+
+        @param rng: generator from L{sampling.makeRng}, a seed or None
+        @param out: buffer of at least n floats
+        """
+        return sampling.sampleBeta(n, self.alpha, self.beta, self.a, self.b, rng = rng, out = out)
+
     def mean(self) :
         if self.m is None :
             return None
@@ -250,19 +801,83 @@ class BetaDistribution(object) :
         return (b - a) / 6.0
 
 
-    def iterpdf(self, epsilon = 0.001):
-        """@rtype: C{[(int, float)]}"""
+    def cdf(self, x, epsilon = 0.001) :
+        """beta_cdf(x), clipped to 0 below a and 1 above b"""
+        if x <= self.a :
+            return 0.0
+        if x >= self.b :
+            return 1.0
+        return beta_cdf(x, self.alpha, self.beta, self.a, self.b, epsilon = epsilon)
+
+    def inv(self, conf) :
+        return beta_inv(conf, self.alpha, self.beta, self.a, self.b)
+
+    def bucketEdges(self, width = 1.0) :
+        """
+        Edges of buckets of the given width centered on multiples of
+        width, clipped to [a, b]; for integer bounds and width 1 these are
+        the buckets [x - 0.5, x + 0.5] for x in a..b.
+
+        Doctests::
+            >>> BetaDistribution(2, 4, 2.0, 2.0).bucketEdges()
+            [2, 2.5, 3.5, 4]
+            >>> BetaDistribution(0.2, 1.1, 2.0, 2.0).bucketEdges(0.5)
+            [0.2, 0.25, 0.75, 1.1]
+
+        @rtype: C{[float]}
+        """
+        a = self.a
+        b = self.b
+        first = int(math.floor(float(a) / width + 0.5))
+        last = int(math.floor(float(b) / width + 0.5))
+        edges = [a]
+        for k in xrange(first, last) :
+            edges.append((k + 0.5) * width)
+        edges.append(b)
+        return edges
+
+    def histogram(self, edges = None, width = 1.0, epsilon = 0.001) :
+        """
+        Probability mass per bucket [edges[i], edges[i+1]] as differences
+        of the CDF at the (sorted) edges, memoized per distribution.
+
+        Doctests::
+            >>> ["%.4f" % prop for (lo, hi, prop) in BetaDistribution(0, 4, 2.0, 2.0).histogram()]
+            ['0.0430', '0.2734', '0.3672', '0.2734', '0.0430']
+
+        @param edges: bucket boundaries; default L{bucketEdges}(width)
+        @rtype: C{[(float, float, float)]} (lo, hi, prop)
+        """
+        if edges is None :
+            edges = self.bucketEdges(width)
+        key = (self.a, self.b, self.alpha, self.beta, tuple(edges), epsilon)
+        try :
+            return self._histograms[key]
+        except AttributeError :
+            self._histograms = {}
+        except KeyError :
+            pass
+        cdfs = [self.cdf(x, epsilon = epsilon) for x in edges]
+        buckets = [(edges[i], edges[i + 1], max(0.0, cdfs[i + 1] - cdfs[i]))
+                   for i in xrange(len(edges) - 1)]
+        self._histograms[key] = buckets
+        return buckets
+
+    def iterpdf(self, epsilon = 0.001, width = 1.0):
+        """
+        Bucket masses by bucket center, see L{histogram}.
+        @rtype: C{[(int, float)]}
+        """
         a = self.a
         b = self.b
-        alpha = self.alpha
-        beta = self.beta
-        f = lambda t:beta_pdf(t, alpha, beta, a, b)
-        for x in xrange(a, b + 1) :
-            prop = INTEGRAL(f, max(a, x - 0.5), min(x + 0.5, b), epsilon = epsilon)
+        for (i, (lo, hi, prop)) in enumerate(self.histogram(width = width, epsilon = epsilon)) :
+            x = (int(math.floor(float(a) / width + 0.5)) + i) * width
+            if x == int(x) :
+                x = int(x)
             yield (x, prop)
 
-    def iterPDFasHistogram(self, maxDots = MAX_DOTS, epsilon = 0.001) :
-        bucketProps = list(self.iterpdf(epsilon))
+    def iterPDFasHistogram(self, maxDots = MAX_DOTS, epsilon = 0.001, width = 1.0) :
+        bucketProps = list(self.iterpdf(epsilon, width = width))
         maxProp = max([b[1] for b in bucketProps])
         header = "%5s %6s %s" % ("units", "CDF", "PDF")
         yield header
@@ -272,7 +887,10 @@ class BetaDistribution(object) :
             cdf += prop
             cdfPercent = 100.0 * cdf
             theDots = "*"*dots
-            line = "%(x)5i %(cdfPercent)6.2f %(theDots)s" % locals()
+            if isinstance(x, float) :
+                line = "%(x)5.4g %(cdfPercent)6.2f %(theDots)s" % locals()
+            else :
+                line = "%(x)5i %(cdfPercent)6.2f %(theDots)s" % locals()
             yield line
 
 #def iterPDFasHistogram(a, b, alpha, beta, maxDots = MAX_DOTS, epsilon = 0.001) :
@@ -293,6 +911,30 @@ class BetaDistribution(object) :
 def round(real) :
     return int(real + 0.5)
 
+#--- metrics (see L{metrics.enable})
+metrics.instrument(sys.modules[__name__],
+                   ["gamma", "log_gamma", "log_beta", "INTEGRAL", "INTEGRAL_GK",
+                    "BETA_GAMMA", "BETA_INTEGRAL", "BETA", "LOG_BETA_CACHED", "BETA_CACHED",
+                    "beta_pdf", "beta_logpdf", "betainc_regularized",
+                    "beta_cdf", "beta_logcdf", "beta_inv", "beta_ppf", "beta_ppf_batch",
+                    "alphaBetaFromAmB"])
+metrics.instrument(BetaDistribution, ["cdf", "inv", "histogram", "iterPDFasHistogram"],
+                   prefix = "BetaDistribution.")
+
+_beta_cache_seen = {}
+
+def _collect_beta_cache() :
+    """beta_cache statistics as counters, see L{metrics.addCollector}"""
+    stats = beta_cache.stats()
+    for key in ("hits", "misses", "evictions") :
+        last = _beta_cache_seen.get(key, 0)
+        delta = stats[key] - last if stats[key] >= last else stats[key] # cleared meanwhile
+        _beta_cache_seen[key] = stats[key]
+        if delta :
+            metrics.increment("pertbeta_beta_cache_%s_total" % (key,), delta)
+
+metrics.addCollector(_collect_beta_cache)
+
 #---
 def test_uniform(a, b, **keywords) :
     """
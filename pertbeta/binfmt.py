@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+Kompaktes spaltenweises Binärformat für Schätzungen und Stichproben der
+Simulation, einmal geschrieben und per mmap ohne Kopie gelesen.
+
+Aufbau einer Datei (little endian)::
+
+    Kopf (BINARY_HEADER Bytes): Kennung, Version, Art, Zeilen, Spalten,
+        Länge der Kennungstabelle, CRC-32 des Rumpfs
+    Schätzungen: je eine float64-Spalte O, N, P, alpha, beta (N fehlt:
+        NaN), dann Zeilen + 1 uint64-Offsets und die Kennungen (UTF-8)
+    Stichproben: Zeilen x Spalten float64, zeilenweise, damit große
+        Läufe blockweise angehängt und blockweise gelesen werden können
+
+Die Spalten liefert L{EstimateFile} mit NumPy als numpy.memmap; ohne
+NumPy als Kopie in array('d').
+"""
+
+#---
+#--- Python
+import argparse
+import array
+import math
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta.betadist import BetaDistribution
+from pertbeta.betaarray import BetaDistributionArray
+from pertbeta.columns import COLUMN_NAMES
+from pertbeta import ingest
+from pertbeta import simulation
+
+#---
+BINARY_MAGIC = "PERTBIN\0"
+BINARY_VERSION = 1
+BINARY_HEADER = 64              # bytes, keeps the columns 8-byte aligned
+KIND_ESTIMATES = 1
+KIND_SAMPLES = 2
+CHECKSUM_BLOCK = 1 << 24        # bytes per zlib.crc32 call when verifying
+
+_HEADER = struct.Struct("<8sHHIQQQI")
+_OFFSET = struct.Struct("<Q")
+
+#---
+def _requireNumpy() :
+    if numpy is None :
+        raise ImportError("pertbeta.binfmt sample files require numpy")
+
+def _packHeader(kind, rows, columns, identBytes, checksum) :
+    header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, kind, 0, rows, columns, identBytes, checksum)
+    return header + "\0" * (BINARY_HEADER - len(header))
+
+def _crc(data, checksum = 0) :
+    return zlib.crc32(data, checksum) & 0xffffffff
+
+def _littleEndian(values) :
+    """array('d') as little-endian bytes"""
+    if sys.byteorder == 'big' :
+        values = array.array('d', values)
+        values.byteswap()
+    return values.tostring()
+
+def _encodeIdent(ident) :
+    if isinstance(ident, unicode) :
+        return ident.encode('utf-8')
+    return str(ident)
+
+def isBinaryFile(path) :
+    """does path start with L{BINARY_MAGIC}"""
+    with open(path, 'rb') as f :
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def writeEstimates(path, estimates) :
+    """
+    Writes (ident, BetaDistribution) pairs, e.g. from
+    L{ingest.iterEstimates} or C{EstimateColumns.iteritems}.
+
+    @rtype: C{int} number of estimates
+    """
+    columns = dict((name, array.array('d')) for name in COLUMN_NAMES)
+    idents = []
+    for (ident, dist) in estimates :
+        m = dist.m if dist.m is not None else float('nan')
+        for (name, value) in zip(COLUMN_NAMES, (dist.a, m, dist.b, dist.alpha, dist.beta)) :
+            columns[name].append(value)
+        idents.append(_encodeIdent(ident))
+    rows = len(idents)
+    position = 0
+    offsets = [_OFFSET.pack(0)]
+    for ident in idents :
+        position += len(ident)
+        offsets.append(_OFFSET.pack(position))
+    parts = [_littleEndian(columns[name]) for name in COLUMN_NAMES] + ["".join(offsets), "".join(idents)]
+    checksum = 0
+    for part in parts :
+        checksum = _crc(part, checksum)
+    with open(path, 'wb') as f :
+        f.write(_packHeader(KIND_ESTIMATES, rows, len(COLUMN_NAMES), position, checksum))
+        for part in parts :
+            f.write(part)
+    return rows
+
+def convertCsv(inputCsv, path, errors = None) :
+    """
+    Doctests::
+        >>> import tempfile, shutil
+        >>> folder = tempfile.mkdtemp()
+        >>> inputCsv = os.path.join(folder, "plan.csv")
+        >>> with open(inputCsv, 'wb') as f :
+        ...     f.write("opt;likly;pess;ident\\n3;5;12;design\\n5;8;20;build\\n1;2;4;test\\n")
+        >>> convertCsv(inputCsv, os.path.join(folder, "plan.pbin"))
+        3
+        >>> with EstimateFile(os.path.join(folder, "plan.pbin")) as estimates :
+        ...     (estimates.idents(), list(estimates.column('b')), estimates.get(1).m)
+        (['design', 'build', 'test'], [12.0, 20.0, 4.0], 8.0)
+        >>> shutil.rmtree(folder)
+
+    @param errors: see L{ingest.iterEstimateChunks}
+    @rtype: C{int} number of estimates
+    """
+    with open(inputCsv, 'rb') as csvfile :
+        return writeEstimates(path, ingest.iterEstimates(csvfile, errors = errors))
+
+
+#---
+class _MappedFile(object) :
+    """header checks and the read-only mapping shared by both kinds"""
+
+    def __init__(self, path, kind, verify) :
+        self.path = path
+        with open(path, 'rb') as f :
+            size = os.fstat(f.fileno()).st_size
+            if size < BINARY_HEADER :
+                raise ValueError("%s: not a pertbeta binary file" % (path,))
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self._arrays = {}       # offset -> memmap, one mapping per column
+        try :
+            self._check(size, kind, verify)
+        except :
+            self._map.close()
+            raise
+
+    def _check(self, size, kind, verify) :
+        path = self.path
+        (magic, version, fileKind, reserved, self.rows, self.columns,
+         self._identBytes, self.checksum) = _HEADER.unpack(self._map[:_HEADER.size])
+        if magic != BINARY_MAGIC :
+            raise ValueError("%s: not a pertbeta binary file" % (path,))
+        if version > BINARY_VERSION :
+            raise ValueError("%s: format version %i is newer than %i" % (path, version, BINARY_VERSION))
+        if fileKind != kind :
+            raise ValueError("%s: file kind %i, expected %i" % (path, fileKind, kind))
+        if size != BINARY_HEADER + self._bodySize() :
+            raise ValueError("%s: %i bytes, expected %i" % (path, size, BINARY_HEADER + self._bodySize()))
+        if verify :
+            self.verify()
+
+    def _bodySize(self) :
+        raise NotImplementedError
+
+    def verify(self) :
+        """@raise ValueError: checksum of the body does not match the header"""
+        checksum = 0
+        for start in xrange(BINARY_HEADER, len(self._map), CHECKSUM_BLOCK) :
+            checksum = _crc(self._map[start:start + CHECKSUM_BLOCK], checksum)
+        if checksum != self.checksum :
+            raise ValueError("%s: checksum mismatch" % (self.path,))
+
+    def _floats(self, offset, count, shape = None) :
+        """zero-copy numpy.memmap, or an array('d') copy without NumPy"""
+        if numpy is not None :
+            if not count :
+                return numpy.zeros(shape or 0)
+            if offset not in self._arrays :
+                self._arrays[offset] = numpy.memmap(self.path, dtype = '<f8', mode = 'r', offset = offset,
+                                                    shape = shape or (count,))
+            return self._arrays[offset]
+        values = array.array('d', self._map[offset:offset + 8 * count])
+        if sys.byteorder == 'big' :
+            values.byteswap()
+        return values
+
+    def close(self) :
+        """memmap columns handed out stay valid"""
+        self._map.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, kind, value, traceback) :
+        self.close()
+        return False
+
+    def __len__(self) :
+        return self.rows
+
+
+class EstimateFile(_MappedFile) :
+    """
+    Estimates written by L{writeEstimates}, opened without parsing.
+
+    @param verify: check the CRC-32, which reads the whole file once;
+        False opens instantly
+    @raise ValueError: not an estimates file, newer version, truncated
+        or checksum mismatch
+    """
+
+    def __init__(self, path, verify = True) :
+        _MappedFile.__init__(self, path, KIND_ESTIMATES, verify)
+        self._offsetsStart = BINARY_HEADER + 8 * self.rows * len(COLUMN_NAMES)
+        self._identStart = self._offsetsStart + 8 * (self.rows + 1)
+
+    def _bodySize(self) :
+        if self.columns != len(COLUMN_NAMES) :
+            raise ValueError("%s: %i columns, expected %i" % (self.path, self.columns, len(COLUMN_NAMES)))
+        return 8 * self.rows * len(COLUMN_NAMES) + 8 * (self.rows + 1) + self._identBytes
+
+    def column(self, name) :
+        """
+        @param name: one of C{columns.COLUMN_NAMES}
+        @rtype: read-only C{numpy.memmap} (C{array.array} copy without NumPy)
+        """
+        index = COLUMN_NAMES.index(name)
+        return self._floats(BINARY_HEADER + 8 * self.rows * index, self.rows)
+
+    def ident(self, row) :
+        if not 0 <= row < self.rows :
+            raise IndexError("row %i outside 0..%i" % (row, self.rows - 1))
+        position = self._offsetsStart + 8 * row
+        (start,) = _OFFSET.unpack(self._map[position:position + 8])
+        (end,) = _OFFSET.unpack(self._map[position + 8:position + 16])
+        return self._map[self._identStart + start:self._identStart + end]
+
+    def idents(self) :
+        offsets = struct.unpack("<%iQ" % (self.rows + 1,), self._map[self._offsetsStart:self._identStart])
+        table = self._map[self._identStart:self._identStart + self._identBytes]
+        return [table[offsets[i]:offsets[i + 1]] for i in xrange(self.rows)]
+
+    def _dist(self, values) :
+        (a, m, b, alpha, beta) = [float(value) for value in values]
+        dist = BetaDistribution(a, b, alpha, beta)
+        if not math.isnan(m) :
+            dist.m = m
+        return dist
+
+    def get(self, row) :
+        """@rtype: C{BetaDistribution}"""
+        if not 0 <= row < self.rows :
+            raise IndexError("row %i outside 0..%i" % (row, self.rows - 1))
+        return self._dist([self.column(name)[row] for name in COLUMN_NAMES])
+
+    def iteritems(self) :
+        """(ident, BetaDistribution) in file order"""
+        columns = [self.column(name) for name in COLUMN_NAMES]
+        for (row, ident) in enumerate(self.idents()) :
+            yield (ident, self._dist([column[row] for column in columns]))
+
+    def iterChunks(self, chunkRows = ingest.CSV_CHUNK_ROWS) :
+        """
+        Like L{ingest.iterEstimateChunks}: lists of (rowNumber, ident, O,
+        N, P), integral values as C{int}; rowNumber counts from 1.
+        """
+        idents = self.idents()
+        (a, m, b) = [self.column(name) for name in ('a', 'm', 'b')]
+        for start in xrange(0, self.rows, chunkRows) :
+            chunk = []
+            for row in xrange(start, min(start + chunkRows, self.rows)) :
+                values = (float(a[row]), float(m[row]), float(b[row]))
+                if all(value == int(value) for value in values) :
+                    values = tuple(int(value) for value in values)
+                chunk.append((row + 1,) + (idents[row],) + values)
+            yield chunk
+
+    def toArray(self) :
+        """@rtype: C{betaarray.BetaDistributionArray} over the mapped columns"""
+        return BetaDistributionArray(*[self.column(name) for name in ('a', 'b', 'alpha', 'beta')],
+                                     m = self.column('m'))
+
+    def accumulator(self) :
+        """@rtype: C{ingest.PortfolioAccumulator} from column reductions"""
+        return ingest.PortfolioAccumulator.FromColumns(*[self.column(name) for name in COLUMN_NAMES])
+
+
+#---
+class SampleWriter(object) :
+    """
+    Appends blocks of simulation samples, rows x columns float64, so a
+    run larger than RAM goes to disk batch by batch; L{close} writes the
+    row count and checksum into the header.  Requires NumPy.
+    """
+
+    def __init__(self, path, columns = 1) :
+        _requireNumpy()
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self._checksum = 0
+        self._file = open(path, 'wb')
+        self._file.write(_packHeader(KIND_SAMPLES, 0, columns, 0, 0))
+
+    def append(self, block) :
+        """
+        @param block: rows x columns, or a vector of rows if columns == 1
+        """
+        block = numpy.ascontiguousarray(block, dtype = '<f8')
+        if block.ndim == 1 :
+            block = block.reshape(-1, 1)
+        if block.shape[1] != self.columns :
+            raise ValueError("block has %i columns, expected %i" % (block.shape[1], self.columns))
+        data = block.tostring()
+        self._checksum = _crc(data, self._checksum)
+        self._file.write(data)
+        self.rows += block.shape[0]
+
+    def close(self) :
+        if self._file.closed :
+            return
+        self._file.seek(0)
+        self._file.write(_packHeader(KIND_SAMPLES, self.rows, self.columns, 0, self._checksum))
+        self._file.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, kind, value, traceback) :
+        self.close()
+        return False
+
+
+class SampleFile(_MappedFile) :
+    """
+    Samples written by L{SampleWriter}.  Requires NumPy.
+
+    Doctests::
+        >>> import tempfile, shutil
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> folder = tempfile.mkdtemp()
+        >>> path = os.path.join(folder, "run.pbin")
+        >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0), BetaDistribution.FromAmB(1.0, 2.0, 6.0)]
+        >>> spillSimulation(path, dists, N = 5000, seed = 1, batchSize = 1024, perEstimate = True)
+        5000
+        >>> with SampleFile(path) as samples :
+        ...     matrix = samples.matrix()
+        ...     totals = numpy.concatenate(list(samples.iterTotals(blockRows = 999)))
+        >>> matrix.shape, bool(numpy.all(totals == matrix.sum(axis = 1)))
+        ((5000, 2), True)
+        >>> exact = simulation.simulateTotals(dists, N = 5000, seed = 1, batchSize = 1024)
+        >>> float(numpy.abs(numpy.sort(totals) - exact.totals()).max()) < 1e-12
+        True
+        >>> shutil.rmtree(folder)
+
+    @param verify: see L{EstimateFile}
+    """
+
+    def __init__(self, path, verify = True) :
+        _requireNumpy()
+        _MappedFile.__init__(self, path, KIND_SAMPLES, verify)
+
+    def _bodySize(self) :
+        return 8 * self.rows * self.columns
+
+    def matrix(self) :
+        """@rtype: read-only C{numpy.memmap} rows x columns"""
+        return self._floats(BINARY_HEADER, self.rows * self.columns, (self.rows, self.columns))
+
+    def iterBlocks(self, blockRows = simulation.SIMULATION_BATCH) :
+        """views of at most blockRows rows; the OS pages them in and out"""
+        matrix = self.matrix()
+        for start in xrange(0, self.rows, blockRows) :
+            yield matrix[start:start + blockRows]
+
+    def iterTotals(self, blockRows = simulation.SIMULATION_BATCH) :
+        """
+        Row sums per block, e.g. for C{streamstats.summarize}; a single
+        column is returned as is.
+        """
+        for block in self.iterBlocks(blockRows) :
+            if self.columns == 1 :
+                yield numpy.asarray(block[:, 0])
+            else :
+                yield block.sum(axis = 1)
+
+    def result(self) :
+        """@rtype: C{simulation.SimulationResult} of the row sums, in RAM"""
+        return simulation.SimulationResult(numpy.concatenate(list(self.iterTotals())))
+
+
+def spillSimulation(path, dists, N = simulation.SIMULATION_SAMPLES, seed = None,
+                    batchSize = simulation.SIMULATION_BATCH, perEstimate = False) :
+    """
+    Runs the simulation batch by batch straight into a sample file.
+
+    @param perEstimate: one column per estimate (L{simulation.iterSampleBatches}),
+        else a single column of totals (L{simulation.iterTotalBatches})
+    @rtype: C{int} rows written
+    """
+    dists = list(dists)
+    if perEstimate :
+        (columns, batches) = (len(dists), simulation.iterSampleBatches(dists, N, seed, batchSize))
+    else :
+        (columns, batches) = (1, simulation.iterTotalBatches(dists, N, seed, batchSize))
+    with SampleWriter(path, columns) as writer :
+        for batch in batches :
+            writer.append(batch)
+    return writer.rows
+
+
+#---
+def parseArguments(argv) :
+    parser = argparse.ArgumentParser(description = "convert O;N;P;ident CSV to the pertbeta binary format")
+    parser.add_argument('inputCsv')
+    parser.add_argument('output')
+    return parser.parse_args(argv)
+
+if __name__ == "__main__" :
+    args = parseArguments(sys.argv[1:])
+    print "%i estimates" % (convertCsv(args.inputCsv, args.output),)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Vorberechneter Index der Verteilungsfunktion einer Gesamtdauer: sortierte
+Stützstellen (x, P(total <= x)), einmal aus einer Simulation oder
+Faltung gewonnen.  Vorwärts- ("mit welcher Wahrscheinlichkeit bis x?")
+und Rückwärtsanfragen ("welches x für 90 %?") kosten dann eine binäre
+Suche und eine lineare Interpolation.
+
+Die Stützstellen liegen an den Rändern dichter, wo sich die Quantile
+schneller ändern.
+"""
+
+#---
+#--- Python
+import bisect
+import math
+
+#---
+CDF_INDEX_KNOTS = 1024      # intervals between the knots
+
+#---
+def probabilityKnots(knots = CDF_INDEX_KNOTS) :
+    """
+    Doctests::
+        >>> ["%.3f" % p for p in probabilityKnots(4)]
+        ['0.000', '0.146', '0.500', '0.854', '1.000']
+    """
+    return [0.5 - 0.5 * math.cos(math.pi * i / knots) for i in xrange(knots + 1)]
+
+def _interpolate(x, x0, x1, y0, y1) :
+    if x1 <= x0 :
+        return y1
+    return y0 + (x - x0) / (x1 - x0) * (y1 - y0)
+
+
+#---
+class CdfIndex(object) :
+    """
+    Doctests::
+        >>> index = CdfIndex([10.0, 20.0, 40.0], [0.0, 0.5, 1.0])
+        >>> index.probability(15.0), index.probability(5.0), index.probability(50.0)
+        (0.25, 0.0, 1.0)
+        >>> index.percentile(0.75), index.percentile(0.5)
+        (30.0, 20.0)
+
+    @param xs: non-decreasing totals
+    @param ps: non-decreasing probabilities from 0 to 1, P(total <= x)
+    @param method: where the knots came from, for display
+    """
+
+    def __init__(self, xs, ps, method = None) :
+        xs = [float(x) for x in xs]
+        ps = [float(p) for p in ps]
+        if len(xs) != len(ps) or len(xs) < 2 :
+            raise ValueError("need at least two knots with x and p")
+        if any(xs[i] > xs[i + 1] or ps[i] > ps[i + 1] for i in xrange(len(xs) - 1)) :
+            raise ValueError("knots must be sorted")
+        if ps[0] != 0.0 or ps[-1] != 1.0 :
+            raise ValueError("probabilities must run from 0 to 1")
+        self.xs = xs
+        self.ps = ps
+        self.method = method
+
+    @classmethod
+    def FromQuantiles(cls, quantile, knots = CDF_INDEX_KNOTS, method = None) :
+        """
+        @param quantile: function q -> total, e.g. C{ConvolutionResult.percentile}
+        """
+        ps = probabilityKnots(knots)
+        xs = []
+        for p in ps :
+            # round-off may make a quantile function dip slightly
+            x = quantile(p)
+            xs.append(max(x, xs[-1]) if xs else x)
+        return cls(xs, ps, method)
+
+    @classmethod
+    def FromResult(cls, result, knots = CDF_INDEX_KNOTS, method = None) :
+        """
+        Doctests::
+            >>> from pertbeta.betadist import BetaDistribution
+            >>> from pertbeta import convolution
+            >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0 + i) for i in xrange(20)]
+            >>> total = convolution.convolveTotals(dists)
+            >>> index = CdfIndex.FromResult(total, method = "convolution")
+            >>> [abs(index.percentile(q) - total.percentile(q)) < 1e-3 * total.sigma() for q in (0.05, 0.5, 0.9, 0.999)]
+            [True, True, True, True]
+            >>> x = total.percentile(0.9)
+            >>> abs(index.probability(x) - 0.9) < 1e-4
+            True
+
+        @param result: C{simulation.SimulationResult}, C{SketchResult} or
+            C{convolution.ConvolutionResult}; a percentile that returns
+            (value, lower, upper) contributes its value
+        """
+        def quantile(q) :
+            value = result.percentile(q)
+            return value[0] if isinstance(value, tuple) else value
+        return cls.FromQuantiles(quantile, knots, method)
+
+    @classmethod
+    def FromDict(cls, data) :
+        """inverse of L{toDict}"""
+        return cls(data["xs"], data["ps"], data.get("method"))
+
+    def toDict(self) :
+        return {"xs" : self.xs, "ps" : self.ps, "method" : self.method}
+
+    def __len__(self) :
+        return len(self.xs)
+
+    def probability(self, x) :
+        """P(total <= x) in O(log n)"""
+        xs = self.xs
+        if x < xs[0] :
+            return 0.0
+        if x >= xs[-1] :
+            return 1.0
+        i = bisect.bisect_right(xs, x)
+        return _interpolate(x, xs[i - 1], xs[i], self.ps[i - 1], self.ps[i])
+
+    def percentile(self, q) :
+        """
+        Inverse of L{probability} in O(log n).
+
+        @param q: probability in [0, 1]
+        """
+        if q < 0 or q > 1 :
+            raise ValueError("q outside support [0,1]")
+        ps = self.ps
+        i = min(max(bisect.bisect_left(ps, q), 1), len(ps) - 1)
+        return _interpolate(q, ps[i - 1], ps[i], self.xs[i - 1], self.xs[i])
+
+    def iterLines(self, percentiles = (0.5, 0.8, 0.95), deadline = None) :
+        knots = len(self.xs)
+        method = self.method or "?"
+        yield "CDF INDEX (%(method)s, %(knots)i knots)" % locals()
+        for q in percentiles :
+            value = self.percentile(q)
+            qPercent = 100.0 * q
+            yield "q%(qPercent)02.0f = %(value).1f" % locals()
+        if deadline is not None :
+            yield "P(total <= %.1f) = %.3f" % (deadline, self.probability(deadline))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Spaltenweiser Speicher für viele Schätzungen: O/N/P, alpha und beta in
+array('d')-Spalten plus Index Kennung -> Zeile.  Pro Schätzung kostet
+das 40 Bytes statt eines Objekts mit Attributen; Summen über alle
+Schätzungen sind Reduktionen einzelner Spalten.
+
+BetaDistribution-Objekte werden erst beim Lesen erzeugt.
+"""
+
+#---
+#--- Python
+import array
+import math
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta.betadist import BetaDistribution
+from pertbeta.betaarray import BetaDistributionArray
+from pertbeta import ingest
+
+#---
+COLUMN_NAMES = ('a', 'm', 'b', 'alpha', 'beta')
+
+#---
+class EstimateColumns(object) :
+    """
+    Doctests::
+        >>> store = EstimateColumns()
+        >>> store.put("design", BetaDistribution.FromAmB(3, 5, 12))
+        >>> store.put("build", BetaDistribution.FromAmB(5, 8, 20))
+        >>> store.put("test", BetaDistribution.FromAmB(1, 2, 4))
+        >>> store.remove("design")
+        >>> len(store), "design" in store, store.get("build").m
+        (2, False, 8.0)
+        >>> sorted(ident for (ident, dist) in store.iteritems())
+        ['build', 'test']
+        >>> store.sum('b'), store.columnSums(['a', 'm'])
+        (24.0, [6.0, 10.0])
+    """
+
+    def __init__(self) :
+        self._idents = []
+        self._rows = {}       # ident -> row
+        self._columns = dict((name, array.array('d')) for name in COLUMN_NAMES)
+
+    def __len__(self) :
+        return len(self._idents)
+
+    def __contains__(self, ident) :
+        return ident in self._rows
+
+    def put(self, ident, dist) :
+        """adds the estimate ident, or replaces it; dist.m None is stored as NaN"""
+        values = (dist.a, dist.m if dist.m is not None else float('nan'), dist.b, dist.alpha, dist.beta)
+        row = self._rows.get(ident)
+        if row is None :
+            self._rows[ident] = len(self._idents)
+            self._idents.append(ident)
+            for (name, value) in zip(COLUMN_NAMES, values) :
+                self._columns[name].append(value)
+        else :
+            for (name, value) in zip(COLUMN_NAMES, values) :
+                self._columns[name][row] = value
+
+    def remove(self, ident) :
+        """
+        Moves the last row into the gap, so iteration order changes.
+
+        @raise KeyError: unknown ident
+        """
+        row = self._rows.pop(ident)
+        last = len(self._idents) - 1
+        if row != last :
+            moved = self._idents[last]
+            self._idents[row] = moved
+            self._rows[moved] = row
+            for column in self._columns.itervalues() :
+                column[row] = column[last]
+        self._idents.pop()
+        for column in self._columns.itervalues() :
+            column.pop()
+
+    def _dist(self, row) :
+        columns = self._columns
+        dist = BetaDistribution(columns['a'][row], columns['b'][row], columns['alpha'][row], columns['beta'][row])
+        m = columns['m'][row]
+        if not math.isnan(m) :
+            dist.m = m
+        return dist
+
+    def get(self, ident) :
+        """@raise KeyError: unknown ident"""
+        return self._dist(self._rows[ident])
+
+    def idents(self) :
+        return list(self._idents)
+
+    def iteritems(self) :
+        """(ident, BetaDistribution) in row order"""
+        for (row, ident) in enumerate(self._idents) :
+            yield (ident, self._dist(row))
+
+    def values(self) :
+        return [self._dist(row) for row in xrange(len(self._idents))]
+
+    def _view(self, name) :
+        """numpy view of a column; only valid until the next put or remove"""
+        column = self._columns[name]
+        if not len(column) :
+            return numpy.zeros(0)
+        return numpy.frombuffer(column, dtype = float)
+
+    def column(self, name) :
+        """
+        @param name: one of L{COLUMN_NAMES}
+        @rtype: C{numpy.ndarray} (C{array.array} without NumPy), a copy
+        """
+        if numpy is not None :
+            return self._view(name).copy()
+        return array.array('d', self._columns[name])
+
+    def sum(self, name) :
+        if numpy is not None :
+            return float(self._view(name).sum())
+        return math.fsum(self._columns[name])
+
+    def columnSums(self, names) :
+        return [self.sum(name) for name in names]
+
+    def accumulator(self) :
+        """
+        Footer sums from column reductions.
+
+        Doctests::
+            >>> store = EstimateColumns(); acc = ingest.PortfolioAccumulator()
+            >>> for i in xrange(1, 40) :
+            ...     dist = BetaDistribution.FromAmB(i, i + 2, 2 * i + 5)
+            ...     store.put(i, dist); acc.add(dist)
+            >>> other = store.accumulator()
+            >>> [abs(getattr(other, name) - getattr(acc, name)) < 1e-9 for name in ('count', 'm', 'mean', 'variance', 'kappa3')]
+            [True, True, True, True, True]
+
+        @rtype: C{ingest.PortfolioAccumulator}
+        """
+        columns = [self._view(name) if numpy is not None else self._columns[name] for name in COLUMN_NAMES]
+        return ingest.PortfolioAccumulator.FromColumns(*columns)
+
+    def toArray(self) :
+        """@rtype: C{betaarray.BetaDistributionArray} over copies of the columns"""
+        return BetaDistributionArray(*[self.column(name) for name in ('a', 'b', 'alpha', 'beta')],
+                                     m = self.column('m'))
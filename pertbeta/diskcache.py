@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Persistenter, inhaltsadressierter Cache in einer SQLite-Datei: Schlüssel
+sind Hashes der Eingaben (L{makeKey}), Werte JSON-Texte.  Mehrere
+Prozesse dürfen dieselbe Datei gleichzeitig benutzen (WAL, Schreiben in
+BEGIN IMMEDIATE-Transaktionen mit Wartezeit).
+
+Die Zahl der Einträge ist begrenzt; beim Überschreiten werden die am
+längsten nicht benutzten Einträge verdrängt.
+"""
+
+#---
+#--- Python
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+#---
+DISK_CACHE_ENTRIES = 5000000
+DISK_CACHE_TIMEOUT = 60.0       # seconds to wait for another process' write lock
+EVICTION_FRACTION = 0.9         # eviction shrinks the cache to this fraction of maxEntries
+SQL_BATCH = 500                 # keys per statement, below SQLite's variable limit
+
+#---
+def makeKey(*parts) :
+    """
+    Doctests::
+        >>> makeKey("design", 3, 5, 12) == makeKey("design", 3, 5, 12), makeKey(1) == makeKey(1.0)
+        (True, False)
+
+    @param parts: JSON-serializable inputs; types matter, 1 and 1.0 differ
+    @rtype: C{str} hex SHA-1
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys = True)).hexdigest()
+
+def _batches(items) :
+    for start in xrange(0, len(items), SQL_BATCH) :
+        yield items[start:start + SQL_BATCH]
+
+class DiskCache(object) :
+    """
+    Doctests::
+        >>> import tempfile, shutil
+        >>> folder = tempfile.mkdtemp()
+        >>> cache = DiskCache(os.path.join(folder, "cache.db"), maxEntries = 10)
+        >>> cache.putMany([(makeKey(i), {"row" : i}) for i in xrange(8)])
+        >>> sorted(cache.getMany([makeKey(1), makeKey(99)]).values())
+        [{u'row': 1}]
+        >>> cache.putMany([(makeKey(i), {"row" : i}) for i in xrange(8, 12)])
+        >>> sorted((name, value) for (name, value) in cache.stats().items() if name != 'path')
+        [('evictions', 3), ('hits', 1), ('maxEntries', 10), ('misses', 1), ('size', 9)]
+        >>> makeKey(1) in cache, makeKey(0) in cache
+        (True, False)
+        >>> cache.close(); shutil.rmtree(folder)
+    """
+
+    def __init__(self, path, maxEntries = DISK_CACHE_ENTRIES, timeout = DISK_CACHE_TIMEOUT) :
+        if maxEntries < 1 :
+            raise ValueError("maxEntries must be >= 1")
+        self.path = path
+        self._maxEntries = maxEntries
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # autocommit; writes use explicit BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, timeout = timeout, isolation_level = None,
+                                   check_same_thread = False)
+        self._db.text_factory = str     # json.loads parses str about twice as fast as unicode
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        with self._transaction() as db :
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('count', 0)")
+
+    def _transaction(self) :
+        return _Transaction(self._db, self._lock)
+
+    def __contains__(self, key) :
+        """does not count as hit or miss"""
+        with self._lock :
+            return self._db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def getMany(self, keys) :
+        """
+        Cached values of the given keys; found entries count as recently used.
+
+        @rtype: C{dict} key -> value, missing keys are left out
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock :
+            for batch in _batches(keys) :
+                sql = "SELECT key, value FROM entries WHERE key IN (%s)" % (",".join("?" * len(batch)),)
+                for (key, value) in self._db.execute(sql, batch) :
+                    found[key] = json.loads(value)
+            self._hits += len(found)
+            self._misses += len(set(keys)) - len(found)
+        if found :
+            now = time.time()
+            with self._transaction() as db :
+                for batch in _batches(found.keys()) :
+                    db.execute("UPDATE entries SET used = ? WHERE key IN (%s)" % (",".join("?" * len(batch)),),
+                               [now] + batch)
+        return found
+
+    def get(self, key, default = None) :
+        return self.getMany([key]).get(key, default)
+
+    def putMany(self, items) :
+        """
+        @param items: (key, JSON-serializable value); a key that is
+            already cached keeps its value, as keys address content
+        """
+        now = time.time()
+        rows = [(key, json.dumps(value), now) for (key, value) in items]
+        with self._transaction() as db :
+            added = 0
+            for batch in _batches(rows) :
+                added += db.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", batch).rowcount
+            db.execute("UPDATE meta SET value = value + ? WHERE name = 'count'", (added,))
+            count = db.execute("SELECT value FROM meta WHERE name = 'count'").fetchone()[0]
+            if count > self._maxEntries :
+                excess = count - int(EVICTION_FRACTION * self._maxEntries)
+                evicted = db.execute("DELETE FROM entries WHERE key IN "
+                                     "(SELECT key FROM entries ORDER BY used LIMIT ?)", (excess,)).rowcount
+                db.execute("UPDATE meta SET value = value - ? WHERE name = 'count'", (evicted,))
+                self._evictions += evicted
+
+    def put(self, key, value) :
+        self.putMany([(key, value)])
+
+    def stats(self) :
+        """counters of this process, size of the shared file"""
+        with self._lock :
+            size = self._db.execute("SELECT value FROM meta WHERE name = 'count'").fetchone()[0]
+            return {"hits" : self._hits, "misses" : self._misses, "evictions" : self._evictions,
+                    "size" : size, "maxEntries" : self._maxEntries, "path" : self.path}
+
+    def clear(self) :
+        with self._transaction() as db :
+            db.execute("DELETE FROM entries")
+            db.execute("UPDATE meta SET value = 0 WHERE name = 'count'")
+
+    def close(self) :
+        with self._lock :
+            self._db.close()
+
+class _Transaction(object) :
+    """BEGIN IMMEDIATE ... COMMIT, or ROLLBACK on an exception"""
+
+    def __init__(self, db, lock) :
+        self._db = db
+        self._lock = lock
+
+    def __enter__(self) :
+        self._lock.acquire()
+        try :
+            self._db.execute("BEGIN IMMEDIATE")
+        except :
+            self._lock.release()
+            raise
+        return self._db
+
+    def __exit__(self, kind, value, traceback) :
+        try :
+            self._db.execute("COMMIT" if kind is None else "ROLLBACK")
+        finally :
+            self._lock.release()
+        return False
+
+
+#---
+_opened = {}
+_openedLock = threading.Lock()
+
+def openCache(path, maxEntries = DISK_CACHE_ENTRIES) :
+    """
+    One L{DiskCache} per path and process; forked workers open their own
+    connection instead of sharing the parent's.
+    """
+    key = (os.path.abspath(path), os.getpid())
+    with _openedLock :
+        cache = _opened.get(key)
+        if cache is None :
+            cache = _opened[key] = DiskCache(path, maxEntries)
+        return cache
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Inkrementelle Monte-Carlo-Simulation der Gesamtdauer: jede Schätzung
+behält ihre Stichprobenspalte, die Summen werden laufend gehalten.
+Ändern, Hinzufügen oder Entfernen einer Schätzung kostet O(N) für diese
+eine Schätzung.
+
+Gemeinsame Zufallszahlen: die Spalte einer Schätzung entsteht per
+inverser CDF aus Gleichverteilten, die nur von seed und Kennung
+abhängen.  Eine geänderte Schätzung verschiebt dieselben Ziehungen, die
+Differenzen der Quantile sind also stabil und vergleichbar.
+"""
+
+#---
+#--- Python
+import bisect
+import hashlib
+import math
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta import sampling
+from pertbeta import simulation
+from pertbeta.betaarray import BetaDistributionArray
+
+#---
+INCREMENTAL_KNOTS = 4096    # knots of the interpolated inverse CDF
+
+#---
+def streamKey(ident) :
+    """stable 32 bit key of an estimate's random stream"""
+    if isinstance(ident, unicode) :
+        ident = ident.encode('utf-8')
+    return int(hashlib.sha1(str(ident)).hexdigest()[:8], 16)
+
+def _knots(K) :
+    """u in [0, 1], dense at both ends where the quantile function is steep"""
+    return [0.5 - 0.5 * math.cos(math.pi * i / K) for i in xrange(K + 1)]
+
+def inverseSample(dist, uniforms, knots = INCREMENTAL_KNOTS) :
+    """
+    dist.inv(u) for each u, interpolated between quantiles at knots + 1
+    points (error about 3e-5 of b - a for 4096 knots).
+
+    Doctests::
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> dist = BetaDistribution.FromAmB(2.0, 4.0, 9.0)
+        >>> [abs(x - dist.inv(u)) < 1e-3 for (u, x) in zip([0.1, 0.5, 0.99], inverseSample(dist, [0.1, 0.5, 0.99]))]
+        [True, True, True]
+    """
+    us = _knots(knots)
+    if numpy is not None :
+        xs = BetaDistributionArray([dist.a], [dist.b], [dist.alpha], [dist.beta]).ppf(numpy.array(us))
+        return numpy.interp(uniforms, us, xs)
+    xs = [dist.inv(u) for u in us]
+    result = []
+    for u in uniforms :
+        i = min(max(bisect.bisect_right(us, u), 1), knots)
+        frac = (u - us[i - 1]) / (us[i] - us[i - 1])
+        result.append(xs[i - 1] + frac * (xs[i] - xs[i - 1]))
+    return result
+
+
+#---
+class IncrementalSimulation(object) :
+    """
+    N joint samples of the total over a changing set of estimates.
+
+    Doctests::
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> sim = IncrementalSimulation(N = 20000, seed = 3)
+        >>> for i in xrange(10) :
+        ...     sim.setEstimate("task%i" % i, BetaDistribution.FromAmB(2.0, 4.0, 9.0))
+        >>> before = sim.quantiles([0.5, 0.95])
+        >>> sim.setEstimate("task3", BetaDistribution.FromAmB(2.0, 6.0, 15.0))
+        >>> sim.removeEstimate("task7")
+        >>> fresh = IncrementalSimulation(N = 20000, seed = 3)
+        >>> for ident in sim.idents() :
+        ...     fresh.setEstimate(ident, sim.estimate(ident))
+        >>> [abs(x - y) < 1e-6 for (x, y) in zip(sim.quantiles([0.5, 0.95]), fresh.quantiles([0.5, 0.95]))]
+        [True, True]
+        >>> delta = sim.whatIf("task3", BetaDistribution.FromAmB(2.0, 4.0, 9.0), [0.5])[0] - sim.quantiles([0.5])[0]
+        >>> -3.0 < delta < -1.0, len(sim), sim.result().N
+        (True, 9, 20000)
+
+    @param storeColumns: keep each estimate's samples (4 bytes per sample
+        with NumPy) so a change subtracts them; False recomputes them
+        from the common random numbers instead
+    """
+
+    def __init__(self, N = simulation.SIMULATION_SAMPLES, seed = 0, storeColumns = True,
+                 knots = INCREMENTAL_KNOTS) :
+        if N <= 0 :
+            raise ValueError("N must be positive")
+        self.N = N
+        self.seed = seed
+        self.knots = knots
+        self._storeColumns = storeColumns
+        self._dists = {}       # ident -> dist
+        self._columns = {}     # ident -> samples added to the totals
+        if numpy is not None :
+            self._totals = numpy.zeros(N)
+        else :
+            self._totals = [0.0] * N
+
+    def __len__(self) :
+        return len(self._dists)
+
+    def idents(self) :
+        return self._dists.keys()
+
+    def estimate(self, ident) :
+        return self._dists[ident]
+
+    def _column(self, ident, dist) :
+        uniforms = sampling.sampleUniform(self.N, sampling.makeStream(self.seed, streamKey(ident)))
+        column = inverseSample(dist, uniforms, self.knots)
+        if numpy is not None :
+            # removal subtracts exactly the float32 values that were added, so it is
+            # reproducible, up to float64 rounding of the running totals
+            column = column.astype(numpy.float32)
+        return column
+
+    def _add(self, column, sign, totals = None) :
+        if totals is None :
+            totals = self._totals
+        if numpy is not None :
+            if sign > 0 :
+                totals += column
+            else :
+                totals -= column
+        else :
+            for i in xrange(self.N) :
+                totals[i] += sign * column[i]
+        return totals
+
+    def _oldColumn(self, ident) :
+        if ident in self._columns :
+            return self._columns[ident]
+        return self._column(ident, self._dists[ident])
+
+    def setEstimate(self, ident, dist) :
+        """adds or replaces the estimate ident"""
+        if ident in self._dists :
+            self._add(self._oldColumn(ident), -1)
+        column = self._column(ident, dist)
+        self._add(column, +1)
+        self._dists[ident] = dist
+        if self._storeColumns :
+            self._columns[ident] = column
+
+    def removeEstimate(self, ident) :
+        """@raise KeyError: unknown ident"""
+        self._add(self._oldColumn(ident), -1)
+        del self._dists[ident]
+        self._columns.pop(ident, None)
+
+    def totals(self) :
+        """current totals in sample order (not sorted)"""
+        return self._totals
+
+    def _quantiles(self, totals, qs) :
+        """SimulationResult.percentile values by selection instead of sorting"""
+        ranks = [q * (self.N - 1) for q in qs]
+        positions = sorted(set([int(math.floor(r)) for r in ranks] + [int(math.ceil(r)) for r in ranks]))
+        if numpy is not None :
+            selected = numpy.partition(totals, positions)
+        else :
+            selected = sorted(totals)
+        result = []
+        for rank in ranks :
+            i = int(math.floor(rank))
+            j = int(math.ceil(rank))
+            frac = rank - i
+            result.append(float(selected[i]) * (1.0 - frac) + float(selected[j]) * frac)
+        return result
+
+    def quantiles(self, qs) :
+        """
+        @param qs: probabilities in [0, 1]
+        @rtype: C{[float]} in O(N) with NumPy
+        """
+        for q in qs :
+            if q < 0 or q > 1 :
+                raise ValueError("q outside support [0,1]")
+        return self._quantiles(self._totals, qs)
+
+    def whatIf(self, ident, dist, qs) :
+        """
+        Quantiles of the total if ident had dist (None: without ident),
+        leaving the state unchanged.
+        """
+        totals = self._totals.copy() if numpy is not None else list(self._totals)
+        if ident in self._dists :
+            self._add(self._oldColumn(ident), -1, totals)
+        if dist is not None :
+            self._add(self._column(ident, dist), +1, totals)
+        return self._quantiles(totals, qs)
+
+    def result(self) :
+        """@rtype: C{simulation.SimulationResult} of the current totals"""
+        return simulation.SimulationResult(self._totals)
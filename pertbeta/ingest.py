@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Einlesen großer Schätzungsdateien (CSV mit O;N;P;Kennung) in Blöcken
+mit konstantem Speicherbedarf, sowie inkrementelle Aggregation
+für die Summenzeile (ACCU).
+"""
+
+#---
+#--- Python
+import csv
+import math
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta.betadist import BetaDistribution
+from pertbeta import simulation
+
+#---
+CSV_CHUNK_ROWS = 10000
+ACCUMULATOR_FIELDS = ('count', 'a', 'm', 'b', 'mean', 'variance', 'kappa1', 'kappa2', 'kappa3')
+
+#---
+def parseEstimateRow(rowNumber, rowList) :
+    """
+    Doctests::
+        >>> parseEstimateRow(1, ["3", "5.5", "12", "design"])
+        ('design', 3.0, 5.5, 12.0)
+        >>> parseEstimateRow(2, ["3", "5", "inf", "build"])
+        Traceback (most recent call last):
+        ...
+        ValueError: row 2: O, N and P must be finite (['3', '5', 'inf', 'build'])
+
+    @rtype: C{(str, number, number, number)} ident, O, N, P; integral
+        values stay C{int} as in the original C{int()} parsing
+    @raise ValueError: malformed row, non-finite value or O <= N <= P
+        with O < P violated
+    """
+    try :
+        a = float(rowList[0])
+        m = float(rowList[1])
+        b = float(rowList[2])
+        ident = rowList[3]
+    except (IndexError, ValueError) :
+        raise ValueError("row %i: expected O;N;P;ident, got %r" % (rowNumber, rowList))
+    if any(math.isinf(x) or math.isnan(x) for x in (a, m, b)) :
+        raise ValueError("row %i: O, N and P must be finite (%r)" % (rowNumber, rowList))
+    if not (a <= m <= b and a < b) :
+        raise ValueError("row %i: O <= N <= P and O < P violated (%r)" % (rowNumber, rowList))
+    if a == int(a) and m == int(m) and b == int(b) :
+        a, m, b = int(a), int(m), int(b)
+    return (ident, a, m, b)
+
+def iterEstimateChunks(csvfile, chunkRows = CSV_CHUNK_ROWS, errors = None,
+                       delimiter = ';', quotechar = '|') :
+    """
+    Lists of at most chunkRows (rowNumber, ident, O, N, P); the first
+    row is the header.
+
+    @param csvfile: open file or any iterator of lines
+    @param errors: list that collects (rowNumber, message) of invalid
+        rows, which are then skipped; if None invalid rows raise ValueError
+    """
+    reader = csv.reader(csvfile, delimiter = delimiter, quotechar = quotechar)
+    chunk = []
+    for (rowNumber, rowList) in enumerate(reader) :
+        if rowNumber == 0 or not rowList :
+            continue
+        try :
+            (ident, a, m, b) = parseEstimateRow(rowNumber, rowList)
+        except ValueError as E :
+            if errors is None :
+                raise
+            errors.append((rowNumber, str(E)))
+            continue
+        chunk.append((rowNumber, ident, a, m, b))
+        if len(chunk) >= chunkRows :
+            yield chunk
+            chunk = []
+    if chunk :
+        yield chunk
+
+def iterEstimates(csvfile, chunkRows = CSV_CHUNK_ROWS, errors = None) :
+    """
+    Doctests::
+        >>> lines = ["opt;likly;pess;ident", "3;5;12;design", "5;8;20;build"]
+        >>> [(ident, dist.a, dist.m, dist.b) for (ident, dist) in iterEstimates(lines)]
+        [('design', 3, 5, 12), ('build', 5, 8, 20)]
+
+    @rtype: iterator of C{(str, BetaDistribution)}
+    """
+    for chunk in iterEstimateChunks(csvfile, chunkRows = chunkRows, errors = errors) :
+        for (rowNumber, ident, a, m, b) in chunk :
+            yield (ident, BetaDistribution.FromAmB(a, m, b))
+
+
+#---
+class PortfolioAccumulator(object) :
+    """
+    Running sums for the ACCU footer in constant memory: O/N/P, PERT
+    mean and sigma, plus the first three cumulants of the exact beta
+    distributions.  The cumulants of a sum of independent tasks add up,
+    so quantiles of the total follow from a Cornish-Fisher expansion.
+
+    Doctests::
+        >>> acc = PortfolioAccumulator()
+        >>> for i in xrange(100) :
+        ...     acc.add(BetaDistribution.FromAmB(2.0, 4.0, 9.0))
+        >>> acc.count, "%.1f" % acc.mean, "%.1f" % acc.quantile(0.5), "%.1f" % acc.quantile(0.95)
+        (100, '450.0', '449.9', '469.3')
+    """
+
+    def __init__(self) :
+        self.count = 0
+        self.a = 0.0
+        self.m = 0.0
+        self.b = 0.0
+        self.mean = 0.0          # sum of PERT means
+        self.variance = 0.0      # sum of PERT sigma**2
+        self.kappa1 = 0.0        # cumulants of the beta distributions
+        self.kappa2 = 0.0
+        self.kappa3 = 0.0
+
+    @classmethod
+    def FromColumns(cls, a, m, b, alpha, beta) :
+        """
+        Sums over many estimates given column-wise, as NumPy reductions
+        if available (see L{columns.EstimateColumns}).
+        """
+        acc = cls()
+        acc.count = len(a)
+        if not acc.count :
+            return acc
+        if numpy is None :
+            acc.count = 0
+            for i in xrange(len(a)) :
+                acc.addValues(a[i], m[i], b[i], alpha[i], beta[i])
+            return acc
+        (a, m, b, alpha, beta) = [numpy.asarray(column, dtype = float) for column in (a, m, b, alpha, beta)]
+        width = b - a
+        s = alpha + beta
+        acc.a = float(a.sum())
+        acc.m = float(m.sum())
+        acc.b = float(b.sum())
+        acc.mean = (acc.a + 4 * acc.m + acc.b) / 6.0
+        acc.variance = float(numpy.dot(width, width)) / 36.0
+        acc.kappa1 = float((a + width * alpha / s).sum())
+        acc.kappa2 = float((width ** 2 * alpha * beta / (s * s * (s + 1.0))).sum())
+        acc.kappa3 = float((width ** 3 * 2.0 * alpha * beta * (beta - alpha) / (s ** 3 * (s + 1.0) * (s + 2.0))).sum())
+        return acc
+
+    def add(self, dist) :
+        self.addValues(dist.a, dist.m, dist.b, dist.alpha, dist.beta)
+
+    def addValues(self, a, m, b, alpha, beta) :
+        """like L{add}, from the O/N/P and shape parameters"""
+        self.count += 1
+        alpha = float(alpha)
+        beta = float(beta)
+        width = float(b - a)
+        s = alpha + beta
+        self.a += a
+        self.m += m
+        self.b += b
+        self.mean += (a + 4 * m + b) / 6.0
+        self.variance += (width / 6.0) ** 2
+        self.kappa1 += a + width * alpha / s
+        self.kappa2 += width ** 2 * alpha * beta / (s * s * (s + 1.0))
+        self.kappa3 += width ** 3 * 2.0 * alpha * beta * (beta - alpha) / (s ** 3 * (s + 1.0) * (s + 2.0))
+
+    @classmethod
+    def FromDict(cls, data) :
+        """inverse of L{toDict}"""
+        acc = cls()
+        for name in ACCUMULATOR_FIELDS :
+            setattr(acc, name, data[name])
+        return acc
+
+    def toDict(self) :
+        return dict((name, getattr(self, name)) for name in ACCUMULATOR_FIELDS)
+
+    def merge(self, other) :
+        """adds the sums of another accumulator, e.g. of a parallel chunk"""
+        for name in ACCUMULATOR_FIELDS :
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def sigma(self) :
+        return math.sqrt(self.variance)
+
+    def quantile(self, q) :
+        """Cornish-Fisher quantile of the total (skewness term)"""
+        if self.kappa2 <= 0.0 :
+            return self.kappa1
+        z = simulation.normalQuantile(q)
+        sigma = math.sqrt(self.kappa2)
+        skew = self.kappa3 / sigma ** 3
+        return self.kappa1 + sigma * (z + (z * z - 1.0) * skew / 6.0)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Thread-sicherer, größenbeschränkter Cache mit LRU-Verdrängung
+und Zählern für Treffer, Fehlschläge und Verdrängungen.
+"""
+
+#---
+#--- Python
+import collections
+import threading
+
+#---
+class LRUCache(object) :
+    """
+    Doctests::
+        >>> cache = LRUCache(2)
+        >>> cache.getOrCompute("x", lambda : 1)
+        1
+        >>> cache.getOrCompute("x", lambda : 2)
+        1
+        >>> cache.put("y", 2); cache.put("z", 3)
+        >>> "x" in cache
+        False
+        >>> sorted(cache.stats().items())
+        [('capacity', 2), ('evictions', 1), ('hitRatio', 0.5), ('hits', 1), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, capacity = 1024) :
+        if capacity < 1 :
+            raise ValueError("capacity must be >= 1")
+        self._capacity = capacity
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) :
+        return len(self._items)
+
+    def __contains__(self, key) :
+        return key in self._items
+
+    def _evict(self) :
+        while len(self._items) > self._capacity :
+            self._items.popitem(last = False)
+            self._evictions += 1
+
+    def get(self, key, default = None) :
+        """Lookup that counts as hit or miss and refreshes the entry"""
+        with self._lock :
+            try :
+                value = self._items.pop(key)
+            except KeyError :
+                self._misses += 1
+                return default
+            self._items[key] = value
+            self._hits += 1
+            return value
+
+    def put(self, key, value) :
+        with self._lock :
+            self._items.pop(key, None)
+            self._items[key] = value
+            self._evict()
+
+    def getOrCompute(self, key, compute) :
+        """
+        @param compute: called without arguments on a miss; it runs outside
+            the lock, so concurrent misses on one key may compute twice
+        """
+        missing = self
+        value = self.get(key, missing)
+        if value is missing :
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) :
+        """Drops all entries and resets the counters"""
+        with self._lock :
+            self._items.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def getCapacity(self) :
+        return self._capacity
+
+    def setCapacity(self, capacity) :
+        if capacity < 1 :
+            raise ValueError("capacity must be >= 1")
+        with self._lock :
+            self._capacity = capacity
+            self._evict()
+
+    def stats(self) :
+        """@rtype: C{dict}"""
+        with self._lock :
+            lookups = self._hits + self._misses
+            return {'hits' : self._hits,
+                    'misses' : self._misses,
+                    'evictions' : self._evictions,
+                    'size' : len(self._items),
+                    'capacity' : self._capacity,
+                    'hitRatio' : float(self._hits) / lookups if lookups else 0.0,
+                    }
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Optionale Messpunkte: Zähler, Histogramme für Auswertungen und Schritte
+sowie Laufzeithistogramme je öffentlicher Funktion, ausgegeben im
+Textformat von Prometheus.
+
+Ausgeschaltet (Voreinstellung) kosten die Messpunkte nur die Abfrage von
+ENABLED; die Laufzeitmessung wird erst mit L{enable} um die registrierten
+Funktionen gelegt und mit L{disable} wieder entfernt.
+"""
+
+#---
+#--- Python
+import bisect
+import functools
+import threading
+import timeit
+
+#---
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4,
+                   5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1, 1.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+FUNCTION_SECONDS = "pertbeta_function_seconds"
+
+HELP = {FUNCTION_SECONDS : "Latency of instrumented functions",
+        "pertbeta_integral_evaluations" : "Integrand evaluations per INTEGRAL call",
+        "pertbeta_steps" : "Iterations per call of an inner solver",
+        "pertbeta_request_seconds" : "Latency of web requests by page",
+        "pertbeta_beta_cache_hits_total" : "LOG_BETA_CACHED lookups found in the cache",
+        "pertbeta_beta_cache_misses_total" : "LOG_BETA_CACHED lookups computed",
+        "pertbeta_beta_cache_evictions_total" : "LOG_BETA_CACHED entries evicted",
+        }
+
+ENABLED = False
+
+_lock = threading.Lock()
+_counters = {}       # (name, labels) -> value
+_histograms = {}     # (name, labels) -> [count per bucket..., count above, sum]
+_buckets = {}        # name -> bucket bounds
+_instrumented = []   # [(owner, attribute, original, label)]
+_collectors = []
+
+#---
+def increment(name, value = 1, labels = ()) :
+    """
+    @param labels: tuple of (label, value) pairs
+    """
+    key = (name, labels)
+    with _lock :
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, buckets = LATENCY_BUCKETS, labels = ()) :
+    """adds value to the histogram name; buckets are fixed by the first call"""
+    key = (name, labels)
+    with _lock :
+        bounds = _buckets.setdefault(name, buckets)
+        try :
+            cells = _histograms[key]
+        except KeyError :
+            cells = _histograms[key] = [0] * (len(bounds) + 1) + [0.0]
+        cells[bisect.bisect_left(bounds, value)] += 1
+        cells[-1] += value
+
+class CallCounter(object) :
+    """
+    wraps a function of any signature and counts its calls
+
+    Doctests::
+        >>> counter = CallCounter(lambda x, y = 1.0 : x * y)
+        >>> counter(2.0), counter(2.0, 3.0), counter(2.0, y = 0.5), counter.calls
+        (2.0, 6.0, 1.0, 3)
+    """
+
+    def __init__(self, function) :
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, *args, **keywords) :
+        self.calls += 1
+        return self.function(*args, **keywords)
+
+
+#---
+def _timed(function, label) :
+    labels = (("function", label),)
+    clock = timeit.default_timer
+
+    @functools.wraps(function)
+    def wrapper(*args, **keywords) :
+        start = clock()
+        try :
+            return function(*args, **keywords)
+        finally :
+            observe(FUNCTION_SECONDS, clock() - start, LATENCY_BUCKETS, labels)
+    return wrapper
+
+def instrument(owner, names, prefix = "") :
+    """
+    Registers functions of a module or plain methods of a class for
+    latency histograms.  Calls through the module or class attribute are
+    measured while enabled, also the calls inside the module itself.
+    """
+    for name in names :
+        original = owner.__dict__[name]
+        _instrumented.append((owner, name, original, prefix + name))
+        if ENABLED :
+            setattr(owner, name, _timed(original, prefix + name))
+
+def addCollector(collector) :
+    """
+    @param collector: called without arguments before metrics are read,
+        e.g. to turn statistics kept elsewhere into counters
+    """
+    _collectors.append(collector)
+
+def enable() :
+    global ENABLED
+    if not ENABLED :
+        ENABLED = True
+        for (owner, name, original, label) in _instrumented :
+            setattr(owner, name, _timed(original, label))
+
+def disable() :
+    global ENABLED
+    if ENABLED :
+        ENABLED = False
+        for (owner, name, original, label) in _instrumented :
+            setattr(owner, name, original)
+
+def _collect() :
+    for collector in _collectors :
+        collector()
+
+def reset() :
+    with _lock :
+        _counters.clear()
+        _histograms.clear()
+
+def snapshot() :
+    """
+    @rtype: C{dict} picklable copy, see L{merge}
+    """
+    _collect()
+    with _lock :
+        return {"counters" : dict(_counters),
+                "histograms" : dict((key, list(cells)) for (key, cells) in _histograms.iteritems()),
+                "buckets" : dict(_buckets),
+                }
+
+def drain() :
+    """snapshot and reset, e.g. to pass a worker's metrics to its parent"""
+    _collect()
+    with _lock :
+        result = {"counters" : dict(_counters),
+                  "histograms" : dict(_histograms),
+                  "buckets" : dict(_buckets),
+                  }
+        _counters.clear()
+        _histograms.clear()
+        return result
+
+def merge(other) :
+    """
+    Adds a L{snapshot} or L{drain} result.
+
+    Doctests::
+        >>> reset()
+        >>> observe("x_seconds", 0.003)
+        >>> merge(drain()); merge({"counters" : {("y_total", ()) : 2}, "histograms" : {}, "buckets" : {}})
+        >>> lines = list(iterPrometheusLines())
+        >>> [line for line in lines if "x_seconds_count" in line or line.startswith("y_total")]
+        ['x_seconds_count 1', 'y_total 2']
+    """
+    with _lock :
+        for (key, value) in other["counters"].iteritems() :
+            _counters[key] = _counters.get(key, 0) + value
+        for (name, bounds) in other["buckets"].iteritems() :
+            _buckets.setdefault(name, bounds)
+        for (key, cells) in other["histograms"].iteritems() :
+            mine = _histograms.get(key)
+            if mine is None :
+                _histograms[key] = list(cells)
+            else :
+                for i in xrange(len(cells)) :
+                    mine[i] += cells[i]
+
+
+#---
+def _formatLabels(labels, extra = ()) :
+    pairs = list(labels) + list(extra)
+    if not pairs :
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in pairs),)
+
+def _formatValue(value) :
+    if isinstance(value, float) :
+        return repr(value)
+    return str(value)
+
+def iterPrometheusLines(gauges = ()) :
+    """
+    Text exposition format 0.0.4.
+
+    @param gauges: additional (name, help, value, labels) values
+    """
+    current = snapshot()
+    (counters, histograms, buckets) = (current["counters"], current["histograms"], current["buckets"])
+    byName = {}
+    for ((name, labels), value) in counters.iteritems() :
+        byName.setdefault(name, ("counter", []))[1].append((labels, value))
+    for ((name, labels), cells) in histograms.iteritems() :
+        byName.setdefault(name, ("histogram", []))[1].append((labels, cells))
+    for (name, helpText, value, labels) in gauges :
+        HELP.setdefault(name, helpText)
+        byName.setdefault(name, ("gauge", []))[1].append((labels, value))
+    for name in sorted(byName) :
+        (kind, series) = byName[name]
+        if name in HELP :
+            yield "# HELP %s %s" % (name, HELP[name])
+        yield "# TYPE %s %s" % (name, kind)
+        for (labels, value) in sorted(series) :
+            if kind != "histogram" :
+                yield "%s%s %s" % (name, _formatLabels(labels), _formatValue(value))
+                continue
+            cumulative = 0
+            for (bound, count) in zip(buckets[name], value) :
+                cumulative += count
+                yield "%s_bucket%s %i" % (name, _formatLabels(labels, [("le", repr(float(bound)))]), cumulative)
+            cumulative += value[-2]
+            yield "%s_bucket%s %i" % (name, _formatLabels(labels, [("le", "+Inf")]), cumulative)
+            yield "%s_sum%s %s" % (name, _formatLabels(labels), repr(float(value[-1])))
+            yield "%s_count%s %i" % (name, _formatLabels(labels), cumulative)
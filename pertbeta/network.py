@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+PERT-Netzplan: Vorgänge mit BETA-verteilter Dauer und Vorgängerbeziehungen.
+Die Monte-Carlo-Simulation berechnet je Stichprobe den längsten Weg
+(Projektende) sowie die Kritikalität jedes Vorgangs.
+
+Mit NumPy wird Ebene für Ebene über ganze Stichprobenblöcke gerechnet,
+ohne NumPy Stichprobe für Stichprobe.
+"""
+
+#---
+#--- Python
+import random
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta import simulation
+from pertbeta import sampling
+
+#---
+NETWORK_BATCH_CELLS = 1 << 22   # tasks * samples held per batch
+
+#---
+class TaskNetwork(object) :
+    """
+    Doctests::
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> net = TaskNetwork()
+        >>> net.AddTask("spec", BetaDistribution.FromAmB(2.0, 3.0, 5.0))
+        >>> net.AddTask("code", BetaDistribution.FromAmB(5.0, 8.0, 15.0), ["spec"])
+        >>> net.AddTask("docs", BetaDistribution.FromAmB(1.0, 2.0, 3.0), ["spec"])
+        >>> result = net.simulate(N = 2000, seed = 1)
+        >>> result.criticality["spec"], result.criticality["code"], result.criticality["docs"]
+        (1.0, 1.0, 0.0)
+    """
+
+    def __init__(self) :
+        self._idents = []
+        self._index = {}         # ident -> position in _idents
+        self._dists = []
+        self._predecessors = []  # [[ident]]
+        self._compiled = None
+
+    def __len__(self) :
+        return len(self._idents)
+
+    def AddTask(self, ident, dist, predecessors = ()) :
+        """
+        @param predecessors: idents of tasks that must finish first; they
+            may be added later, but must exist before L{simulate}
+        """
+        if ident in self._index :
+            raise ValueError("duplicate task %r" % (ident,))
+        self._index[ident] = len(self._idents)
+        self._idents.append(ident)
+        self._dists.append(dist)
+        self._predecessors.append(list(predecessors))
+        self._compiled = None
+
+    def _compile(self) :
+        """
+        Topological order (Kahn) grouped by level, where the level of a
+        task is one more than the largest level of its predecessors,
+        plus predecessor and successor lists in CSR form over the
+        topological positions.
+        """
+        if self._compiled is not None :
+            return self._compiled
+        n = len(self._idents)
+        preds = []
+        for (i, names) in enumerate(self._predecessors) :
+            try :
+                preds.append([self._index[name] for name in names])
+            except KeyError as E :
+                raise ValueError("unknown predecessor %r of task %r" % (E.args[0], self._idents[i]))
+        succs = [[] for i in xrange(n)]
+        indegree = [len(p) for p in preds]
+        for (i, p) in enumerate(preds) :
+            for j in p :
+                succs[j].append(i)
+        level = [0] * n
+        frontier = [i for i in xrange(n) if indegree[i] == 0]
+        order = []
+        while frontier :
+            order.extend(frontier)
+            nextFrontier = []
+            for j in frontier :
+                for i in succs[j] :
+                    level[i] = max(level[i], level[j] + 1)
+                    indegree[i] -= 1
+                    if indegree[i] == 0 :
+                        nextFrontier.append(i)
+            frontier = nextFrontier
+        if len(order) < n :
+            raise ValueError("task network contains a cycle")
+        order.sort(key = lambda i : level[i])
+        pos = [0] * n
+        for (p, i) in enumerate(order) :
+            pos[i] = p
+        levels = []
+        start = 0
+        for p in xrange(1, n + 1) :
+            if p == n or level[order[p]] != level[order[start]] :
+                levels.append((start, p))
+                start = p
+        predPtr, predIdx = [0], []
+        succPtr, succIdx = [0], []
+        for i in order :
+            predIdx.extend(sorted(pos[j] for j in preds[i]))
+            predPtr.append(len(predIdx))
+            succIdx.extend(sorted(pos[j] for j in succs[i]))
+            succPtr.append(len(succIdx))
+        self._compiled = (order, levels, predPtr, predIdx, succPtr, succIdx)
+        return self._compiled
+
+    def simulate(self, N = simulation.SIMULATION_SAMPLES, seed = None, batchSize = None) :
+        """
+        Completion time (longest path) and criticality per task over N samples.
+
+        @param batchSize: samples per batch, default keeps
+            tasks * batchSize below L{NETWORK_BATCH_CELLS}
+        @rtype: C{NetworkResult}
+        """
+        if not self._idents :
+            raise ValueError("empty task network")
+        if batchSize is None :
+            batchSize = max(1, NETWORK_BATCH_CELLS // len(self._idents))
+        if numpy is not None :
+            return self._simulateNumpy(N, seed, batchSize)
+        return self._simulatePython(N, seed)
+
+    def _simulateNumpy(self, N, seed, batchSize) :
+        (order, levels, predPtr, predIdx, succPtr, succIdx) = self._compile()
+        dists = [self._dists[i] for i in order]
+        predPtr = numpy.array(predPtr)
+        predIdx = numpy.array(predIdx, dtype = int)
+        succPtr = numpy.array(succPtr)
+        succIdx = numpy.array(succIdx, dtype = int)
+        rng = simulation.makeRng(seed)
+        n = len(order)
+        critical = numpy.zeros(n)
+        totals = []
+        duration = None
+        done = 0
+        while done < N :
+            B = min(batchSize, N - done)
+            if duration is None or duration.shape[1] != B :
+                duration = numpy.empty((n, B))
+            sampling.sampleMany(dists, B, rng, out = duration)
+            finish = numpy.empty((n, B))
+            # forward pass: earliest finish, level by level
+            for (s, e) in levels :
+                if predPtr[s] == predPtr[e] :
+                    finish[s:e] = duration[s:e]
+                    continue
+                start = numpy.maximum.reduceat(finish[predIdx[predPtr[s]:predPtr[e]]],
+                                               predPtr[s:e] - predPtr[s], axis = 0)
+                finish[s:e] = start + duration[s:e]
+            total = finish.max(axis = 0)
+            # backward pass: latest finish, zero float means critical
+            latest = numpy.empty((n, B))
+            latest[:] = total
+            for (s, e) in reversed(levels) :
+                counts = succPtr[s + 1:e + 1] - succPtr[s:e]
+                hasSucc = counts > 0
+                if not hasSucc.any() :
+                    continue
+                edges = succIdx[succPtr[s]:succPtr[e]]
+                bound = numpy.minimum.reduceat(latest[edges] - duration[edges],
+                                               (succPtr[s:e] - succPtr[s])[hasSucc], axis = 0)
+                rows = numpy.arange(s, e)[hasSucc]
+                latest[rows] = numpy.minimum(latest[rows], bound)
+            tolerance = 1e-9 * numpy.abs(total)
+            critical += (latest - finish <= tolerance).sum(axis = 1)
+            totals.append(total)
+            done += B
+        criticality = dict((self._idents[i], float(critical[p]) / N) for (p, i) in enumerate(order))
+        return NetworkResult(simulation.SimulationResult(numpy.concatenate(totals)), criticality)
+
+    def _simulatePython(self, N, seed) :
+        (order, levels, predPtr, predIdx, succPtr, succIdx) = self._compile()
+        dists = [self._dists[i] for i in order]
+        rng = random.Random(seed)
+        n = len(order)
+        critical = [0] * n
+        totals = []
+        for k in xrange(N) :
+            duration = [dist.a + (dist.b - dist.a) * rng.betavariate(dist.alpha, dist.beta) for dist in dists]
+            finish = [0.0] * n
+            for p in xrange(n) :
+                start = max([finish[q] for q in predIdx[predPtr[p]:predPtr[p + 1]]] or [0.0])
+                finish[p] = start + duration[p]
+            total = max(finish)
+            latest = [total] * n
+            for p in reversed(xrange(n)) :
+                for q in succIdx[succPtr[p]:succPtr[p + 1]] :
+                    latest[p] = min(latest[p], latest[q] - duration[q])
+            tolerance = 1e-9 * abs(total)
+            for p in xrange(n) :
+                if latest[p] - finish[p] <= tolerance :
+                    critical[p] += 1
+            totals.append(total)
+        criticality = dict((self._idents[i], float(critical[p]) / N) for (p, i) in enumerate(order))
+        return NetworkResult(simulation.SimulationResult(totals), criticality)
+
+
+#---
+class NetworkResult(object) :
+
+    def __init__(self, completion, criticality) :
+        """
+        @param completion: project completion times
+        @type  completion: C{simulation.SimulationResult}
+        @param criticality: ident -> share of samples in which the task
+            lies on a critical path (zero total float)
+        @type  criticality: C{dict}
+        """
+        self.completion = completion
+        self.criticality = criticality
+
+    def iterLines(self, percentiles = (0.5, 0.8, 0.95), top = 10) :
+        for line in self.completion.iterLines(percentiles) :
+            yield line
+        yield "%-20s %6s" % ("task", "crit")
+        ranked = sorted(self.criticality.items(), key = lambda item : -item[1])
+        for (ident, index) in ranked[:top] :
+            yield "%-20s %6.3f" % (ident, index)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Parallele Monte-Carlo-Simulation der Gesamtdauer: die Stichprobe wird
+in Shards fester Größe zerlegt, jeder Shard zieht aus seinem eigenen
+Zufallsstrom (L{sampling.makeStream}) und liefert Momente und
+Quantilskizze (L{streamstats}).  Die Teilergebnisse werden in der
+Reihenfolge der Shards zusammengeführt, das Ergebnis hängt also nur von
+seed, N und shardSize ab, nicht von der Zahl der Prozesse oder Rechner.
+
+Die Shards laufen in einem lokalen Prozesspool und/oder auf entfernten
+Rechnern, auf denen C{python -m pertbeta.parallel serve} läuft
+(JSON-Zeilen über TCP, ohne Authentifizierung: nur im eigenen Netz).
+"""
+
+#---
+#--- Python
+import sys
+import json
+import random
+import socket
+import threading
+import argparse
+import multiprocessing
+import Queue
+import SocketServer
+
+#--- .
+from pertbeta.betadist import BetaDistribution
+from pertbeta import sampling
+from pertbeta import simulation
+from pertbeta import streamstats
+
+#---
+PARALLEL_SHARD = 65536     # samples per shard
+PARALLEL_PORT = 8765
+REMOTE_TIMEOUT = 600.0     # seconds to wait for a remote shard
+POLL_SECONDS = 0.1
+
+class SimulationCancelled(Exception) :
+    """raised by L{simulateParallel} when cancel was set"""
+
+#---
+def makeJob(dists, N, seed, shardSize = PARALLEL_SHARD, k = streamstats.SKETCH_K,
+            batchSize = simulation.SIMULATION_BATCH) :
+    """
+    JSON-ready description of a simulation, the same for every shard.
+
+    @param seed: int in [0, 2**32); None draws one
+    """
+    if seed is None :
+        seed = random.SystemRandom().randint(0, 2 ** 32 - 1)
+    return {"dists" : [[float(dist.a), float(dist.b), float(dist.alpha), float(dist.beta)] for dist in dists],
+            "N" : int(N), "seed" : int(seed), "shardSize" : int(shardSize),
+            "k" : int(k), "batchSize" : int(batchSize)}
+
+def shardCount(job) :
+    return (job["N"] + job["shardSize"] - 1) // job["shardSize"]
+
+def runShard(job, index) :
+    """
+    Doctests::
+        >>> job = makeJob([BetaDistribution.FromAmB(2.0, 4.0, 9.0)], N = 2500, seed = 1, shardSize = 1000)
+        >>> shardCount(job), runShard(job, 2)["moments"]["count"]
+        (3, 500)
+
+    @rtype: C{dict} index, moments and sketch as L{streamstats} dicts
+    """
+    start = index * job["shardSize"]
+    n = min(job["shardSize"], job["N"] - start)
+    if n <= 0 :
+        raise ValueError("shard %i outside N = %i" % (index, job["N"]))
+    dists = [BetaDistribution(a, b, alpha, beta) for (a, b, alpha, beta) in job["dists"]]
+    rng = sampling.makeStream(job["seed"], index)
+    batches = simulation.iterTotalBatches(dists, n, rng, job["batchSize"])
+    (moments, sketch) = streamstats.summarize(batches, job["k"], "%i/%i" % (job["seed"], index))
+    return {"index" : index, "moments" : moments.toDict(), "sketch" : sketch.toDict()}
+
+def _runShardRequest(request) :
+    """remote shard; errors are returned, they do not stop the server"""
+    try :
+        return runShard(request["job"], request["index"])
+    except Exception as E :
+        return {"index" : request.get("index"), "error" : "%s: %s" % (E.__class__.__name__, E)}
+
+
+#---
+def _localSlot(pool, job, tasks, results, done) :
+    while not done.is_set() :
+        try :
+            index = tasks.get(timeout = POLL_SECONDS)
+        except Queue.Empty :
+            continue
+        try :
+            if pool is None :
+                result = runShard(job, index)
+            else :
+                pending = pool.apply_async(runShard, (job, index))
+                while not pending.ready() :
+                    if done.is_set() :
+                        return
+                    pending.wait(POLL_SECONDS)
+                result = pending.get()
+        except Exception as E :
+            results.put((index, None, E))
+        else :
+            results.put((index, result, None))
+
+def _remoteSlot(address, job, tasks, results, done) :
+    """sends up to as many shards as the host has workers, then one per reply"""
+    inflight = set()
+    try :
+        connection = socket.create_connection(address, REMOTE_TIMEOUT)
+        try :
+            stream = connection.makefile('rwb')
+            capacity = max(1, int(json.loads(stream.readline())["workers"]))
+            while not done.is_set() :
+                while len(inflight) < capacity :
+                    try :
+                        index = tasks.get(timeout = 0 if inflight else POLL_SECONDS)
+                    except Queue.Empty :
+                        break
+                    inflight.add(index)
+                    stream.write(json.dumps({"job" : job, "index" : index}) + "\n")
+                    stream.flush()
+                if not inflight :
+                    continue
+                line = stream.readline()
+                if not line :
+                    raise IOError("connection closed by %s:%i" % address)
+                reply = json.loads(line)
+                inflight.discard(reply["index"])
+                if "error" in reply :
+                    results.put((reply["index"], None, RuntimeError("%s:%i: %s" % (address + (reply["error"],)))))
+                else :
+                    results.put((reply["index"], reply, None))
+        finally :
+            connection.close()
+    except (IOError, ValueError, KeyError) as E :
+        # the host is lost, other slots take over its shards
+        for index in inflight :
+            tasks.put(index)
+        results.put((None, None, E))
+
+def parseAddress(host) :
+    """'host:port' or 'host' -> (host, port)"""
+    (name, sep, port) = host.rpartition(':')
+    if not sep :
+        return (host, PARALLEL_PORT)
+    return (name, int(port))
+
+def simulateParallel(dists, N = simulation.SIMULATION_SAMPLES, seed = None, workers = None, hosts = (),
+                     shardSize = PARALLEL_SHARD, k = streamstats.SKETCH_K,
+                     batchSize = simulation.SIMULATION_BATCH, progress = None, cancel = None) :
+    """
+    Like L{simulation.simulateSummary}, with the shards spread over local
+    processes and remote hosts.  If a host fails, its shards run elsewhere.
+
+    Doctests::
+        >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0) for i in xrange(10)]
+        >>> one = simulateParallel(dists, N = 30000, seed = 4, workers = 0, shardSize = 8000)
+        >>> calls = []
+        >>> three = simulateParallel(dists, N = 30000, seed = 4, workers = 3, shardSize = 8000,
+        ...                          progress = lambda done, N : calls.append(done))
+        >>> one.N, one.mean() == three.mean(), one.percentile(0.9) == three.percentile(0.9)
+        (30000, True, True)
+        >>> sorted(calls)[-1]
+        30000
+
+    @param workers: local processes, default one per CPU; 0 runs the local
+        shards in this process, or none at all if hosts are given
+    @param hosts: 'host:port' of machines running L{serve}
+    @param progress: called with (samples done, N) after each shard
+    @param cancel: e.g. C{threading.Event}; once set, the remaining shards
+        are dropped and L{SimulationCancelled} is raised
+    @rtype: C{simulation.SketchResult}
+    """
+    job = makeJob(dists, N, seed, shardSize, k, batchSize)
+    count = shardCount(job)
+    if count == 0 :
+        raise ValueError("empty simulation")
+    if workers is None :
+        workers = multiprocessing.cpu_count()
+    tasks = Queue.Queue()
+    for index in xrange(count) :
+        tasks.put(index)
+    results = Queue.Queue()
+    done = threading.Event()
+    pool = multiprocessing.Pool(workers) if workers > 0 else None
+    localSlots = []
+    if pool is not None :
+        localSlots.extend(threading.Thread(target = _localSlot, args = (pool, job, tasks, results, done))
+                          for i in xrange(workers))
+    elif not hosts :
+        localSlots.append(threading.Thread(target = _localSlot, args = (None, job, tasks, results, done)))
+    remoteSlots = [threading.Thread(target = _remoteSlot, args = (parseAddress(host), job, tasks, results, done))
+                   for host in hosts]
+    slots = localSlots + remoteSlots
+    for slot in slots :
+        slot.daemon = True
+        slot.start()
+
+    moments = streamstats.Moments()
+    sketch = streamstats.QuantileSketch(job["k"], job["seed"])
+    waiting = {}        # shards that finished before their predecessors
+    merged = 0
+    finished = 0
+    samples = 0
+    lastError = None
+    try :
+        while merged < count :
+            if cancel is not None and cancel.is_set() :
+                raise SimulationCancelled("cancelled after %i of %i shards" % (finished, count))
+            try :
+                (index, result, error) = results.get(timeout = POLL_SECONDS)
+            except Queue.Empty :
+                if not any(slot.is_alive() for slot in slots) :
+                    raise RuntimeError("all workers failed, last error: %s" % (lastError,))
+                continue
+            if index is None :
+                lastError = error
+                continue
+            if error is not None :
+                raise error
+            waiting[index] = result
+            finished += 1
+            samples += result["moments"]["count"]
+            if progress is not None :
+                progress(samples, job["N"])
+            # merge in shard order, so the result does not depend on scheduling
+            while merged in waiting :
+                result = waiting.pop(merged)
+                moments.merge(streamstats.Moments.FromDict(result["moments"]))
+                sketch.merge(streamstats.QuantileSketch.FromDict(result["sketch"]))
+                merged += 1
+    finally :
+        done.set()
+        # local slots stop within POLL_SECONDS, remote ones after their current reply
+        for slot in localSlots :
+            slot.join()
+        for slot in remoteSlots :
+            slot.join(POLL_SECONDS)
+        if pool is not None :
+            if merged < count :
+                pool.terminate()
+            else :
+                pool.close()
+            pool.join()
+    return simulation.SketchResult(moments, sketch)
+
+
+#---
+class ShardServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer) :
+    daemon_threads = True
+    allow_reuse_address = True
+
+def makeServer(address = ('', PARALLEL_PORT), workers = None) :
+    """
+    TCP server for remote shards.  On connect it sends one line
+    {"workers" : n}, then answers each request line {"job", "index"}
+    with one line of the L{runShard} result or {"index", "error"}, in
+    the order the shards finish.
+
+    Doctests::
+        >>> server = makeServer(('127.0.0.1', 0), workers = 0)
+        >>> thread = threading.Thread(target = server.serve_forever); thread.daemon = True; thread.start()
+        >>> host = "127.0.0.1:%i" % server.server_address[1]
+        >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0) for i in xrange(10)]
+        >>> remote = simulateParallel(dists, N = 30000, seed = 4, workers = 0, hosts = [host], shardSize = 8000)
+        >>> local = simulateParallel(dists, N = 30000, seed = 4, workers = 0, shardSize = 8000)
+        >>> remote.mean() == local.mean(), remote.percentile(0.5) == local.percentile(0.5)
+        (True, True)
+        >>> server.shutdown(); server.server_close()
+
+    @param workers: processes for the shards, default one per CPU;
+        0 runs them in the connection thread
+    """
+    if workers is None :
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers) if workers > 0 else None
+
+    class ShardHandler(SocketServer.StreamRequestHandler) :
+
+        def handle(self) :
+            lock = threading.Lock()
+
+            def reply(result) :
+                with lock :
+                    try :
+                        self.wfile.write(json.dumps(result) + "\n")
+                        self.wfile.flush()
+                    except socket.error :
+                        pass # the client is gone, its shards run elsewhere
+
+            reply({"workers" : max(workers, 1)})
+            pending = []
+            for line in iter(self.rfile.readline, "") :
+                try :
+                    request = json.loads(line)
+                except ValueError :
+                    reply({"index" : None, "error" : "malformed request"})
+                    break
+                if pool is None :
+                    reply(_runShardRequest(request))
+                else :
+                    pending.append(pool.apply_async(_runShardRequest, (request,), callback = reply))
+            for result in pending :
+                result.wait()
+
+    server = ShardServer(address, ShardHandler)
+    closeServer = server.server_close
+
+    def server_close() :
+        closeServer()
+        if pool is not None :
+            pool.terminate()
+            pool.join()
+    server.server_close = server_close
+    return server
+
+def serve(host = '', port = PARALLEL_PORT, workers = None) :
+    server = makeServer((host, port), workers)
+    try :
+        server.serve_forever()
+    except KeyboardInterrupt :
+        pass
+    finally :
+        server.server_close()
+
+def parseArguments(argv) :
+    parser = argparse.ArgumentParser(description = "pertbeta simulation worker")
+    commands = parser.add_subparsers(dest = 'command')
+    server = commands.add_parser('serve', help = "run shards for remote simulateParallel calls")
+    server.add_argument('--host', default = '', help = "address to listen on")
+    server.add_argument('--port', type = int, default = PARALLEL_PORT)
+    server.add_argument('--workers', type = int, default = None,
+                        help = "shard processes (default: one per CPU, 0: none)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__" :
+    args = parseArguments(sys.argv[1:])
+    serve(args.host, args.port, args.workers)
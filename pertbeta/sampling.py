@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Ziehen vieler BETA-verteilter Zufallszahlen in einem Aufruf, für eine
+oder mehrere Verteilungen, in vorab angelegte Puffer.
+
+Mit NumPy (Generator ab 1.17, sonst RandomState) wird vektorisiert
+gezogen, ohne NumPy mit random.Random in einer Schleife ohne
+Zwischenlisten.  Unabhängige, reproduzierbare Ströme liefert
+L{makeStreams}.
+"""
+
+#---
+#--- Python
+import random
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#---
+def makeRng(seed = None) :
+    """
+    NumPy Generator if available (NumPy >= 1.17), else RandomState;
+    random.Random without NumPy.
+    """
+    if numpy is None :
+        return random.Random(seed)
+    default_rng = getattr(numpy.random, 'default_rng', None)
+    if default_rng is not None :
+        return default_rng(seed)
+    return numpy.random.RandomState(seed)
+
+def makeStream(seed, index) :
+    """
+    The index-th of the generators that L{makeStreams} returns for seed,
+    without creating the others, e.g. in the process that draws shard
+    index of a simulation.
+    """
+    if numpy is not None :
+        SeedSequence = getattr(numpy.random, 'SeedSequence', None)
+        if SeedSequence is not None :
+            # SeedSequence(seed).spawn(n)[index] has spawn_key (index,)
+            return numpy.random.default_rng(SeedSequence(seed, spawn_key = (index,)))
+        if seed is None :
+            return numpy.random.RandomState()
+        return numpy.random.RandomState([seed, index])
+    if seed is None :
+        return random.Random()
+    return random.Random((long(seed) << 32) | index)
+
+def makeStreams(seed, count) :
+    """
+    count independent generators; the same seed gives the same streams.
+    NumPy >= 1.17 spawns them from one SeedSequence, older NumPy seeds
+    RandomState with [seed, i], so seed must then be an int in [0, 2**32).
+
+    Doctests::
+        >>> [sampleBeta(2, 2.0, 3.0, rng = rng)[0] for rng in makeStreams(7, 2)] == \\
+        ...     [sampleBeta(2, 2.0, 3.0, rng = makeStream(7, i))[0] for i in xrange(2)]
+        True
+
+    @rtype: C{list}
+    """
+    if numpy is not None :
+        SeedSequence = getattr(numpy.random, 'SeedSequence', None)
+        if SeedSequence is not None :
+            return [numpy.random.default_rng(child) for child in SeedSequence(seed).spawn(count)]
+    return [makeStream(seed, i) for i in xrange(count)]
+
+def asRng(rng) :
+    """rng may be a generator, a seed or None"""
+    if rng is None or isinstance(rng, (int, long)) :
+        return makeRng(rng)
+    return rng
+
+def _isGenerator(rng) :
+    Generator = getattr(numpy.random, 'Generator', None)
+    return Generator is not None and isinstance(rng, Generator)
+
+def _ratioOfGammas(rng, alpha, beta, out, scratch) :
+    """beta variates as X / (X + Y) with X ~ Gamma(alpha), Y ~ Gamma(beta), in place"""
+    rng.standard_gamma(alpha, out = out)
+    rng.standard_gamma(beta, out = scratch)
+    scratch += out
+    out /= scratch
+
+def sampleBeta(n, alpha, beta, a = 0.0, b = 1.0, rng = None, out = None, scratch = None) :
+    """
+    n variates of the beta distribution on [a, b].
+
+    Doctests::
+        >>> values = sampleBeta(20000, 2.0, 6.0, 10.0, 18.0, rng = 1)
+        >>> len(values), abs(sum(values) / 20000 - 12.0) < 0.05
+        (20000, True)
+
+    @param rng: generator from L{makeRng}/L{makeStreams}, a seed or None
+    @param out: buffer of at least n floats that receives the variates
+        (C{numpy.ndarray}, without NumPy any mutable sequence)
+    @param scratch: NumPy Generator only: second buffer of n floats
+    @rtype: C{out[:n]} or a new C{numpy.ndarray} (C{[float]} without NumPy)
+    """
+    rng = asRng(rng)
+    width = b - a
+    if numpy is None :
+        betavariate = rng.betavariate
+        if out is None :
+            return [a + width * betavariate(alpha, beta) for i in xrange(n)]
+        if len(out) < n :
+            raise ValueError("out holds less than %i values" % (n,))
+        for i in xrange(n) :
+            out[i] = a + width * betavariate(alpha, beta)
+        return out
+    if out is None :
+        out = numpy.empty(n)
+    elif len(out) < n :
+        raise ValueError("out holds less than %i values" % (n,))
+    else :
+        out = out[:n]
+    if _isGenerator(rng) and (alpha >= 1.0 or beta >= 1.0) :
+        # both gammas tiny would underflow; Generator.beta handles that case
+        scratch = numpy.empty(n) if scratch is None else scratch[:n]
+        _ratioOfGammas(rng, alpha, beta, out, scratch)
+    else :
+        out[:] = rng.beta(alpha, beta, n)
+    if width != 1.0 :
+        out *= width
+    if a != 0.0 :
+        out += a
+    return out
+
+def sampleUniform(n, rng = None, out = None) :
+    """
+    n uniform variates in [0, 1), e.g. for sampling by inverse CDF.
+
+    @rtype: C{numpy.ndarray} (C{[float]} without NumPy)
+    """
+    rng = asRng(rng)
+    if numpy is None :
+        if out is None :
+            out = [0.0] * n
+        for i in xrange(n) :
+            out[i] = rng.random()
+        return out
+    if _isGenerator(rng) :
+        return rng.random(n, out = None if out is None else out[:n])
+    if out is None :
+        return rng.random_sample(n)
+    out[:n] = rng.random_sample(n)
+    return out[:n]
+
+def sampleMany(dists, n, rng = None, out = None) :
+    """
+    n variates of each distribution, row i belongs to dists[i].
+
+    Doctests::
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0), BetaDistribution.FromAmB(0.0, 1.0, 2.0)]
+        >>> rows = sampleMany(dists, 1000, rng = 3)
+        >>> len(rows), len(rows[0]), min(rows[1]) >= 0.0, max(rows[1]) <= 2.0
+        (2, 1000, True, True)
+
+    @param out: buffer with one row of at least n floats per distribution
+    @rtype: C{numpy.ndarray} of shape (len(dists), n) (C{[[float]]} without NumPy)
+    """
+    dists = list(dists)
+    rng = asRng(rng)
+    if numpy is None :
+        if out is None :
+            out = [None] * len(dists)
+        for (i, dist) in enumerate(dists) :
+            out[i] = sampleBeta(n, dist.alpha, dist.beta, dist.a, dist.b, rng, out[i])
+        return out
+    k = len(dists)
+    if out is None :
+        out = numpy.empty((k, n))
+    elif out.shape[0] != k or out.shape[1] < n :
+        raise ValueError("out must have shape (%i, >= %i)" % (k, n))
+    else :
+        out = out[:, :n]
+    column = lambda name : numpy.array([float(getattr(dist, name)) for dist in dists])[:, None]
+    (a, alpha, beta) = (column('a'), column('alpha'), column('beta'))
+    width = column('b') - a
+    if _isGenerator(rng) and out.flags.c_contiguous and numpy.all((alpha >= 1.0) | (beta >= 1.0)) :
+        _ratioOfGammas(rng, alpha, beta, out, numpy.empty_like(out))
+    else :
+        out[:] = rng.beta(alpha, beta, size = (k, n))
+    out *= width
+    out += a
+    return out
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Vorberechnete Tabellen für standardisierte PERT-BETA-Verteilungen.
+
+alpha und beta aus L{betadist.alphaBetaFromAmB} hängen nur vom relativen
+Modalwert r = (m - a) / (b - a) ab; jede PERT-Schätzung ist also eine
+affine Transformation einer einparametrigen Familie auf [0, 1].  Die
+Tabelle speichert für ein Gitter von r-Werten die glatten Faktoren der
+CDF und beantwortet cdf/ppf-Anfragen durch Interpolation, ohne Integration
+und ohne Kettenbruch.
+
+Die Tabelle kann gespeichert und beim Start wieder geladen werden.  Sie
+ist optional: L{betadist.BetaDistribution} und L{betadist.beta_ppf}
+rechnen weiterhin mit der unvollständigen Betafunktion, deren Fehler
+bei 1e-15 statt 1e-9 liegt.
+"""
+
+#---
+#--- Python
+import json
+import math
+import threading
+
+#--- .
+from pertbeta import betadist
+
+#---
+SHAPE_ROWS = 128            # intervals of the relative mode grid
+SHAPE_KNOTS = 64            # intervals of [0, 1/2]
+SHAPE_PPF_KNOTS = 64        # intervals of the start values of ppf
+SHAPE_TABLE_VERSION = 1
+
+#---
+def pertAlphaBeta(r) :
+    """
+    alpha and beta of the PERT distribution with relative mode r,
+    same as L{betadist.alphaBetaFromAmB}(0.0, r, 1.0).
+
+    Doctests::
+        >>> pertAlphaBeta(0.5)
+        (4.0, 4.0)
+    """
+    second = 1.0 + 4.0 * r * (1.0 - r)
+    return (2.0 * (1.0 + 4.0 * r) / 3.0 * second,
+            2.0 * (5.0 - 4.0 * r) / 3.0 * second)
+
+def _logSmoothFactor(v, alpha, beta, lbeta) :
+    """
+    log P(v) and d log P / dv for P(v) = I_v(alpha, beta) / v**alpha;
+    P is analytic and positive on [0, 1/2], at v = 0 it follows from the
+    hypergeometric series.
+    """
+    if v <= 0.0 :
+        return (-lbeta - math.log(alpha), alpha * (1.0 - beta) / (alpha + 1.0))
+    F = betadist._betainc(v, alpha, beta, lbeta)
+    f = math.exp((alpha - 1.0) * math.log(v) + (beta - 1.0) * math.log1p(-v) - lbeta)
+    return (math.log(F) - alpha * math.log(v), f / F - alpha / v)
+
+def _lagrangeWeights(x) :
+    """
+    weights of the quintic through the nodes 0..5 at x
+
+    Doctests::
+        >>> ["%.4f" % w for w in _lagrangeWeights(2.5)]
+        ['0.0117', '-0.0977', '0.5859', '0.5859', '-0.0977', '0.0117']
+    """
+    d0 = x
+    d1 = x - 1.0
+    d2 = x - 2.0
+    d3 = x - 3.0
+    d4 = x - 4.0
+    d5 = x - 5.0
+    r45 = d4 * d5
+    r345 = d3 * r45
+    r2345 = d2 * r345
+    l01 = d0 * d1
+    l012 = l01 * d2
+    l0123 = l012 * d3
+    return (d1 * r2345 / -120.0, d0 * r2345 / 24.0, l01 * r345 / -12.0,
+            l012 * r45 / 12.0, l0123 * d5 / -24.0, l0123 * d4 / 120.0)
+
+
+#---
+class ShapeTable(object) :
+    """
+    For the grid r_j = j / rows the table holds log P_j(v) with
+    P_j(v) = I_v(alpha_j, beta_j) / v**alpha_j and its slope on knots of
+    [0, 1/2].  A query (r, u) takes the cubic Hermite interpolant in v on
+    the six rows around r, combines them with quintic Lagrange weights in
+    r and multiplies with u**alpha(r) again, so the CDF keeps its exact
+    behaviour at the bounds.  The upper half uses
+    1 - F(u) = (1 - u)**beta * P_{1-r}(1 - u), as alpha(1 - r) = beta(r).
+
+    L{maxError} is the largest absolute CDF error, measured while building
+    against L{betadist.betainc_regularized} at the midpoints between the
+    rows and knots, where interpolation errors are largest.
+
+    Doctests::
+        >>> table = ShapeTable.Build(rows = 64, knots = 32)
+        >>> table.maxError < 1e-8
+        True
+        >>> dist = betadist.BetaDistribution.FromAmB(3.0, 5.0, 12.0)
+        >>> abs(table.cdf(7.0, 3.0, 5.0, 12.0) - dist.cdf(7.0)) < 1e-8
+        True
+        >>> "%.6f" % table.ppf(0.8, 3.0, 5.0, 12.0), "%.6f" % dist.inv(0.8)
+        ('7.136005', '7.136005')
+    """
+
+    @classmethod
+    def Build(cls, rows = SHAPE_ROWS, knots = SHAPE_KNOTS, ppfKnots = SHAPE_PPF_KNOTS) :
+        if rows < 5 or knots < 1 or ppfKnots < 2 :
+            raise ValueError("rows >= 5, knots >= 1 and ppfKnots >= 2 required")
+        values = []
+        slopes = []
+        quantiles = []
+        step = 0.5 / knots
+        for j in xrange(rows + 1) :
+            r = float(j) / rows
+            (alpha, beta) = pertAlphaBeta(r)
+            lbeta = betadist.log_beta(alpha, beta)
+            for k in xrange(knots + 1) :
+                (logP, dlogP) = _logSmoothFactor(k * step, alpha, beta, lbeta)
+                values.append(logP)
+                slopes.append(dlogP * step)
+            confs = [float(k) / ppfKnots for k in xrange(1, ppfKnots)]
+            quantiles.extend(betadist.beta_ppf_batch(confs, alpha, beta, 0.0, 1.0))
+        table = cls(rows, knots, ppfKnots, values, slopes, quantiles)
+        table.maxError = table.measureError()
+        return table
+
+    @classmethod
+    def Load(cls, path) :
+        """
+        @raise ValueError: not a shape table of this version
+        @raise KeyError: a field is missing
+        """
+        with open(path, 'rb') as f :
+            data = json.load(f)
+        if not isinstance(data, dict) :
+            raise ValueError("%s: not a shape table" % (path,))
+        if data.get("version") != SHAPE_TABLE_VERSION :
+            raise ValueError("%s: shape table version %r, expected %r" % (path, data.get("version"), SHAPE_TABLE_VERSION))
+        return cls(data["rows"], data["knots"], data["ppfKnots"],
+                   data["values"], data["slopes"], data["quantiles"], data["maxError"])
+
+    def __init__(self, rows, knots, ppfKnots, values, slopes, quantiles, maxError = None) :
+        if len(values) != (rows + 1) * (knots + 1) or len(slopes) != len(values) \
+           or len(quantiles) != (rows + 1) * (ppfKnots - 1) :
+            raise ValueError("table size does not match rows, knots and ppfKnots")
+        self.rows = rows
+        self.knots = knots
+        self.ppfKnots = ppfKnots
+        self._values = values
+        self._slopes = slopes
+        self._quantiles = quantiles
+        self.maxError = maxError
+
+    def Save(self, path) :
+        data = {"version" : SHAPE_TABLE_VERSION,
+                "rows" : self.rows,
+                "knots" : self.knots,
+                "ppfKnots" : self.ppfKnots,
+                "maxError" : self.maxError,
+                "values" : self._values,
+                "slopes" : self._slopes,
+                "quantiles" : self._quantiles,
+                }
+        with open(path, 'wb') as f :
+            json.dump(data, f)
+
+    def _stencil(self, r) :
+        """first table index and Lagrange weights of the six rows around r"""
+        s = r * self.rows
+        j = min(max(int(s) - 2, 0), self.rows - 5)
+        return (j * (self.knots + 1), _lagrangeWeights(s - j))
+
+    def _smooth(self, stencil, v) :
+        """interpolated P_r(v) for v in [0, 1/2]"""
+        (i, (w0, w1, w2, w3, w4, w5)) = stencil
+        K = self.knots
+        y = v * 2 * K
+        k = min(int(y), K - 1)
+        t = y - k
+        i += k
+        K1 = K + 1
+        i1, i2, i3, i4, i5 = i + K1, i + 2 * K1, i + 3 * K1, i + 4 * K1, i + 5 * K1
+        V = self._values
+        D = self._slopes
+        p0 = w0 * V[i] + w1 * V[i1] + w2 * V[i2] + w3 * V[i3] + w4 * V[i4] + w5 * V[i5]
+        d0 = w0 * D[i] + w1 * D[i1] + w2 * D[i2] + w3 * D[i3] + w4 * D[i4] + w5 * D[i5]
+        i, i1, i2, i3, i4, i5 = i + 1, i1 + 1, i2 + 1, i3 + 1, i4 + 1, i5 + 1
+        p1 = w0 * V[i] + w1 * V[i1] + w2 * V[i2] + w3 * V[i3] + w4 * V[i4] + w5 * V[i5]
+        d1 = w0 * D[i] + w1 * D[i1] + w2 * D[i2] + w3 * D[i3] + w4 * D[i4] + w5 * D[i5]
+        t1 = 1.0 - t
+        return math.exp(t1 * t1 * ((1.0 + 2.0 * t) * p0 + t * d0) + t * t * ((3.0 - 2.0 * t) * p1 - t1 * d1))
+
+    def _cdf(self, u, alpha, beta, lower, upper) :
+        if u <= 0.5 :
+            return u ** alpha * self._smooth(lower, u)
+        return 1.0 - (1.0 - u) ** beta * self._smooth(upper, 1.0 - u)
+
+    def standardCdf(self, u, r) :
+        """CDF at u of the PERT distribution on [0, 1] with relative mode r"""
+        if u <= 0.0 :
+            return 0.0
+        if u >= 1.0 :
+            return 1.0
+        (alpha, beta) = pertAlphaBeta(r)
+        if u <= 0.5 :
+            return u ** alpha * self._smooth(self._stencil(r), u)
+        return 1.0 - (1.0 - u) ** beta * self._smooth(self._stencil(1.0 - r), 1.0 - u)
+
+    def standardPpf(self, conf, r, tol = betadist.QUANTILE_TOL, maxiter = betadist.QUANTILE_MAXITER) :
+        """
+        Root of L{standardCdf}(u, r) = conf, by Newton steps from a start
+        value interpolated between the stored quantiles.
+
+        Doctests::
+            >>> table = ShapeTable.Build(rows = 16, knots = 8)
+            >>> 0.0 < table.standardPpf(0.3, 0.2, maxiter = 1) < 1.0
+            True
+
+        @param tol: absolute tolerance for u
+        @param maxiter: iteration cap; the best bracketed estimate is
+            returned when it is reached, as in L{betadist.beta_ppf}
+        """
+        if conf < 0 or conf > 1 :
+            raise ValueError("conf outside support [0,1]")
+        if conf <= 0.0 :
+            return 0.0
+        if conf >= 1.0 :
+            return 1.0
+        (alpha, beta) = pertAlphaBeta(r)
+        lbeta = betadist.LOG_BETA_CACHED(alpha, beta)
+        # start value: linear in conf and r between the stored quantiles
+        n = self.ppfKnots
+        s = r * self.rows
+        j = min(int(s), self.rows - 1)
+        x = s - j
+        y = conf * n
+        k = min(max(int(y), 1), n - 2)
+        t = y - k
+        Q = self._quantiles
+        i = j * (n - 1) + k - 1
+        lower = (1.0 - t) * Q[i] + t * Q[i + 1]
+        upper = (1.0 - t) * Q[i + n - 1] + t * Q[i + n]
+        u = min(max((1.0 - x) * lower + x * upper, tol), 1.0 - tol)
+        lower = self._stencil(r)
+        upper = self._stencil(1.0 - r)
+        lo, hi = 0.0, 1.0
+        for it in xrange(maxiter) :
+            F = self._cdf(u, alpha, beta, lower, upper) - conf
+            if F < 0.0 :
+                lo = u
+            else :
+                hi = u
+            f = math.exp((alpha - 1.0) * math.log(u) + (beta - 1.0) * math.log1p(-u) - lbeta)
+            un = u - F / f
+            if not lo < un < hi :
+                un = 0.5 * (lo + hi)
+            if abs(un - u) <= tol or hi - lo <= tol :
+                return un
+            u = un
+        return u
+
+    def cdf(self, x, a, m, b) :
+        """CDF at x of the PERT distribution L{BetaDistribution.FromAmB}(a, m, b)"""
+        width = float(b - a)
+        return self.standardCdf((x - a) / width, (m - a) / width)
+
+    def ppf(self, conf, a, m, b, tol = betadist.QUANTILE_TOL) :
+        """
+        @param tol: absolute tolerance for x (in units of [a, b])
+        """
+        width = float(b - a)
+        return a + width * self.standardPpf(conf, (m - a) / width, tol = tol / width)
+
+    def measureError(self) :
+        """largest absolute CDF error at the midpoints between rows and knots"""
+        worst = 0.0
+        points = [(k + 0.5) / (2 * self.knots) for k in xrange(2 * self.knots)]
+        for j in xrange(self.rows) :
+            r = (j + 0.5) / self.rows
+            (alpha, beta) = pertAlphaBeta(r)
+            for u in points :
+                exact = betadist.betainc_regularized(u, alpha, beta)
+                worst = max(worst, abs(self.standardCdf(u, r) - exact))
+        return worst
+
+
+#---
+_defaultTable = None
+_defaultLock = threading.Lock()
+
+def getShapeTable(path = None) :
+    """
+    The shared table: loaded from path if that file exists and is valid,
+    else built (about a second) and saved to path if given.
+
+    @rtype: C{ShapeTable}
+    """
+    global _defaultTable
+    with _defaultLock :
+        if _defaultTable is None :
+            try :
+                _defaultTable = ShapeTable.Load(path) if path else None
+            except (IOError, KeyError, ValueError) :
+                _defaultTable = None
+            if _defaultTable is None :
+                _defaultTable = ShapeTable.Build()
+                if path :
+                    _defaultTable.Save(path)
+        return _defaultTable
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Monte-Carlo-Simulation der Gesamtdauer mehrerer unabhängiger
+BETA-verteilter Schätzungen (z.B. aller Zeilen eines MultiEstimate).
+
+Mit NumPy wird stapelweise gezogen, ohne NumPy mit dem Modul random
+(beides über L{sampling.sampleBeta}).  L{simulateSummary} hält statt
+aller Summen nur Momente und eine Quantilskizze (L{streamstats}).
+"""
+
+#---
+#--- Python
+import bisect
+import math
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#--- .
+from pertbeta import sampling
+from pertbeta import streamstats
+
+#---
+SIMULATION_SAMPLES = 100000
+SIMULATION_BATCH = 65536     # samples per batch
+
+#---
+def normalQuantile(p) :
+    """
+    Inverse of the standard normal CDF, by bisection on math.erf.
+
+    Doctests::
+        >>> "%.4f" % normalQuantile(0.975)
+        '1.9600'
+    """
+    if not 0.0 < p < 1.0 :
+        raise ValueError("p outside (0,1)")
+    lo, hi = -40.0, 40.0
+    for i in xrange(100) :
+        mid = 0.5 * (lo + hi)
+        if 0.5 * (1.0 + math.erf(mid / math.sqrt(2.0))) < p :
+            lo = mid
+        else :
+            hi = mid
+    return 0.5 * (lo + hi)
+
+def _columns(dists) :
+    dists = list(dists)
+    a = [float(dist.a) for dist in dists]
+    width = [float(dist.b - dist.a) for dist in dists]
+    alpha = [float(dist.alpha) for dist in dists]
+    beta = [float(dist.beta) for dist in dists]
+    return a, width, alpha, beta
+
+makeRng = sampling.makeRng
+
+def _iterBatchesNumpy(dists, N, seed, batchSize) :
+    a, width, alpha, beta = _columns(dists)
+    rng = sampling.asRng(seed)
+    offset = math.fsum(a)
+    samples = numpy.empty(min(batchSize, N))
+    scratch = numpy.empty(len(samples))
+    done = 0
+    while done < N :
+        n = min(batchSize, N - done)
+        totals = numpy.empty(n)
+        totals.fill(offset)
+        for i in xrange(len(a)) :
+            totals += sampling.sampleBeta(n, alpha[i], beta[i], 0.0, width[i], rng, samples, scratch)
+        yield totals
+        done += n
+
+def _iterBatchesPython(dists, N, seed, batchSize) :
+    a, width, alpha, beta = _columns(dists)
+    rng = sampling.asRng(seed)
+    offset = math.fsum(a)
+    samples = [0.0] * min(batchSize, N)
+    done = 0
+    while done < N :
+        n = min(batchSize, N - done)
+        totals = [offset] * n
+        for i in xrange(len(a)) :
+            sampling.sampleBeta(n, alpha[i], beta[i], 0.0, width[i], rng, samples)
+            for j in xrange(n) :
+                totals[j] += samples[j]
+        yield totals
+        done += n
+
+def iterTotalBatches(dists, N = SIMULATION_SAMPLES, seed = None, batchSize = SIMULATION_BATCH) :
+    """
+    Batches of joint samples of the total sum(dist) over all dists,
+    reproducible for a given seed, N and batchSize.
+
+    @param seed: int, None or a generator from L{sampling.makeRng}
+
+    @rtype: iterator of C{numpy.ndarray} (or C{[float]} without NumPy)
+    """
+    if numpy is not None :
+        return _iterBatchesNumpy(dists, N, seed, batchSize)
+    return _iterBatchesPython(dists, N, seed, batchSize)
+
+def iterSampleBatches(dists, N = SIMULATION_SAMPLES, seed = None, batchSize = SIMULATION_BATCH) :
+    """
+    Like L{iterTotalBatches}, with the same draws, but batches are
+    n x len(dists) matrices of each estimate's samples.  Requires NumPy.
+
+    @rtype: iterator of C{numpy.ndarray}
+    """
+    if numpy is None :
+        raise ImportError("iterSampleBatches requires numpy")
+    a, width, alpha, beta = _columns(dists)
+    rng = sampling.asRng(seed)
+    done = 0
+    while done < N :
+        n = min(batchSize, N - done)
+        matrix = numpy.empty((n, len(a)))
+        for i in xrange(len(a)) :
+            matrix[:, i] = sampling.sampleBeta(n, alpha[i], beta[i], 0.0, width[i], rng)
+            matrix[:, i] += a[i]
+        yield matrix
+        done += n
+
+def simulateTotals(dists, N = SIMULATION_SAMPLES, seed = None, batchSize = SIMULATION_BATCH) :
+    """
+    Doctests::
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0) for i in xrange(10)]
+        >>> result = simulateTotals(dists, N = 20000, seed = 1)
+        >>> abs(result.mean() - sum(dist.mean() for dist in dists)) < 0.2
+        True
+
+    @rtype: C{SimulationResult}
+    """
+    batches = list(iterTotalBatches(dists, N, seed, batchSize))
+    if numpy is not None :
+        totals = numpy.concatenate(batches) if batches else numpy.zeros(0)
+    else :
+        totals = [t for batch in batches for t in batch]
+    return SimulationResult(totals)
+
+def simulateSummary(dists, N = SIMULATION_SAMPLES, seed = None, batchSize = SIMULATION_BATCH,
+                    k = streamstats.SKETCH_K) :
+    """
+    Like L{simulateTotals}, but in constant memory: each batch only
+    updates the moments and the quantile sketch.
+
+    Doctests::
+        >>> from pertbeta.betadist import BetaDistribution
+        >>> dists = [BetaDistribution.FromAmB(2.0, 4.0, 9.0) for i in xrange(10)]
+        >>> exact = simulateTotals(dists, N = 20000, seed = 1)
+        >>> summary = simulateSummary(dists, N = 20000, seed = 1)
+        >>> abs(summary.mean() - exact.mean()) < 1e-9, abs(summary.sigma() - exact.sigma()) < 1e-9
+        (True, True)
+        >>> abs(summary.percentile(0.8)[0] - exact.percentile(0.8)[0]) < 0.1
+        True
+
+    @rtype: C{SketchResult}
+    """
+    (moments, sketch) = streamstats.summarize(iterTotalBatches(dists, N, seed, batchSize), k, seed)
+    return SketchResult(moments, sketch)
+
+
+#---
+class SimulationResult(object) :
+    """Sorted sample of simulated totals with summary statistics"""
+
+    def __init__(self, totals) :
+        if numpy is not None :
+            self._totals = numpy.sort(numpy.asarray(totals, dtype = float))
+        else :
+            self._totals = sorted(totals)
+        self.N = len(self._totals)
+        if not self.N :
+            raise ValueError("empty simulation")
+        if numpy is not None :
+            self._mean = float(self._totals.mean())
+            self._var = float(self._totals.var())
+        else :
+            self._mean = math.fsum(self._totals) / self.N
+            self._var = math.fsum([(t - self._mean) ** 2 for t in self._totals]) / self.N
+
+    def totals(self) :
+        """sorted totals"""
+        return self._totals
+
+    def mean(self) :
+        return self._mean
+
+    def sigma(self) :
+        return math.sqrt(self._var)
+
+    def meanInterval(self, confidence = 0.95) :
+        """@rtype: C{(float, float)}"""
+        z = normalQuantile(0.5 + 0.5 * confidence)
+        half = z * self.sigma() / math.sqrt(self.N)
+        return (self._mean - half, self._mean + half)
+
+    def _at(self, rank) :
+        """linear interpolation between order statistics, rank in [0, N-1]"""
+        rank = min(max(rank, 0.0), self.N - 1.0)
+        i = int(math.floor(rank))
+        j = min(i + 1, self.N - 1)
+        frac = rank - i
+        return float(self._totals[i]) * (1.0 - frac) + float(self._totals[j]) * frac
+
+    def percentile(self, q, confidence = 0.95) :
+        """
+        q-quantile of the total with a distribution-free confidence
+        interval from the binomial distribution of the order statistics.
+
+        @param q: probability in [0, 1]
+        @rtype: C{(float, float, float)} value, lower and upper bound
+        """
+        if q < 0 or q > 1 :
+            raise ValueError("q outside support [0,1]")
+        N = self.N
+        rank = q * (N - 1)
+        z = normalQuantile(0.5 + 0.5 * confidence)
+        spread = z * math.sqrt(N * q * (1.0 - q))
+        return (self._at(rank),
+                self._at(math.floor(rank - spread)),
+                self._at(math.ceil(rank + spread)))
+
+    def probability(self, deadline, confidence = 0.95) :
+        """
+        P(total <= deadline) with a Wilson score interval.
+
+        @rtype: C{(float, float, float)} value, lower and upper bound
+        """
+        if numpy is not None :
+            count = int(numpy.searchsorted(self._totals, deadline, side = 'right'))
+        else :
+            count = bisect.bisect_right(self._totals, deadline)
+        N = float(self.N)
+        p = count / N
+        z = normalQuantile(0.5 + 0.5 * confidence)
+        denom = 1.0 + z * z / N
+        center = (p + z * z / (2 * N)) / denom
+        half = z * math.sqrt(p * (1.0 - p) / N + z * z / (4 * N * N)) / denom
+        return (p, max(0.0, center - half), min(1.0, center + half))
+
+    def iterLines(self, percentiles = (0.5, 0.8, 0.95), deadline = None, confidence = 0.95) :
+        N = self.N
+        mean = self.mean()
+        sigma = self.sigma()
+        conf = 100.0 * confidence
+        yield "SIMULATION (N = %(N)i, %(conf).0f%% confidence intervals)" % locals()
+        yield "mean = %(mean).1f sigma = %(sigma).1f" % locals()
+        for q in percentiles :
+            (value, lo, hi) = self.percentile(q, confidence)
+            qPercent = 100.0 * q
+            yield "q%(qPercent)02.0f = %(value).1f [%(lo).1f, %(hi).1f]" % locals()
+        if deadline is not None :
+            (p, lo, hi) = self.probability(deadline, confidence)
+            yield "P(total <= %.1f) = %.3f [%.3f, %.3f]" % (deadline, p, lo, hi)
+
+
+class SketchResult(SimulationResult) :
+    """
+    Summary of simulated totals from L{streamstats.Moments} and a
+    L{streamstats.QuantileSketch}; the intervals include the rank error
+    of the sketch.  Results of parallel runs combine with L{merge}.
+    """
+
+    def __init__(self, moments, sketch) :
+        if not moments.count :
+            raise ValueError("empty simulation")
+        self.moments = moments
+        self.sketch = sketch
+        self._update()
+
+    def _update(self) :
+        self.N = self.moments.count
+        self._mean = self.moments.mean()
+        self._var = self.moments.variance()
+
+    def merge(self, other) :
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self._update()
+
+    def totals(self) :
+        raise ValueError("a sketch keeps no totals, use simulateTotals")
+
+    def percentile(self, q, confidence = 0.95) :
+        if q < 0 or q > 1 :
+            raise ValueError("q outside support [0,1]")
+        N = self.N
+        z = normalQuantile(0.5 + 0.5 * confidence)
+        spread = z * math.sqrt(q * (1.0 - q) / N) + self.sketch.normalizedRankError()
+        return (self.sketch.quantile(q),
+                self.sketch.quantile(max(0.0, q - spread)),
+                self.sketch.quantile(min(1.0, q + spread)))
+
+    def probability(self, deadline, confidence = 0.95) :
+        """P(total <= deadline), Wilson interval widened by the sketch error"""
+        N = float(self.N)
+        p = self.sketch.rank(deadline)
+        z = normalQuantile(0.5 + 0.5 * confidence)
+        denom = 1.0 + z * z / N
+        center = (p + z * z / (2 * N)) / denom
+        half = z * math.sqrt(p * (1.0 - p) / N + z * z / (4 * N * N)) / denom + self.sketch.normalizedRankError()
+        return (p, max(0.0, center - half), min(1.0, center + half))
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Kennzahlen großer Stichproben in einem Durchlauf und mit konstantem
+Speicher: Momente nach Welford/Pébay (Mittelwert, Varianz, Schiefe,
+Wölbung) und eine KLL-Quantilskizze mit beschränktem Rangfehler.
+
+Beide nehmen einzelne Werte oder ganze Blöcke (Listen, NumPy-Arrays)
+entgegen und lassen sich zusammenführen, z.B. die Ergebnisse mehrerer
+Prozesse; L{Moments.toDict} und L{QuantileSketch.toDict} liefern dazu
+eine JSON-taugliche Form.
+"""
+
+#---
+#--- Python
+import bisect
+import math
+import random
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+#---
+SKETCH_K = 1000            # capacity of the top compactor
+SKETCH_C = 2.0 / 3.0       # capacity ratio between neighbouring compactors
+
+#---
+class Moments(object) :
+    """
+    Count, mean and central moments up to order four, updated value by
+    value (Welford) or block by block (Pébay's pairwise formulas).
+
+    Doctests::
+        >>> values = [3.0, 5.0, 4.0, 9.0, 12.0, 7.5]
+        >>> one = Moments()
+        >>> for v in values :
+        ...     one.add(v)
+        >>> left = Moments(); left.update(values[:2])
+        >>> right = Moments(); right.update(values[2:])
+        >>> left.merge(right)
+        >>> ["%.6f" % x for x in (one.mean(), one.variance(), one.skewness(), one.kurtosis())]
+        ['6.750000', '9.645833', '0.431858', '-1.119201']
+        >>> ["%.6f" % x for x in (left.mean(), left.variance(), left.skewness(), left.kurtosis())]
+        ['6.750000', '9.645833', '0.431858', '-1.119201']
+        >>> Moments.FromDict(left.toDict()).toDict() == left.toDict()
+        True
+    """
+
+    def __init__(self) :
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0           # sums of powers of deviations from the mean
+        self._m3 = 0.0
+        self._m4 = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def FromDict(cls, data) :
+        """inverse of L{toDict}"""
+        moments = cls()
+        moments.count = int(data["count"])
+        (moments._mean, moments._m2, moments._m3, moments._m4) = [float(data[name]) for name in ("mean", "m2", "m3", "m4")]
+        (moments.min, moments.max) = (data["min"], data["max"])
+        return moments
+
+    def toDict(self) :
+        return {"count" : self.count, "mean" : self._mean,
+                "m2" : self._m2, "m3" : self._m3, "m4" : self._m4,
+                "min" : self.min, "max" : self.max}
+
+    def add(self, x) :
+        x = float(x)
+        n1 = self.count
+        n = self.count = n1 + 1
+        delta = x - self._mean
+        deltaN = delta / n
+        deltaN2 = deltaN * deltaN
+        term1 = delta * deltaN * n1
+        self._mean += deltaN
+        self._m4 += term1 * deltaN2 * (n * n - 3 * n + 3) + 6.0 * deltaN2 * self._m2 - 4.0 * deltaN * self._m3
+        self._m3 += term1 * deltaN * (n - 2) - 3.0 * deltaN * self._m2
+        self._m2 += term1
+        if n1 == 0 :
+            self.min = self.max = x
+        elif x < self.min :
+            self.min = x
+        elif x > self.max :
+            self.max = x
+
+    def update(self, values) :
+        """adds a block of values; with NumPy a block costs a few array passes"""
+        if numpy is None :
+            for x in values :
+                self.add(x)
+            return
+        x = numpy.asarray(values, dtype = float).ravel()
+        if not len(x) :
+            return
+        block = Moments()
+        block.count = len(x)
+        block._mean = float(x.mean())
+        d = x - block._mean
+        d2 = d * d
+        block._m2 = float(d2.sum())
+        block._m3 = float(numpy.dot(d2, d))
+        block._m4 = float(numpy.dot(d2, d2))
+        block.min = float(x.min())
+        block.max = float(x.max())
+        self.merge(block)
+
+    def merge(self, other) :
+        """adds the values of another accumulator"""
+        if not other.count :
+            return
+        if not self.count :
+            (self.count, self._mean, self._m2, self._m3, self._m4, self.min, self.max) = \
+                (other.count, other._mean, other._m2, other._m3, other._m4, other.min, other.max)
+            return
+        na = float(self.count)
+        nb = float(other.count)
+        n = na + nb
+        delta = other._mean - self._mean
+        delta2 = delta * delta
+        (m2a, m3a) = (self._m2, self._m3)
+        (m2b, m3b) = (other._m2, other._m3)
+        self._m4 += (other._m4 + delta2 * delta2 * na * nb * (na * na - na * nb + nb * nb) / (n * n * n)
+                     + 6.0 * delta2 * (na * na * m2b + nb * nb * m2a) / (n * n)
+                     + 4.0 * delta * (na * m3b - nb * m3a) / n)
+        self._m3 += (m3b + delta2 * delta * na * nb * (na - nb) / (n * n)
+                     + 3.0 * delta * (na * m2b - nb * m2a) / n)
+        self._m2 += m2b + delta2 * na * nb / n
+        self._mean += delta * nb / n
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self) :
+        return self._mean
+
+    def variance(self, ddof = 0) :
+        """population variance; ddof = 1 for the sample variance"""
+        if self.count <= ddof :
+            return 0.0
+        return self._m2 / (self.count - ddof)
+
+    def sigma(self, ddof = 0) :
+        return math.sqrt(self.variance(ddof))
+
+    def skewness(self) :
+        if self._m2 <= 0.0 :
+            return 0.0
+        return math.sqrt(self.count) * self._m3 / self._m2 ** 1.5
+
+    def kurtosis(self) :
+        """excess kurtosis, 0 for the normal distribution"""
+        if self._m2 <= 0.0 :
+            return 0.0
+        return self.count * self._m4 / (self._m2 * self._m2) - 3.0
+
+
+#---
+def _empty() :
+    if numpy is not None :
+        return numpy.zeros(0)
+    return []
+
+def _concat(first, second) :
+    if numpy is not None :
+        return numpy.concatenate((first, second))
+    return list(first) + list(second)
+
+class QuantileSketch(object) :
+    """
+    KLL sketch (Karnin, Lang, Liberty 2016): a stack of compactors, level h
+    holds values of weight 2**h.  A full level is sorted and every other
+    value, starting at a random offset, moves up with twice the weight.
+
+    The memory stays below about 3k values; ranks are exact up to
+    L{normalizedRankError} times the count, with about 99% probability.
+
+    Doctests::
+        >>> rng = random.Random(5)
+        >>> left = QuantileSketch(seed = 1); right = QuantileSketch(seed = 2)
+        >>> for i in xrange(30000) :
+        ...     left.add(rng.random())
+        >>> right.update([rng.random() for i in xrange(30000)])
+        >>> left.merge(right)
+        >>> left.count, left.size() < 3 * left.k
+        (60000, True)
+        >>> [abs(left.quantile(q) - q) < left.normalizedRankError() for q in (0.05, 0.5, 0.95)]
+        [True, True, True]
+        >>> abs(left.rank(0.25) - 0.25) < left.normalizedRankError()
+        True
+        >>> QuantileSketch.FromDict(left.toDict()).quantile(0.5) == left.quantile(0.5)
+        True
+    """
+
+    def __init__(self, k = SKETCH_K, seed = None) :
+        if k < 8 :
+            raise ValueError("k must be at least 8")
+        self.k = k
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._levels = [_empty()]
+        self._pending = []               # single values from add
+        self._random = random.Random(seed)
+        self._view = None                # sorted (values, cumulative weights)
+
+    @classmethod
+    def FromDict(cls, data, seed = None) :
+        """inverse of L{toDict}"""
+        sketch = cls(int(data["k"]), seed)
+        sketch.count = int(data["count"])
+        (sketch.min, sketch.max) = (data["min"], data["max"])
+        sketch._levels = [_concat(_empty(), level) for level in data["levels"]]
+        return sketch
+
+    def toDict(self) :
+        self._flush()
+        return {"k" : self.k, "count" : self.count, "min" : self.min, "max" : self.max,
+                "levels" : [[float(v) for v in level] for level in self._levels]}
+
+    def normalizedRankError(self) :
+        """rank error bound as a fraction of count (empirical KLL fit)"""
+        return 2.296 / self.k ** 0.9723
+
+    def size(self) :
+        """number of values retained"""
+        return sum(len(level) for level in self._levels) + len(self._pending)
+
+    def _capacity(self, level) :
+        depth = len(self._levels) - level - 1
+        return max(int(math.ceil(self.k * SKETCH_C ** depth)), 2)
+
+    def add(self, x) :
+        self._pending.append(float(x))
+        if len(self._pending) >= self.k :
+            self._flush()
+
+    def _flush(self) :
+        if self._pending :
+            (pending, self._pending) = (self._pending, [])
+            self.update(pending)
+
+    def update(self, values) :
+        """adds a block of values"""
+        if numpy is not None :
+            block = numpy.asarray(values, dtype = float).ravel()
+            if not len(block) :
+                return
+            (low, high) = (float(block.min()), float(block.max()))
+        else :
+            block = [float(v) for v in values]
+            if not block :
+                return
+            (low, high) = (min(block), max(block))
+        if self.count == 0 :
+            (self.min, self.max) = (low, high)
+        else :
+            (self.min, self.max) = (min(self.min, low), max(self.max, high))
+        self.count += len(block)
+        self._levels[0] = _concat(self._levels[0], block)
+        self._compress()
+
+    def merge(self, other) :
+        """adds the values of another sketch with the same k"""
+        if other.k != self.k :
+            raise ValueError("cannot merge sketches with k = %i and k = %i" % (self.k, other.k))
+        self._flush()
+        other._flush()
+        if not other.count :
+            return
+        if self.count == 0 :
+            (self.min, self.max) = (other.min, other.max)
+        else :
+            (self.min, self.max) = (min(self.min, other.min), max(self.max, other.max))
+        self.count += other.count
+        for (h, level) in enumerate(other._levels) :
+            if h == len(self._levels) :
+                self._levels.append(_empty())
+            self._levels[h] = _concat(self._levels[h], level)
+        self._compress()
+
+    def _compress(self) :
+        self._view = None
+        h = 0
+        while h < len(self._levels) :
+            level = self._levels[h]
+            if len(level) <= self._capacity(h) :
+                h += 1
+                continue
+            if h + 1 == len(self._levels) :
+                self._levels.append(_empty())
+            if numpy is not None :
+                level = numpy.sort(level)
+            else :
+                level = sorted(level)
+            keep = len(level) % 2       # an odd value stays on this level
+            offset = self._random.randint(0, 1)
+            self._levels[h + 1] = _concat(self._levels[h + 1], level[offset:len(level) - keep:2])
+            self._levels[h] = _concat(_empty(), level[len(level) - keep:])
+            # a new top level lowers the capacities below, so start over
+            h = 0
+
+    def _sortedView(self) :
+        self._flush()
+        if self._view is None :
+            if numpy is not None :
+                values = numpy.concatenate(self._levels)
+                weights = numpy.concatenate([numpy.repeat(float(2 ** h), len(level)) for (h, level) in enumerate(self._levels)])
+                order = numpy.argsort(values, kind = 'mergesort')
+                self._view = (values[order], numpy.cumsum(weights[order]))
+            else :
+                pairs = sorted((v, 2 ** h) for (h, level) in enumerate(self._levels) for v in level)
+                cumulative = []
+                total = 0
+                for (v, w) in pairs :
+                    total += w
+                    cumulative.append(total)
+                self._view = ([v for (v, w) in pairs], cumulative)
+        return self._view
+
+    def rank(self, x) :
+        """estimated fraction of values <= x"""
+        if not self.count :
+            raise ValueError("empty sketch")
+        (values, cumulative) = self._sortedView()
+        i = bisect.bisect_right(values, x)
+        if i == 0 :
+            return 0.0
+        return float(cumulative[i - 1]) / self.count
+
+    def quantile(self, q) :
+        """
+        @param q: probability in [0, 1]
+        @rtype: C{float} a retained value whose estimated rank is about q
+        """
+        if q < 0 or q > 1 :
+            raise ValueError("q outside support [0,1]")
+        if not self.count :
+            raise ValueError("empty sketch")
+        if q == 0 :
+            return self.min
+        if q == 1 :
+            return self.max
+        (values, cumulative) = self._sortedView()
+        i = bisect.bisect_left(cumulative, q * self.count)
+        return float(values[min(i, len(values) - 1)])
+
+
+#---
+def summarize(chunks, k = SKETCH_K, seed = None) :
+    """
+    Moments and quantile sketch of all values in an iterator of blocks,
+    e.g. the batches of L{simulation.iterTotalBatches}.
+
+    @rtype: C{(Moments, QuantileSketch)}
+    """
+    moments = Moments()
+    sketch = QuantileSketch(k, seed)
+    for chunk in chunks :
+        moments.update(chunk)
+        sketch.update(chunk)
+    return (moments, sketch)